@@ -9,70 +9,308 @@ This is the flap module for W7-X camera diagnostic
 """
 
 import os.path
-import fnmatch
+import atexit
+import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import hashlib
+import json
+import logging
+import threading
+import time
 import numpy as np
-import copy
 import h5py
 import pylab as plt
 import scipy.io as io
 
 import flap
 
+logger = logging.getLogger(__name__)
+
+
+class _MetadataCache:
+    """
+    Thread-safe LRU cache of the metadata parsed from the files (time vectors,
+    settings, store descriptions, calibrations), it keeps the last max_items
+    entries. The values are shared by the callers, they should not be modified.
+    The value is computed outside the lock, threads missing the same key at the
+    same time compute it more than once.
+    """
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._items = collections.OrderedDict()
+
+    def get(self, key):
+        """
+        Returns the value of a key or None if it is not in the cache.
+        """
+        with self._lock:
+            value = self._items.get(key)
+            if (value is not None):
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """
+        Adds a value to the cache, the least recently used values are dropped
+        above max_items. Returns the value.
+        """
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while (len(self._items) > self.max_items):
+                self._items.popitem(last=False)
+        return value
+
+    def keys(self):
+        with self._lock:
+            return list(self._items.keys())
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+
+# Settings groups read when a file is parsed, the others are read at their first use
+EAGER_SETTINGS = ['Clock', 'Exposure Settings', 'ROIP']
+
+_settings_lock = threading.RLock()
+
+
+def _h5_value(dataset):
+    """
+    Returns the value of a settings dataset as a Python value: one element
+    arrays become scalars, longer ones lists, byte strings are decoded.
+    """
+    value = dataset[()]
+    if (isinstance(value, np.ndarray)):
+        if (value.size != 1):
+            if (value.dtype.kind == 'S'):
+                return [v.decode('utf-8', errors='replace') for v in value.ravel()]
+            return value.tolist()
+        value = value.reshape(-1)[0]
+    if (isinstance(value, bytes)):
+        return value.decode('utf-8', errors='replace')
+    if (isinstance(value, np.generic)):
+        return value.item()
+    return value
+
+
+def _h5_settings(obj):
+    """
+    Returns an HDF5 settings group as a dictionary of Python values or the
+    value of a dataset.
+    """
+    if (isinstance(obj, h5py.Group)):
+        return {name: _h5_settings(item) for name, item in obj.items()}
+    return _h5_value(obj)
+
+
+class CameraSettings(collections.abc.Mapping):
+    """
+    The settings of a camera recording as a read only mapping of plain Python
+    values (numbers, strings, lists and dictionaries). It can be pickled and
+    sent to worker processes, dict(settings) can be written to JSON.
+    The values given at creation are kept, the Settings groups named in lazy
+    are read from the file at their first access.
+    """
+
+    def __init__(self, path, values, lazy=()):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        self._values = dict(values)
+        self._lazy = [name for name in lazy if name not in self._values]
+
+    def __getitem__(self, key):
+        if (key not in self._values):
+            if (key not in self._lazy):
+                raise KeyError(key)
+            with _settings_lock:
+                if (key not in self._values):
+                    if (os.stat(self.path).st_mtime_ns != self.mtime):
+                        raise IOError("{:s} was changed since its settings were read.".format(self.path))
+                    with _file_pool.file(self.path) as h5_obj:
+                        self._values[key] = _h5_settings(h5_obj['Settings'][key])
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(list(self._values) + [name for name in self._lazy if name not in self._values])
+
+    def __len__(self):
+        return len(set(self._values) | set(self._lazy))
+
+    def __repr__(self):
+        return "CameraSettings({!r}, read: {}, lazy: {})".format(
+               self.path, list(self._values), [name for name in self._lazy if name not in self._values])
 
 
 def get_camera_config_h5(h5_obj, roi_num):
     """
-    This function parses the Settings field of the HDF5 file (if available)
-    and counts the ROIPs with data. This latter will determine
-    the channel names.
+    This function parses the Settings field of the HDF5 file of an EDICAM
+    recording. The ROI geometry of roi_num (X Start, X Len, Y Start, Y Len),
+    the ROIP, Clock and Exposure Settings groups are read, the other groups
+    (Event, Sensor Settings, ...) only when they are used.
+    Returns a CameraSettings.
     """
-    info = dict()
-    # Get the actual data
-    # print(list(h5_obj.keys()))
-    # print(list(h5_obj['Settings'].keys()))
+    settings = h5_obj['Settings']
+    values = {}
+    for name in EAGER_SETTINGS:
+        if (name in settings):
+            values[name] = _h5_settings(settings[name])
+    roi = values['ROIP'][roi_num]
+    for key in ['X Start', 'X Len', 'Y Start', 'Y Len']:
+        values[key] = roi[key]
     # TODO: integrate events!
-    # TODO: finish the config read!
-    info['Clock'] = dict()
-    info['Clock']['Auto int'] = np.array(h5_obj['Settings']['Clock']['Auto int'])[0]
-    info['Clock']['Clk pol'] = np.array(h5_obj['Settings']['Clock']['Clk pol'])[0]
-    info['Clock']['Enable'] = np.array(h5_obj['Settings']['Clock']['Enable'])[0]
-    info['Clock']['PLL div'] = np.array(h5_obj['Settings']['Clock']['PLL div'])
-    info['Clock']['PLL mult'] = np.array(h5_obj['Settings']['Clock']['PLL mult'])
-    info['Clock']['Quality'] = np.array(h5_obj['Settings']['Clock']['Quality'])
-    info['Event'] = dict()
-    info['Event']['Event1'] = h5_obj['Settings']['Event']['Event1']['Action1'].keys()
-    print(list(h5_obj['Settings']['Event']['Event1'].keys()))
-    print(list(h5_obj['Settings']['Event']))
-    print(list(h5_obj['Settings']['Event'].keys()))
-    print(info['Event']['Event1'])
-    info['Exposure Settings'] = h5_obj['Settings']['Exposure Settings']
-    info['Image Processing Settings'] = h5_obj['Settings']['Image Processing Settings']
-    info['ROIP'] = h5_obj['Settings']['ROIP']
-    info['Sensor Control'] = h5_obj['Settings']['Sensor Control']
-    info['Sensor Settings'] = h5_obj['Settings']['Sensor Settings']
-    info['X Start'] = h5_obj['Settings']['ROIP'][roi_num]['X Start'][0]
-    info['X Len'] = h5_obj['Settings']['ROIP'][roi_num]['X Len'][0]
-    info['Y Start'] = h5_obj['Settings']['ROIP'][roi_num]['Y Start'][0]
-    info['Y Len'] = h5_obj['Settings']['ROIP'][roi_num]['Y Len'][0]
-
-    print("-------------------------")
-    print(info)
-    return info
-
-
-def get_camera_config_ascii(path):
-    """
-    This function parses an ASCII file containing the settings of and
-    EDICAM or a Photron camera recording.
-    """
-    info = dict()
-    print("In get_camera_config_ascii.")
-    # Get the actual settings
-    # TODO: implement this!
-    return info
-
-
-def read_hdf5_arr(h5_data, x, y, frame_vec):
+    return CameraSettings(h5_obj.filename, values, lazy=list(settings.keys()))
+
+
+def get_camera_config_ascii(path, roi_num=None):
+    """
+    Returns the settings of a camera recording from its ASCII settings file.
+    The format of these files is not documented and no sample is available,
+    so reading them is not supported: the returned CameraSettings is empty.
+    """
+    logger.warning("The ASCII camera settings files are not supported, no settings for %s.", path)
+    return CameraSettings(path, {})
+
+
+# Parsed camera settings: {(path, mtime, size, ROI, camera): CameraSettings}
+SETTINGS_CACHE_SIZE = 256
+_camera_settings_cache = _MetadataCache(SETTINGS_CACHE_SIZE)
+
+
+def read_camera_settings(path, roi_num, camera='EDICAM'):
+    """
+    Returns the settings of a camera recording (see CameraSettings), the file
+    is parsed once and the result is cached by path, modification time and size.
+    EDICAM: get_camera_config_h5(), if it fails the settings are empty
+            (the ASCII settings files are not supported, see get_camera_config_ascii()).
+    PHOTRON: X Start and Y Start from the X pos and Y pos settings.
+    The CameraSettings is shared by the callers, it should not be modified.
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size, roi_num, camera)
+    settings = _camera_settings_cache.get(key)
+    if (settings is not None):
+        return settings
+    if (camera == 'PHOTRON'):
+        with _file_pool.file(path) as h5_obj:
+            try:
+                values = {'X Start': _h5_value(h5_obj['Settings']['X pos']),
+                          'Y Start': _h5_value(h5_obj['Settings']['Y pos'])}
+            except Exception:
+                raise IOError("Could not find ROI x and y position in HDF5 file.")
+            settings = CameraSettings(path, values, lazy=list(h5_obj['Settings'].keys()))
+    else:
+        try:
+            with _file_pool.file(path) as h5_obj:
+                settings = get_camera_config_h5(h5_obj, roi_num)
+        except Exception as e:
+            logger.warning("Camera config is not found: %s", e)
+            settings = get_camera_config_ascii(path, roi_num)
+    return _camera_settings_cache.put(key, settings)
+
+
+# Size limit of the scratch buffer used when frames are read together with
+# the unneeded frames between them (bytes)
+READ_BLOCK_SIZE = 64 * 1024**2
+# Frames closer than this are read together with the frames between them from
+# a dataset without chunking
+CONTIGUOUS_MAX_GAP = 64
+# Frames read one by one are copied into the output in groups of this size
+FRAME_COPY_GROUP = 16
+
+
+def new_read_stats():
+    """
+    Returns an empty read statistics dictionary:
+        'Stages': {stage name: time [s]}
+        'Bytes read': Number of bytes read from the HDF5 datasets
+        'Read calls': Number of HDF5 read calls
+        'Peak buffer': Size of the largest array allocated for reading [bytes]
+    """
+    return {'Stages': {},
+            'Bytes read': 0,
+            'Read calls': 0,
+            'Peak buffer': 0}
+
+
+def stage_time(stats, name=None, t_start=None):
+    """
+    Adds the time since t_start to the stage name in the read statistics (if not None)
+    and returns the current time, which is the start of the next stage.
+    If t_start is None only the current time is returned.
+    """
+    t = time.perf_counter()
+    if ((stats is not None) and (t_start is not None)):
+        stats['Stages'][name] = stats['Stages'].get(name, 0.) + t - t_start
+    return t
+
+
+def count_read(stats, n_bytes):
+    """
+    Adds one HDF5 read call of n_bytes to the read statistics (if not None).
+    """
+    if (stats is not None):
+        stats['Read calls'] += 1
+        stats['Bytes read'] += n_bytes
+
+
+def count_buffer(stats, buffer):
+    """
+    Updates the peak buffer size in the read statistics (if not None).
+    """
+    if ((stats is not None) and (buffer.nbytes > stats['Peak buffer'])):
+        stats['Peak buffer'] = buffer.nbytes
+
+
+def merge_read_stats(stats, part):
+    """
+    Adds the read statistics of a part of a read (e.g. one of parallel reads)
+    to the read statistics (if not None). The stage times, bytes and read calls
+    are added, the peak buffer is the larger one.
+    """
+    if (stats is not None):
+        for (name, t) in part['Stages'].items():
+            stats['Stages'][name] = stats['Stages'].get(name, 0.) + t
+        stats['Bytes read'] += part['Bytes read']
+        stats['Read calls'] += part['Read calls']
+        stats['Peak buffer'] = max(stats['Peak buffer'], part['Peak buffer'])
+
+
+def frames_per_chunk(h5_data):
+    """
+    Returns the number of frames stored in one chunk of the dataset
+    or None if the dataset is not chunked.
+    """
+    plist = h5_data.get_create_plist()
+    if (plist.get_layout() == h5py.h5d.CHUNKED):
+        return plist.get_chunk()[2]
+    return None
+
+
+def frame_spans(frame_vec, max_gap):
+    """
+    Groups an increasing frame index vector into spans where the difference
+    between consecutive frames is at most max_gap.
+    Returns a list of (index_start, index_end) tuples, the spans are
+    frame_vec[index_start:index_end].
+    """
+    breaks = np.nonzero(np.diff(frame_vec) > max_gap)[0] + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [frame_vec.shape[0]]))
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def read_hdf5_arr(h5_data, x, y, frame_vec, binning=None, out=None, average=1, stats=None, cache=None,
+                  correction=None):
     """
     h5_data is a HDF5 dataset object (opened with a known path)
     indices is an array in the form of (x_start:x_end, y_start:y_end, time_slices)
@@ -80,67 +318,1769 @@ def read_hdf5_arr(h5_data, x, y, frame_vec):
     y: (starty, endy)
     # frame_num: (start_frame, end_frame)
     frame_vec: [frame_num1, frame_num2, frame_num3, ...]
+    binning: (bin_x, bin_y) number of pixels to average in the x and y directions.
+             The frames are read and binned in blocks, the result is float.
+             Pixels not filling a full bin at the end of the ranges are dropped.
+    out: C contiguous array to read the data into. Its shape should be the shape
+         of the result, the dtype the dtype of the dataset (float with binning or
+         averaging). If None a new array is allocated.
+    average: Number of consecutive frames to average. Output frame i is the mean of
+             frames frame_vec[i] ... frame_vec[i] + average - 1, the result is float.
+    stats: Read statistics (see new_read_stats()) to update or None.
+    cache: A FrameBlockCache. If not None the frames are read in blocks of whole
+           frames through the cache, only the blocks not in the cache are read
+           from the file.
+    correction: Dark frame and flat field correction (see frame_correction()) or None.
+                The frames are read in blocks and corrected in the output array
+                before binning and averaging, the result has the dtype of the
+                correction.
+
+    Frames are read in spans (see frame_spans()). A span of consecutive frames
+    is read with one hyperslab directly into the output array, other spans
+    (e.g. constant stride) are read in blocks of consecutive frames and the
+    necessary frames are copied from the blocks. HDF5 handles strided and union
+    selections much slower than this.
+    If each frame is stored in a separate chunk or the frames are not in
+    increasing order the frames are read one by one.
     """
     (startx, endx) = x
     (starty, endy) = y
     if (type(frame_vec) is not np.ndarray):
         frame_vec = np.array(frame_vec)
+    n_x = endx - startx
+    n_y = endy - starty
+
+    if (correction is not None):
+        float_dtype = correction['Dtype']
+    else:
+        float_dtype = float
+
+    if (average > 1):
+        if ((binning is not None) and (tuple(binning) != (1, 1))):
+            (bin_x, bin_y) = binning
+        else:
+            (bin_x, bin_y) = (1, 1)
+        arr_full = output_array(out, (n_x // bin_x, n_y // bin_y, frame_vec.shape[0]), float_dtype)
+        count_buffer(stats, arr_full)
+        # Reading the frames of whole groups in blocks
+        block_groups = max(READ_BLOCK_SIZE // max(n_x * n_y * 8 * average, 1), 1)
+        for i_block in range(0, frame_vec.shape[0], block_groups):
+            group_starts = frame_vec[i_block:i_block + block_groups]
+            block_vec = (group_starts[:, np.newaxis] + np.arange(average)).ravel()
+            arr = read_hdf5_arr(h5_data, x, y, block_vec, binning=binning, stats=stats, cache=cache,
+                                correction=correction)
+            arr_full[:, :, i_block:i_block + group_starts.shape[0]] = \
+                arr.reshape(arr.shape[0], arr.shape[1], group_starts.shape[0], average).mean(axis=3)
+        return arr_full
+
+    if (((binning is not None) and (tuple(binning) != (1, 1))) or (correction is not None)):
+        if (binning is None):
+            binning = (1, 1)
+        (bin_x, bin_y) = binning
+        n_bin_x = n_x // bin_x
+        n_bin_y = n_y // bin_y
+        arr_full = output_array(out, (n_bin_x, n_bin_y, frame_vec.shape[0]), float_dtype)
+        count_buffer(stats, arr_full)
+        # Only one block of raw frames is in memory at a time
+        block_frames = max(READ_BLOCK_SIZE // max(n_x * n_y * np.dtype(h5_data.dtype).itemsize, 1), 1)
+        for i_block in range(0, frame_vec.shape[0], block_frames):
+            arr = read_hdf5_arr(h5_data,
+                                (startx, startx + n_bin_x * bin_x),
+                                (starty, starty + n_bin_y * bin_y),
+                                frame_vec[i_block:i_block + block_frames],
+                                stats=stats, cache=cache)
+            out_block = arr_full[:, :, i_block:i_block + arr.shape[2]]
+            if ((bin_x, bin_y) == (1, 1)):
+                # Correcting directly in the output array
+                apply_correction(arr, correction, out_block)
+                continue
+            if (correction is not None):
+                block = np.empty(arr.shape, dtype=float_dtype)
+                arr = apply_correction(arr, correction, block)
+            out_block[...] = arr.reshape(n_bin_x, bin_x, n_bin_y, bin_y, arr.shape[2]).mean(axis=(1, 3))
+        return arr_full
+
+    arr_full = output_array(out, (n_x, n_y, frame_vec.shape[0]), h5_data.dtype)
+    count_buffer(stats, arr_full)
+    if (frame_vec.shape[0] == 0):
+        return arr_full
+    if (cache is not None):
+        return read_cached_blocks(h5_data, x, y, frame_vec, arr_full, cache, stats=stats)
 
     # low level frame reading
     data_space = h5_data.get_space()
-    # dims = data_space.shape
-    arr_full = np.zeros((endx - startx, endy - starty, frame_vec.shape[0]), dtype=h5_data.dtype)
-    arr = np.zeros((endx - startx, endy - starty), dtype=h5_data.dtype)
-    count = (endx, endy, 1)
-    h_i = 0  # helper indexer
-
-    for frame_num in frame_vec:
-        start = (startx, starty, frame_num)
-        end = count
-        data_space.select_hyperslab(start, end)
-        result_space = h5py.h5s.create_simple(count)
-        h5_data.read(result_space, data_space, arr)
-        arr_full[:, :, h_i] = arr
-        h_i = h_i + 1
-    
+    chunk_frames = frames_per_chunk(h5_data)
+    if ((chunk_frames == 1) or np.any(np.diff(frame_vec) <= 0)):
+        # Reading more frames with one call does not reduce the number of chunks to process.
+        # The frames are read into a frame-major buffer and copied into the output
+        # in groups, copying single frames into the frame-minor output is much slower.
+        group_frames = min(FRAME_COPY_GROUP, frame_vec.shape[0])
+        arr = np.empty((group_frames, n_x, n_y), dtype=h5_data.dtype)
+        count_buffer(stats, arr)
+        mem_space = h5py.h5s.create_simple((n_x, n_y, 1))
+        for i_group in range(0, frame_vec.shape[0], group_frames):
+            n_group = min(group_frames, frame_vec.shape[0] - i_group)
+            for i_frame in range(n_group):
+                data_space.select_hyperslab((startx, starty, int(frame_vec[i_group + i_frame])), (n_x, n_y, 1))
+                h5_data.read(mem_space, data_space, arr[i_frame].reshape(n_x, n_y, 1))
+                count_read(stats, arr[i_frame].nbytes)
+            arr_full[:, :, i_group:i_group + n_group] = arr[:n_group].transpose(1, 2, 0)
+        return arr_full
+
+    if (chunk_frames is None):
+        max_gap = CONTIGUOUS_MAX_GAP
+    else:
+        max_gap = chunk_frames
+    block_frames = max(READ_BLOCK_SIZE // max(n_x * n_y * arr_full.itemsize, 1), 1)
+    # The memory space is the whole output array, the output slice is selected in it
+    mem_space = h5py.h5s.create_simple(arr_full.shape)
+    for (i_start, i_end) in frame_spans(frame_vec, max_gap):
+        first_frame = int(frame_vec[i_start])
+        span_len = int(frame_vec[i_end - 1]) - first_frame + 1
+        if (span_len == i_end - i_start):
+            data_space.select_hyperslab((startx, starty, first_frame), (n_x, n_y, span_len))
+            mem_space.select_hyperslab((0, 0, i_start), (n_x, n_y, span_len))
+            h5_data.read(mem_space, data_space, arr_full)
+            count_read(stats, n_x * n_y * span_len * arr_full.itemsize)
+            continue
+        span_frames = frame_vec[i_start:i_end]
+        for block_start in range(first_frame, first_frame + span_len, block_frames):
+            block_len = min(block_frames, first_frame + span_len - block_start)
+            ind = np.arange(np.searchsorted(span_frames, block_start),
+                            np.searchsorted(span_frames, block_start + block_len))
+            if (ind.size == 0):
+                continue
+            # Starting the block at the first necessary frame
+            block_start = int(span_frames[ind[0]])
+            block_len = int(span_frames[ind[-1]]) - block_start + 1
+            arr = np.empty((n_x, n_y, block_len), dtype=h5_data.dtype)
+            block_space = h5py.h5s.create_simple(arr.shape)
+            data_space.select_hyperslab((startx, starty, block_start), (n_x, n_y, block_len))
+            h5_data.read(block_space, data_space, arr)
+            count_read(stats, arr.nbytes)
+            count_buffer(stats, arr)
+            arr_full[:, :, i_start + ind] = arr[:, :, span_frames[ind] - block_start]
+
     return arr_full
 
 
-def w7x_camera_get_data(exp_id=None, data_name=None, no_data=False, options=None, coordinates=None, data_source=None):
-    """ Data read function for the W7-X EDICAM and Photron cameras (HDF5 format)
-    data_name: Usually AEQ21_PHOTRON_ROIPx, ... (string) depending on configuration file
-    exp_id: Experiment ID, YYYYMMDD.xxx, e.g. 20181018.016
-    Options:
-            Datapath: the base path at which the camera files can be found (e.g. /data/W7X)
-            Time: the date and time the recording was made: 123436 (12:34:36)
-            Camera name: either EDICAM or PHOTRON
-            Port: the port number the camera was used, e.g. AEQ20
+def apply_correction(arr, correction, out):
+    """
+    Writes the dark frame and flat field corrected frames of arr (x, y, frame)
+    into out (float, same shape) and returns out. The correction arrays are cut
+    to the size of arr.
     """
+    n_x, n_y = arr.shape[:2]
+    if (correction['Dark'] is not None):
+        np.subtract(arr, correction['Dark'][:n_x, :n_y, np.newaxis], out=out, casting='unsafe')
+    else:
+        out[...] = arr
+    if (correction['Gain'] is not None):
+        out *= correction['Gain'][:n_x, :n_y, np.newaxis]
+    return out
 
-    default_options = {'Datapath': 'data',
-                       'Timing path': 'data',
-                       'Time': None,
-                       'Max_size': 4  # in GB!
-                       }
+
+def output_array(out, shape, dtype):
+    """
+    Returns out after checking that data of shape and dtype can be read into it
+    or a new array if out is None.
+    """
+    if (out is None):
+        return np.empty(shape, dtype=dtype)
+    if (type(out) is not np.ndarray):
+        raise TypeError("The output array should be a numpy array.")
+    if (tuple(out.shape) != tuple(shape)):
+        raise ValueError("The output array shape should be {}, not {}.".format(tuple(shape), out.shape))
+    if (out.dtype != np.dtype(dtype)):
+        raise ValueError("The output array dtype should be {}, not {}.".format(np.dtype(dtype), out.dtype))
+    if (not out.flags.c_contiguous or not out.flags.writeable):
+        raise ValueError("The output array should be C contiguous and writeable.")
+    return out
+
+
+def flip_x_inplace(arr):
+    """
+    Flips an (x, y, frame) array in the x direction in place by swapping
+    the rows. Only one row is copied at a time.
+    """
+    n_x = arr.shape[0]
+    if (n_x < 2):
+        return arr
+    row = np.empty(arr.shape[1:], dtype=arr.dtype)
+    for i in range(n_x // 2):
+        row[...] = arr[i]
+        arr[i] = arr[n_x - 1 - i]
+        arr[n_x - 1 - i] = row
+    return arr
+
+
+# Approximate size of the frame blocks in the frame block cache (bytes) and the
+# maximum number of frames in a block. A miss reads the whole block, small frames
+# stored in separate chunks would make large blocks slow to read.
+CACHE_BLOCK_SIZE = 4 * 1024**2
+CACHE_BLOCK_FRAMES = 64
+
+
+def read_cached_blocks(h5_data, x, y, frame_vec, arr_full, cache, stats=None):
+    """
+    Reads frames through a FrameBlockCache into arr_full (see read_hdf5_arr()).
+    The dataset is divided into blocks of consecutive whole frames, the missing
+    blocks are read from the file and put into the cache.
+    """
+    dims = h5_data.get_space().shape
+    frame_bytes = dims[0] * dims[1] * arr_full.itemsize
+    block_frames = min(max(CACHE_BLOCK_SIZE // max(frame_bytes, 1), 1), CACHE_BLOCK_FRAMES)
+    chunk_frames = frames_per_chunk(h5_data)
+    if ((chunk_frames is not None) and (chunk_frames > 1)):
+        # Blocks of whole chunks
+        block_frames = max(block_frames // chunk_frames, 1) * chunk_frames
+    # The file is identified by the inode and the modification time of the open file
+    file_id = h5py.h5i.get_file_id(h5_data)
+    st = os.fstat(file_id.get_vfd_handle())
+    dataset_key = (st.st_dev, st.st_ino, st.st_mtime_ns, h5py.h5i.get_name(h5_data), block_frames)
+
+    block_ind = frame_vec // block_frames
+    order = np.argsort(block_ind, kind='stable')
+    blocks, starts = np.unique(block_ind[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    for (block, i_start, i_end) in zip(blocks, starts, ends):
+        key = dataset_key + (int(block),)
+        arr = cache.get(key)
+        if (arr is None):
+            first_frame = int(block) * block_frames
+            arr = read_hdf5_arr(h5_data, (0, dims[0]), (0, dims[1]),
+                                np.arange(first_frame, min(first_frame + block_frames, dims[2])),
+                                stats=stats)
+            arr.flags.writeable = False
+            cache.put(key, arr)
+        ind = order[i_start:i_end]
+        arr_full[:, :, ind] = arr[x[0]:x[1], y[0]:y[1], frame_vec[ind] - int(block) * block_frames]
+    return arr_full
+
+
+class FrameBlockCache:
+    """
+    Thread-safe LRU cache of blocks of frames read from the camera files, the
+    total size of the blocks is limited to max_bytes. The keys identify the
+    file, the dataset (ROI) and the block (see read_cached_blocks()).
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._blocks = collections.OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            arr = self._blocks.get(key)
+            if (arr is None):
+                self.misses += 1
+            else:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+            return arr
+
+    def put(self, key, arr):
+        with self._lock:
+            if ((arr.nbytes > self.max_bytes) or (key in self._blocks)):
+                return
+            self._blocks[key] = arr
+            self.n_bytes += arr.nbytes
+            self._evict()
+
+    def set_max_bytes(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.n_bytes = 0
+
+    def statistics(self):
+        """
+        Returns a dictionary with 'Hits', 'Misses', 'Evictions' (number of blocks),
+        'Blocks' (number of cached blocks), 'Bytes' and 'Max bytes'.
+        """
+        with self._lock:
+            return {'Hits': self.hits,
+                    'Misses': self.misses,
+                    'Evictions': self.evictions,
+                    'Blocks': len(self._blocks),
+                    'Bytes': self.n_bytes,
+                    'Max bytes': self.max_bytes}
+
+    def _evict(self):
+        while (self.n_bytes > self.max_bytes):
+            key, arr = self._blocks.popitem(last=False)
+            self.n_bytes -= arr.nbytes
+            self.evictions += 1
+
+
+# The frame block cache of the reads, disabled (size 0) by default
+_frame_cache = FrameBlockCache()
+
+
+def set_frame_cache_size(max_size):
+    """
+    Sets the size of the frame block cache [GB]. Repeated or overlapping reads of the
+    same ROI are served from the cache. 0 disables the cache.
+    """
+    if (max_size < 0):
+        raise ValueError("The cache size should not be negative.")
+    _frame_cache.set_max_bytes(int(max_size * 1024**3))
+
+
+def frame_cache_statistics():
+    """
+    Returns the hit/miss statistics of the frame block cache (see FrameBlockCache.statistics()).
+    """
+    return _frame_cache.statistics()
+
+
+def _active_frame_cache():
+    if (_frame_cache.max_bytes > 0):
+        return _frame_cache
+    return None
+
+
+def open_dataset(path, h5_path):
+    """
+    Opens a dataset in an HDF5 file with the low level h5py interface.
+    Returns the file and dataset ids, both should be closed after use.
+    """
+    h5_obj = h5py.h5f.open(path.encode('utf-8'), h5py.h5f.ACC_RDONLY)
+    try:
+        h5_data = h5py.h5d.open(h5_obj, h5_path.encode('utf-8'))
+    except Exception:
+        h5_obj.close()
+        raise
+    return h5_obj, h5_data
+
+
+class CameraFilePool:
+    """
+    Thread-safe pool of open HDF5 files (read only). The files and the datasets
+    opened in them are kept open and reused by later reads. At most max_open files
+    are kept open, the least recently used unused file is closed first.
+    A file is reopened if its modification time, size or inode changed.
+    Files in use are never closed, if all are in use the limit is exceeded
+    until they are released.
+    HDF5 does not allow opening a file for writing while it is open, use close()
+    before rewriting a file in the same process.
+    """
+
+    def __init__(self, max_open=16):
+        self.max_open = max_open
+        self._lock = threading.RLock()
+        # path: {'File', 'Stat', 'Users', 'Datasets', 'Stale'} in LRU order
+        self._files = collections.OrderedDict()
+        self.opens = 0
+        self.hits = 0
+
+    @contextlib.contextmanager
+    def file(self, path):
+        """
+        Context manager returning the open h5py.File of path.
+        """
+        entry = self._acquire(path)
+        try:
+            yield entry['File']
+        finally:
+            self._release(entry)
+
+    @contextlib.contextmanager
+    def dataset(self, path, h5_path):
+        """
+        Context manager returning the low level dataset id of h5_path in path.
+        """
+        entry = self._acquire(path)
+        try:
+            with self._lock:
+                h5_data = entry['Datasets'].get(h5_path)
+                if (h5_data is None):
+                    h5_data = h5py.h5d.open(entry['File'].id, h5_path.encode('utf-8'))
+                    entry['Datasets'][h5_path] = h5_data
+            yield h5_data
+        finally:
+            self._release(entry)
+
+    def set_max_open(self, max_open):
+        if (max_open < 1):
+            raise ValueError("The maximum number of open files should be positive.")
+        with self._lock:
+            self.max_open = max_open
+            self._evict()
+
+    def close(self):
+        """
+        Closes all files. Files in use are closed when they are released.
+        """
+        with self._lock:
+            for entry in self._files.values():
+                entry['Stale'] = True
+                if (entry['Users'] == 0):
+                    self._close(entry)
+            self._files.clear()
+
+    def discard(self, path):
+        """
+        Closes one file. If it is in use it is closed when it is released.
+        """
+        with self._lock:
+            entry = self._files.pop(os.path.abspath(path), None)
+            if (entry is not None):
+                entry['Stale'] = True
+                if (entry['Users'] == 0):
+                    self._close(entry)
+
+    def open_files(self):
+        """
+        Returns the paths of the open files in LRU order.
+        """
+        with self._lock:
+            return list(self._files.keys())
+
+    def _acquire(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        file_stat = (st.st_mtime_ns, st.st_size, st.st_ino)
+        with self._lock:
+            entry = self._files.get(path)
+            if ((entry is not None) and (entry['Stat'] != file_stat)):
+                del self._files[path]
+                entry['Stale'] = True
+                if (entry['Users'] == 0):
+                    self._close(entry)
+                entry = None
+            if (entry is None):
+                entry = {'File': h5py.File(path, 'r'),
+                         'Stat': file_stat,
+                         'Users': 0,
+                         'Datasets': {},
+                         'Stale': False}
+                self._files[path] = entry
+                self.opens += 1
+            else:
+                self._files.move_to_end(path)
+                self.hits += 1
+            entry['Users'] += 1
+            self._evict()
+            return entry
+
+    def _release(self, entry):
+        with self._lock:
+            entry['Users'] -= 1
+            if (entry['Users'] == 0):
+                if (entry['Stale']):
+                    self._close(entry)
+                else:
+                    self._evict()
+
+    def _evict(self):
+        if (len(self._files) <= self.max_open):
+            return
+        for path in list(self._files.keys()):
+            entry = self._files[path]
+            if (entry['Users'] == 0):
+                del self._files[path]
+                self._close(entry)
+                if (len(self._files) <= self.max_open):
+                    return
+
+    def _after_fork(self):
+        # The HDF5 handles of the parent process are not used in a child process
+        self._lock = threading.RLock()
+        self._files = collections.OrderedDict()
+
+    @staticmethod
+    def _close(entry):
+        for h5_data in entry['Datasets'].values():
+            h5_data.close()
+        entry['Datasets'] = {}
+        entry['File'].close()
+
+
+# The open camera files shared by all reads
+_file_pool = CameraFilePool()
+atexit.register(_file_pool.close)
+if (hasattr(os, 'register_at_fork')):
+    os.register_at_fork(after_in_child=_file_pool._after_fork)
+
+
+def set_max_open_files(max_open):
+    """
+    Sets the maximum number of camera files kept open between reads.
+    """
+    _file_pool.set_max_open(max_open)
+
+
+def close_camera_files():
+    """
+    Closes all camera files kept open between reads.
+    """
+    _file_pool.close()
+
+
+def dataset_info(path, h5_path):
+    """
+    Returns the shape and the dtype of a dataset in an HDF5 file.
+    """
+    with _file_pool.dataset(path, h5_path) as h5_data:
+        return h5_data.get_space().shape, np.dtype(h5_data.dtype)
+
+
+class LazyCameraArray:
+    """
+    Array-like proxy over a camera dataset in an HDF5 file. Only shape, dtype and
+    the read parameters are stored, indexing reads only the touched frames and
+    pixels from the file. np.array() reads everything.
+    The x window, binning and x flip are the same as in read_hdf5_arr() and
+    w7x_camera_get_data(), the index refers to the output (binned, flipped) array.
+    The file is read through the shared file pool (see set_max_open_files()).
+    """
+
+    def __init__(self, path, h5_path, x, y, frame_vec, binning=(1, 1), flip_x=False):
+        self.path = path
+        self.h5_path = h5_path
+        self.x = x
+        self.y = y
+        self.frame_vec = np.array(frame_vec)
+        self.binning = tuple(binning)
+        self.flip_x = flip_x
+        if (self.binning != (1, 1)):
+            self.dtype = np.dtype(float)
+        else:
+            self.dtype = dataset_info(path, h5_path)[1]
+        self.shape = ((x[1] - x[0]) // self.binning[0],
+                      (y[1] - y[0]) // self.binning[1],
+                      self.frame_vec.shape[0])
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return "LazyCameraArray({:s}:{:s}, shape={}, dtype={})".format(self.path, self.h5_path,
+                                                                       self.shape, self.dtype)
+
+    def close(self):
+        """
+        Nothing to do, the file is kept open in the shared file pool
+        (see close_camera_files()).
+        """
+
+    def __deepcopy__(self, memo):
+        # The data is in the file, a copy is a new proxy over the same file
+        new = LazyCameraArray.__new__(LazyCameraArray)
+        new.__dict__.update(self.__dict__)
+        new.frame_vec = self.frame_vec.copy()
+        return new
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self[...]
+        if (dtype is not None):
+            arr = arr.astype(dtype, copy=False)
+        return arr
+
+    def _normalize_key(self, key):
+        if (type(key) is not tuple):
+            key = (key,)
+        n_ellipsis = sum(1 for k in key if k is Ellipsis)
+        if (n_ellipsis > 1):
+            raise IndexError("An index can only have a single ellipsis.")
+        if (n_ellipsis == 1):
+            i = [k is Ellipsis for k in key].index(True)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1:]
+        if (len(key) > self.ndim):
+            raise IndexError("Too many indices for LazyCameraArray.")
+        return key + (slice(None),) * (self.ndim - len(key))
+
+    @staticmethod
+    def _window(k, n):
+        """
+        Returns the index range [start, end) needed for index k on an axis of length n
+        and the index to apply on the range.
+        """
+        if (isinstance(k, slice)):
+            ind = np.arange(n)[k]
+            if (ind.size == 0):
+                return None
+            step = 1 if k.step is None else k.step
+            start = int(ind.min())
+            local_stop = int(ind[-1]) - start + (1 if step > 0 else -1)
+            if (local_stop < 0):
+                local_stop = None
+            return (start, int(ind.max()) + 1), slice(int(ind[0]) - start, local_stop, step)
+        if (np.isscalar(k) or (isinstance(k, np.ndarray) and k.ndim == 0)):
+            k = int(k)
+            if ((k < -n) or (k >= n)):
+                raise IndexError("Index {:d} is out of bounds for axis with size {:d}.".format(k, n))
+            k = k % n
+            return (k, k + 1), 0
+        ind = np.arange(n)[np.asarray(k)]
+        if (ind.size == 0):
+            return None
+        start = int(ind.min())
+        return (start, int(ind.max()) + 1), ind - start
+
+    def __getitem__(self, key):
+        key = self._normalize_key(key)
+        # Zero strided placeholder of the full array to get the result shape of empty selections
+        empty = np.lib.stride_tricks.as_strided(np.zeros(1, dtype=self.dtype), shape=self.shape, strides=(0, 0, 0))
+        x_window = self._window(key[0], self.shape[0])
+        y_window = self._window(key[1], self.shape[1])
+        if ((x_window is None) or (y_window is None)):
+            return empty[key].copy()
+
+        # Frames: reading only the indexed ones, in the indexed order for slices
+        k = key[2]
+        if (isinstance(k, slice)):
+            frame_ind = np.arange(self.shape[2])[k]
+            local_frames = slice(None)
+        elif (np.isscalar(k) or (isinstance(k, np.ndarray) and k.ndim == 0)):
+            frame_ind = np.arange(self.shape[2])[[int(k)]]
+            local_frames = 0
+        else:
+            ind = np.arange(self.shape[2])[np.asarray(k)]
+            frame_ind = np.unique(ind)
+            local_frames = np.searchsorted(frame_ind, ind)
+        if (frame_ind.size == 0):
+            return empty[key].copy()
+
+        (bin_x, bin_y) = self.binning
+        ((x_start, x_end), local_x) = x_window
+        ((y_start, y_end), local_y) = y_window
+        if (self.flip_x):
+            x = (self.x[1] - x_end * bin_x, self.x[1] - x_start * bin_x)
+        else:
+            x = (self.x[0] + x_start * bin_x, self.x[0] + x_end * bin_x)
+        y = (self.y[0] + y_start * bin_y, self.y[0] + y_end * bin_y)
+        with _file_pool.dataset(self.path, self.h5_path) as h5_data:
+            arr = read_hdf5_arr(h5_data, x, y, self.frame_vec[frame_ind], binning=self.binning,
+                                cache=_active_frame_cache())
+        if (self.flip_x):
+            arr = np.flip(arr, axis=0)
+        return arr[local_x, local_y, local_frames]
+
+
+def image_window(coordinates, image_start, dims, binning=None, flip_x=False):
+    """
+    Determines the pixel window to read from the dataset from the Image x and
+    Image y coordinate ranges and the binning.
+    coordinates: List of flap.Coordinate objects, the ones other than Image x
+                 and Image y are ignored. The ranges are inclusive.
+    image_start: (X Start, Y Start) the Image x and Image y of the first pixel
+    dims: The shape of the dataset
+    binning: None, an integer or (bin_x, bin_y)
+    flip_x: True if the images are flipped in the x direction after reading
+            (the coordinates refer to the flipped image)
+    Returns x, y, image_x_start, image_y_start, binning
+            x, y: (start, end) pixel ranges in the dataset, truncated to full bins
+            image_x_start, image_y_start: Image x and Image y of the first
+                                          (binned) pixel of the output
+            binning: (bin_x, bin_y)
+    """
+    if (binning is None):
+        binning = (1, 1)
+    elif (np.isscalar(binning)):
+        binning = (int(binning), int(binning))
+    else:
+        binning = (int(binning[0]), int(binning[1]))
+    if ((binning[0] < 1) or (binning[1] < 1)):
+        raise ValueError("Binning should be a positive integer.")
+
+    # The window in the output image, [start, end)
+    window = [[0, dims[0]], [0, dims[1]]]
+    for coord in coordinates:
+        if (coord.unit.name == 'Image x'):
+            i_dim = 0
+        elif (coord.unit.name == 'Image y'):
+            i_dim = 1
+        else:
+            continue
+        if (coord.c_range is None):
+            raise NotImplementedError("At present only simple range selection is supported for {:s}.".format(coord.unit.name))
+        start = max(int(np.ceil(float(coord.c_range[0]) - image_start[i_dim])), 0)
+        end = min(int(np.floor(float(coord.c_range[1]) - image_start[i_dim])) + 1, dims[i_dim])
+        if (end - start < binning[i_dim]):
+            raise ValueError("No data in {:s} range.".format(coord.unit.name))
+        window[i_dim] = [start, end]
+    for i_dim in range(2):
+        n_bins = (window[i_dim][1] - window[i_dim][0]) // binning[i_dim]
+        if (n_bins == 0):
+            raise ValueError("Binning is larger than the image size.")
+        window[i_dim][1] = window[i_dim][0] + n_bins * binning[i_dim]
+
+    x = (window[0][0], window[0][1])
+    y = (window[1][0], window[1][1])
+    if (flip_x):
+        x = (dims[0] - window[0][1], dims[0] - window[0][0])
+    image_x_start = image_start[0] + window[0][0]
+    image_y_start = image_start[1] + window[1][0]
+    # The coordinate of a binned pixel is the center of the bin
+    if (binning[0] > 1):
+        image_x_start = image_x_start + (binning[0] - 1) / 2
+    if (binning[1] > 1):
+        image_y_start = image_y_start + (binning[1] - 1) / 2
+    return x, y, image_x_start, image_y_start, binning
+
+
+# The shot index: file lists of the data directories, see find_camera_file()
+# {absolute directory path: {'Mtime': ..., 'Files': {file name: file entry}}}
+# A file entry also holds the shapes and dtypes of the datasets read from the
+# file and the file modification time they belong to, see indexed_dataset_info().
+_shot_index = {}
+# The modification times of the index files when they were last loaded: {index file: mtime}
+_shot_index_mtimes = {}
+_shot_index_lock = threading.RLock()
+
+
+def camera_file_entry(fname):
+    """
+    Parses a camera file name: <port>_<camera>_<date>_<exp num>_<time>.h5
+    or <port>_<camera>_<date>_<time>.h5
+    Returns a dictionary with Port, Camera, Date, Exp num (None if not in the name)
+    and Time or None if the name is not a camera file name.
+    """
+    if (not fname.endswith('.h5')):
+        return None
+    parts = fname[:-3].split('_')
+    if (len(parts) == 5):
+        exp_num = parts[3]
+    elif (len(parts) == 4):
+        exp_num = None
+    else:
+        return None
+    return {'Port': parts[0],
+            'Camera': parts[1],
+            'Date': parts[2],
+            'Exp num': exp_num,
+            'Time': parts[-1]}
+
+
+def _index_file(index_path, dp):
+    """
+    Returns the index file of a data directory (absolute path) in the index directory.
+    """
+    return os.path.join(index_path, hashlib.sha1(dp.encode('utf-8')).hexdigest()[:20] + '.json')
+
+
+def _load_directory_index(index_path, dp):
+    """
+    Loads the index entry of a data directory into _shot_index if its index file
+    was changed since it was last loaded.
+    """
+    if (index_path is None):
+        return
+    index_file = _index_file(index_path, dp)
+    try:
+        mtime = os.stat(index_file).st_mtime_ns
+    except FileNotFoundError:
+        return
+    if (_shot_index_mtimes.get(index_file) == mtime):
+        return
+    with open(index_file, 'r') as f:
+        index = json.load(f)
+    if (index['Directory'] == dp):
+        _shot_index[dp] = index['Entry']
+    _shot_index_mtimes[index_file] = mtime
+
+
+def _save_directory_index(index_path, dp, entry):
+    """
+    Writes the index entry of a data directory to its index file.
+    """
+    if (index_path is None):
+        return
+    os.makedirs(index_path, exist_ok=True)
+    index_file = _index_file(index_path, dp)
+    tmp_file = "{:s}.{:d}.tmp".format(index_file, os.getpid())
+    with open(tmp_file, 'w') as f:
+        json.dump({'Directory': dp, 'Entry': entry}, f)
+    os.replace(tmp_file, index_file)
+    _shot_index_mtimes[index_file] = os.stat(index_file).st_mtime_ns
+
+
+def index_camera_directory(dp, index_path=None):
+    """
+    Returns the index entry of a data directory: {file name: file entry}
+    The directory is listed only if it was modified since it was indexed.
+    The entries are kept in memory and, if index_path is set, each directory
+    in its own JSON file in index_path, so a change rewrites only the file of
+    the changed directory. The directories are identified by their absolute path.
+    """
+    dp = os.path.abspath(dp)
+    with _shot_index_lock:
+        _load_directory_index(index_path, dp)
+        dir_mtime = os.stat(dp).st_mtime_ns
+        entry = _shot_index.get(dp)
+        if ((entry is None) or (entry['Mtime'] != dir_mtime)):
+            old_files = {} if entry is None else entry['Files']
+            files = {}
+            for fname in os.listdir(dp):
+                file_entry = camera_file_entry(fname)
+                if (file_entry is None):
+                    continue
+                if (fname in old_files):
+                    file_entry = old_files[fname]
+                files[fname] = file_entry
+            entry = {'Mtime': dir_mtime, 'Files': files}
+            _shot_index[dp] = entry
+            _save_directory_index(index_path, dp, entry)
+        return entry['Files']
+
+
+def find_camera_file(dp, port, cam_str, date, exp_num, time, index_path=None):
+    """
+    Finds the file of a measurement in a data directory using the shot index
+    instead of listing the directory at every call.
+    time: The time stamp of the file or None.
+    If no file is found with exp_num and time is set the file name without
+    experiment number is also tried.
+    Returns the file name and its time stamp.
+    """
+    files = index_camera_directory(dp, index_path=index_path)
+
+    def matches(with_exp_num):
+        fnames = []
+        for fname, file_entry in files.items():
+            if ((file_entry['Port'] != port.lower()) or (file_entry['Camera'] != cam_str.lower())
+                    or (file_entry['Date'] != date)):
+                continue
+            if (with_exp_num):
+                if (file_entry['Exp num'] != exp_num):
+                    continue
+            elif (file_entry['Exp num'] is not None):
+                continue
+            if ((time is None) or (file_entry['Time'] == time)):
+                fnames.append(fname)
+        return sorted(fnames)
+
+    fnames = matches(True)
+    if (len(fnames) > 1):
+        if (time is not None):
+            raise ValueError("Multiple files found, 'Time' option should be set?")
+        else:
+            filename_mask = "_".join([port.lower(), cam_str.lower(), date, exp_num, ("*.h5")])
+            raise ValueError("Multiple files found:{:s}.".format(os.path.join(dp,filename_mask)))
+    elif (len(fnames) == 0):
+        if (time is not None):
+            fnames = matches(False)
+            if (len(fnames) == 0):
+                raise ValueError("Cannot find any file for this measurement.")
+        else:
+            filename_mask = "_".join([port.lower(), cam_str.lower(), date, exp_num, ("*.h5")])
+            raise ValueError("Cannot find file without time parameter. Filename mask:"+filename_mask+" dp:"+dp)
+    return fnames[0], files[fnames[0]]['Time']
+
+
+def indexed_dataset_info(path, h5_path, index_path=None):
+    """
+    Returns the shape and the dtype of a dataset in a camera file like
+    dataset_info(), but takes them from the shot index if the file was not
+    modified since they were recorded there. Otherwise the file is opened and
+    the shape and dtype are added to the index entry of the file.
+    index_path: The directory of the index files (see index_camera_directory())
+    """
+    dp, fname = os.path.split(os.path.abspath(path))
+    mtime = os.stat(path).st_mtime_ns
+    with _shot_index_lock:
+        file_entry = index_camera_directory(dp, index_path=index_path).get(fname)
+        if (file_entry is None):
+            return dataset_info(path, h5_path)
+        if (file_entry.get('Mtime') == mtime):
+            dataset = file_entry['Datasets'].get(h5_path)
+            if (dataset is not None):
+                return tuple(dataset['Shape']), np.dtype(dataset['Dtype'])
+    dims, dtype = dataset_info(path, h5_path)
+    with _shot_index_lock:
+        file_entry = index_camera_directory(dp, index_path=index_path).get(fname)
+        if (file_entry is not None):
+            if (file_entry.get('Mtime') != mtime):
+                file_entry['Mtime'] = mtime
+                file_entry['Datasets'] = {}
+            file_entry['Datasets'][h5_path] = {'Shape': [int(n) for n in dims], 'Dtype': dtype.str}
+            _save_directory_index(index_path, dp, _shot_index[dp])
+    return dims, dtype
+
+
+def w7x_camera_build_index(datapath, index_path=None):
+    """
+    Builds or updates the shot index for all camera data directories under
+    datapath (<datapath>/<CAMERA>/<PORT>/<date>). Only the directories
+    modified since the last run are listed.
+    index_path: The directory of the index files (see index_camera_directory())
+    Returns the number of indexed files.
+    """
+    n_files = 0
+    for cam_name in ['EDICAM', 'PHOTRON']:
+        cam_dir = os.path.join(datapath, cam_name)
+        if (not os.path.isdir(cam_dir)):
+            continue
+        for port in sorted(os.listdir(cam_dir)):
+            port_dir = os.path.join(cam_dir, port)
+            if (not os.path.isdir(port_dir)):
+                continue
+            for date in sorted(os.listdir(port_dir)):
+                dp = os.path.join(port_dir, date)
+                if (os.path.isdir(dp)):
+                    n_files += len(index_camera_directory(dp, index_path=index_path))
+    return n_files
+
+
+def time_axis(time_vec_sec):
+    """
+    Precomputes the information for selecting time windows from a time vector.
+    Returns a dictionary:
+        'Monotonic': True if the time vector is not decreasing
+        'Segment starts': Start indices of the segments of the sample time
+                          differences (dt = time_vec_sec[1:] - time_vec_sec[:-1])
+                          within which all dt are within 0.1% of the first dt of
+                          the segment
+        'N dt': The number of sample time differences
+    """
+    time_vec_sec = np.asarray(time_vec_sec)
+    dt = time_vec_sec[1:] - time_vec_sec[:-1]
+    starts = []
+    i_start = 0
+    while (i_start < len(dt)):
+        starts.append(i_start)
+        ref = dt[i_start]
+        i_end = i_start + 1
+        # Searching the end of the segment in growing steps
+        length = 16
+        while (i_end < len(dt)):
+            ind = np.nonzero(np.abs(dt[i_end:i_end + length] - ref) > 0.001 * abs(ref))[0]
+            if (len(ind) != 0):
+                i_end = i_end + int(ind[0])
+                break
+            i_end += length
+            length *= 2
+        i_start = i_end
+    return {'Monotonic': bool(np.all(dt >= 0)),
+            'Segment starts': np.array(starts, dtype=int),
+            'N dt': len(dt)}
+
+
+def time_range_frames(time_vec_sec, axis, read_range, include_end=True):
+    """
+    Returns the frame index range (start, end) of the frames with
+    read_range[0] <= time <= read_range[1] (< if include_end is False)
+    by binary search in a monotonic time vector.
+    axis: The result of time_axis() for the time vector
+    For time vectors which are not monotonic use time_range_index().
+    """
+    if (not axis['Monotonic']):
+        raise ValueError("The time vector is not monotonic, use time_range_index().")
+    start = int(np.searchsorted(time_vec_sec, read_range[0], side='left'))
+    end = int(np.searchsorted(time_vec_sec, read_range[1], side='right' if include_end else 'left'))
+    return (start, max(end, start))
+
+
+def time_range_index(time_vec_sec, axis, read_range, include_end=True):
+    """
+    Returns the indices of the frames with read_range[0] <= time <= read_range[1]
+    (< if include_end is False) in increasing order. For monotonic time vectors
+    these are the consecutive frames found by time_range_frames(), otherwise
+    the frames are selected with a mask and need not be consecutive.
+    axis: The result of time_axis() for the time vector
+    """
+    if (axis['Monotonic']):
+        return np.arange(*time_range_frames(time_vec_sec, axis, read_range, include_end=include_end))
+    if (include_end):
+        return np.nonzero((time_vec_sec >= read_range[0]) & (time_vec_sec <= read_range[1]))[0]
+    return np.nonzero((time_vec_sec >= read_range[0]) & (time_vec_sec < read_range[1]))[0]
+
+
+def frames_equidistant(axis, frame_vec):
+    """
+    Returns True if the frames of frame_vec are consecutive and equidistant in time
+    (see window_equidistant()).
+    """
+    if ((len(frame_vec) < 2) or (frame_vec[-1] - frame_vec[0] + 1 != len(frame_vec))):
+        return False
+    return window_equidistant(axis, int(frame_vec[0]), int(frame_vec[-1]) + 1)
+
+
+def window_equidistant(axis, start, end):
+    """
+    Returns True if the frames start...end-1 are equidistant in time, that is
+    all their time differences are in one segment of time_axis().
+    """
+    if (end - start < 2):
+        return False
+    starts = axis['Segment starts']
+    i_seg = int(np.searchsorted(starts, start, side='right')) - 1
+    if (i_seg + 1 < len(starts)):
+        seg_end = starts[i_seg + 1]
+    else:
+        seg_end = axis['N dt']
+    # The last time difference of the window is end - 2
+    return end - 2 < seg_end
+
+
+# The number of recordings, stores and quick-look files whose time vectors are cached
+TIME_CACHE_SIZE = 256
+# EDICAM time vectors: {(path, mtime, ROI): time vector dictionary}
+_edicam_time_cache = _MetadataCache(TIME_CACHE_SIZE)
+
+
+def read_edicam_time(path, roi_num):
+    """
+    Reads the ETU and W7-X time vectors of an EDICAM ROI and calculates the
+    time vector in seconds from them. The result is cached by path and
+    modification time, the arrays are read only.
+    Returns a dictionary with 'Time vec', 'ETU time vec', 'W7X time vec'
+    (the latter two can be None) and 'Time axis' (see time_axis()).
+    """
+    key = (path, os.stat(path).st_mtime_ns, roi_num.upper())
+    time_vectors = _edicam_time_cache.get(key)
+    if (time_vectors is not None):
+        return time_vectors
+    with _file_pool.file(path) as h5_obj:
+        try:
+            time_vec_etu = np.array(h5_obj['ROIP']['{}'.format(roi_num.upper())]['{}ETU'.format(roi_num.upper())])
+            #print("ETU time vector found!")
+        except Exception as e:
+            logger.warning("Cannot read ETU! Error message: %s", e)
+            time_vec_etu = None
+        try:
+            time_vec_w7x = np.array(h5_obj['ROIP']['{}'.format(roi_num.upper())]['{}W7XTime'.format(roi_num.upper())])
+            #print("W7-X time vector found!")
+        except Exception as e:
+            logger.warning("Cannot read W7-X time units (ns)! Error message: %s", e)
+            time_vec_w7x = None
+        
+        if time_vec_w7x is not None:
+            logger.debug("Using W7-X time vector [ns] for time vector [s] calculation.")
+            time_vec_sec = (time_vec_w7x - time_vec_w7x[0]) / 1.e9
+        elif time_vec_etu is not None:
+            logger.debug("Using ETU time vector [100 ns] for time vector [s] calculation.")
+            time_vec_sec = (time_vec_etu - time_vec_etu[0]) / 1.e7
+        else:
+            raise IOError("No time vector found!")
+    for arr in [time_vec_sec, time_vec_etu, time_vec_w7x]:
+        if (arr is not None):
+            arr.flags.writeable = False
+    time_vectors = {'Time vec': time_vec_sec,
+                    'ETU time vec': time_vec_etu,
+                    'W7X time vec': time_vec_w7x,
+                    'Time axis': time_axis(time_vec_sec)}
+    return _edicam_time_cache.put(key, time_vectors)
+
+
+# The repacked stores are written in blocks of about this size (bytes) with
+# chunks of about REPACK_CHUNK_SIZE bytes
+REPACK_BLOCK_SIZE = 256 * 1024**2
+REPACK_CHUNK_SIZE = 1024**2
+REPACK_VERSION = 1
+
+
+def repack_path(path, roi_num, repack_dir=None):
+    """
+    Returns the path of the repacked store of a ROI of a camera file.
+    repack_dir: The directory of the stores. If None it is the directory of the file.
+    """
+    return _sidecar_path(path, roi_num, 'repack', repack_dir)
+
+
+def _sidecar_path(path, roi_num, kind, directory=None):
+    if (directory is None):
+        directory = os.path.dirname(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(directory, "_".join([name, roi_num.lower(), kind + '.h5']))
+
+
+def _source_changed(sidecar, source_path):
+    """
+    Returns True if source_path is not the file a sidecar (repacked store,
+    quick-look file) was made from: its modification time or size changed.
+    """
+    source_st = os.stat(source_path)
+    return ((sidecar['Source mtime'] != source_st.st_mtime_ns) or (sidecar['Source size'] != source_st.st_size))
+
+
+def repack_chunk_shape(dims, itemsize):
+    """
+    Returns the chunk shape of a repacked store for time series access: a long
+    run of frames of a small tile of pixels. The number of frames in a chunk is
+    the number of frames in a REPACK_BLOCK_SIZE block (64...4096).
+    """
+    frame_bytes = dims[0] * dims[1] * itemsize
+    n_t = int(min(max(REPACK_BLOCK_SIZE // max(frame_bytes, 1), 64), 4096, dims[2]))
+    n_pixels = max(REPACK_CHUNK_SIZE // (n_t * itemsize), 1)
+    n_x = int(min(max(int(np.sqrt(n_pixels)), 1), dims[0]))
+    n_y = int(min(max(n_pixels // n_x, 1), dims[1]))
+    return (n_x, n_y, max(n_t, 1))
+
+
+# Repacked store contents: {(path, mtime): store dictionary}
+_repack_cache = _MetadataCache(TIME_CACHE_SIZE)
+
+
+def read_repack_info(store_path, source_path):
+    """
+    Returns the description of a repacked store or None if it does not exist or
+    was made from an earlier version of source_path. The result is cached:
+        'Path': store_path
+        'Camera', 'Info': The camera name and the info of the recording
+                          (X Start, Y Start, Frame per trig and Rec rate for Photron)
+        'Time vec', 'ETU time vec', 'W7X time vec', 'Time axis': As in read_edicam_time()
+    """
+    try:
+        st = os.stat(store_path)
+    except FileNotFoundError:
+        return None
+    key = (store_path, st.st_mtime_ns, st.st_size)
+    store = _repack_cache.get(key)
+    if (store is None):
+        with _file_pool.file(store_path) as h5_obj:
+            attrs = dict(h5_obj.attrs)
+            if (attrs.get('Version') != REPACK_VERSION):
+                logger.warning("Unknown repacked store version in %s, not used.", store_path)
+                return None
+            info = json.loads(attrs['Info'])
+            time_vectors = {}
+            for (name, key_name) in [('Time', 'Time vec'), ('ETUTime', 'ETU time vec'), ('W7XTime', 'W7X time vec')]:
+                if (name in h5_obj):
+                    time_vectors[key_name] = np.array(h5_obj[name])
+                    time_vectors[key_name].flags.writeable = False
+                else:
+                    time_vectors[key_name] = None
+        store = {'Path': store_path,
+                 'Camera': attrs['Camera'],
+                 'Info': info,
+                 'Source mtime': int(attrs['Source mtime']),
+                 'Source size': int(attrs['Source size']),
+                 'Time axis': time_axis(time_vectors['Time vec'])}
+        store.update(time_vectors)
+        _repack_cache.put(key, store)
+    if (_source_changed(store, source_path)):
+        logger.warning("The repacked store %s is older than %s, not used.", store_path, source_path)
+        return None
+    return store
+
+
+def w7x_camera_repack(exp_id=None, data_name=None, options=None):
+    """
+    Converts the recording of a camera ROI into a store for time series access and
+    returns its path. w7x_camera_get_data() reads the store instead of the recording
+    if it exists and is newer than the recording (option Use repack).
+    The store is an HDF5 file with the same dataset path and (x, y, frame) shape as
+    the recording but chunked in long runs of frames of small pixel tiles (see
+    repack_chunk_shape()) and compressed. The Photron x flip is applied and the
+    Time, ETUTime and W7XTime vectors are stored with the data.
+    The arguments and options are the same as for w7x_camera_get_data(), the
+    coordinates are not used. Further options:
+        Repack path: Directory of the store, if None it is next to the recording.
+        Compression: 'lzf' (fast), 'gzip' or None
+        Overwrite: If False an up to date store is not written again.
+    """
+    default_options = {'Repack path': None,
+                       'Compression': 'lzf',
+                       'Overwrite': False}
     _options = flap.config.merge_options(default_options, options, data_source='W7X_CAMERA')
+    # The store contains the raw frames of the recording
+    plan_options = {} if options is None else dict(options)
+    plan_options.update({'Use repack': False, 'Quicklook': None, 'Dark': None, 'Flat': None,
+                         'Binning': None, 'Decimate': None})
+    plan = w7x_camera_read_plan(exp_id=exp_id, data_name=data_name, options=plan_options)
+    roi_num = data_name.split("_")[2]
+    store_path = repack_path(plan['Path'], roi_num, _options['Repack path'])
+    if ((not _options['Overwrite']) and (read_repack_info(store_path, plan['Path']) is not None)):
+        return store_path
 
-    name_split = data_name.split("_")
-    port = name_split[0]
-    cam_name = name_split[1].upper()
-    roi_num = name_split[2]
+    dims = plan['Dims']
+    dtype = plan['Dtype']
+    n_frames = len(plan['Frame vec'])
+    chunks = repack_chunk_shape((dims[0], dims[1], n_frames), dtype.itemsize)
+    source_st = os.stat(plan['Path'])
+    info = {'X Start': int(plan['Info']['X Start']),
+            'Y Start': int(plan['Info']['Y Start'])}
+    if (plan['Camera'] == 'PHOTRON'):
+        info['Frame per trig'] = int(plan['Info']['Frame per trig'])
+        info['Rec rate'] = float(plan['Info']['Rec rate'])
+    os.makedirs(os.path.dirname(os.path.abspath(store_path)), exist_ok=True)
+    tmp_path = store_path + '.tmp'
+    try:
+        with h5py.File(tmp_path, 'w') as h5_obj:
+            data = h5_obj.create_dataset(plan['HDF5 path'], shape=(dims[0], dims[1], n_frames), dtype=dtype,
+                                         chunks=chunks, compression=_options['Compression'],
+                                         shuffle=(_options['Compression'] is not None))
+            with _file_pool.dataset(plan['Path'], plan['HDF5 path']) as h5_data:
+                # Writing whole chunks
+                for i_start in range(0, n_frames, chunks[2]):
+                    arr = read_hdf5_arr(h5_data, (0, dims[0]), (0, dims[1]),
+                                        plan['Frame vec'][i_start:i_start + chunks[2]])
+                    if (plan['Flip x']):
+                        flip_x_inplace(arr)
+                    data[:, :, i_start:i_start + arr.shape[2]] = arr
+            h5_obj['Time'] = plan['Time vec']
+            if (plan['ETU time vec'] is not None):
+                h5_obj['ETUTime'] = plan['ETU time vec']
+            if (plan['W7X time vec'] is not None):
+                h5_obj['W7XTime'] = plan['W7X time vec']
+            h5_obj.attrs['Version'] = REPACK_VERSION
+            h5_obj.attrs['Camera'] = plan['Camera']
+            h5_obj.attrs['Info'] = json.dumps(info)
+            h5_obj.attrs['Source path'] = plan['Path']
+            h5_obj.attrs['Source mtime'] = source_st.st_mtime_ns
+            h5_obj.attrs['Source size'] = source_st.st_size
+        os.replace(tmp_path, store_path)
+    finally:
+        if (os.path.exists(tmp_path)):
+            os.remove(tmp_path)
+    logger.info("Repacked %s %s into %s, chunks %s", exp_id, data_name, store_path, chunks)
+    return store_path
 
-    datapath = _options['Datapath']
-    time = _options['Time']
-    max_size = _options['Max_size']
-    timing_path = _options['Timing path']
 
-    if (coordinates is None):
-        _coordinates = []
+QUICKLOOK_VERSION = 1
+
+
+def quicklook_path(path, roi_num, quicklook_dir=None):
+    """
+    Returns the path of the quick-look file of a ROI of a camera file.
+    quicklook_dir: The directory of the quick-look files. If None it is the directory of the file.
+    """
+    return _sidecar_path(path, roi_num, 'quicklook', quicklook_dir)
+
+
+def _bin_block(arr, factor):
+    """
+    Averages groups of factor x factor pixels and factor consecutive frames of a
+    (x, y, frame) array, the incomplete groups at the ends are dropped.
+    """
+    n = [arr.shape[i] // factor for i in range(3)]
+    arr = arr[:n[0] * factor, :n[1] * factor, :n[2] * factor]
+    return arr.reshape(n[0], factor, n[1], factor, n[2], factor).mean(axis=(1, 3, 5))
+
+
+def w7x_camera_quicklook(exp_id=None, data_name=None, options=None):
+    """
+    Computes the quick-look products of a camera ROI in one pass over the recording
+    and writes them into a quick-look file. Returns the path of the file.
+    The products, all (x, y, frame) arrays with the same orientation as the data
+    returned by w7x_camera_get_data():
+        Mean, Std: The mean and standard deviation of the frames (one frame)
+        Intensity: The sum of the pixels of each frame (one pixel)
+        Level1, Level2, ...: The movie averaged in 2**level x 2**level pixel and
+                             2**level frame groups
+    They are read with the Quicklook option of w7x_camera_get_data().
+    The arguments and options are the same as for w7x_camera_get_data(), the
+    coordinates are not used. Further options:
+        Quicklook path: Directory of the quick-look file, if None it is next to the recording.
+        Quicklook levels: The number of downsampled movie levels. Levels smaller than one
+                          pixel or frame are not made.
+        Overwrite: If False an up to date quick-look file is not written again.
+    """
+    default_options = {'Quicklook path': None,
+                       'Quicklook levels': 4,
+                       'Overwrite': False}
+    _options = flap.config.merge_options(default_options, options, data_source='W7X_CAMERA')
+    # The products are made from the raw frames of the recording
+    plan_options = {} if options is None else dict(options)
+    plan_options.update({'Use repack': False, 'Quicklook': None, 'Dark': None, 'Flat': None,
+                         'Binning': None, 'Decimate': None})
+    plan = w7x_camera_read_plan(exp_id=exp_id, data_name=data_name, options=plan_options)
+    roi_num = data_name.split("_")[2]
+    ql_path = quicklook_path(plan['Path'], roi_num, _options['Quicklook path'])
+    if ((not _options['Overwrite']) and (read_quicklook_info(ql_path, plan['Path']) is not None)):
+        return ql_path
+
+    shape = plan_data_shape(plan)
+    n_levels = 0
+    while ((n_levels < int(_options['Quicklook levels'])) and (min(shape) >> (n_levels + 1) >= 1)):
+        n_levels += 1
+    # The blocks start at a multiple of the largest averaging group
+    block_size = max(READ_BLOCK_SIZE // (shape[0] * shape[1] * 8) >> n_levels, 1) << n_levels
+    source_st = os.stat(plan['Path'])
+    info = {'X Start': int(plan['Info']['X Start']),
+            'Y Start': int(plan['Info']['Y Start']),
+            'Flip x': bool(plan['Flip x']),
+            'Dims': [int(n) for n in shape],
+            'Levels': n_levels}
+    os.makedirs(os.path.dirname(os.path.abspath(ql_path)), exist_ok=True)
+    tmp_path = ql_path + '.tmp'
+    try:
+        with h5py.File(tmp_path, 'w') as h5_obj:
+            levels = []
+            for level in range(1, n_levels + 1):
+                level_shape = tuple(n >> level for n in shape)
+                chunk_frames = max(min(REPACK_CHUNK_SIZE // (level_shape[0] * level_shape[1] * 4), level_shape[2]), 1)
+                levels.append(h5_obj.create_dataset('Level{:d}'.format(level), shape=level_shape, dtype=np.float32,
+                                                    chunks=(level_shape[0], level_shape[1], chunk_frames)))
+            intensity = np.empty(shape[2])
+            n_sum = 0
+            mean = np.zeros(shape[:2])
+            m2 = np.zeros(shape[:2])
+            iter_options = dict(plan_options, **{'Block size': block_size})
+            for d in w7x_camera_iter_data(exp_id=exp_id, data_name=data_name, options=iter_options):
+                arr = d.data
+                i_start = n_sum
+                n_block = arr.shape[2]
+                intensity[i_start:i_start + n_block] = arr.sum(axis=(0, 1), dtype=np.float64)
+                # Combining the mean and the sum of squared deviations of the blocks
+                block_mean = arr.mean(axis=2)
+                block_m2 = np.var(arr, axis=2) * n_block
+                delta = block_mean - mean
+                n_sum += n_block
+                mean += delta * (n_block / n_sum)
+                m2 += block_m2 + delta ** 2 * ((n_sum - n_block) * n_block / n_sum)
+                level_arr = arr
+                for (level, dataset) in enumerate(levels, start=1):
+                    level_arr = _bin_block(level_arr, 2)
+                    if (level_arr.shape[2] > 0):
+                        i_level = i_start >> level
+                        dataset[:, :, i_level:i_level + level_arr.shape[2]] = level_arr
+            h5_obj['Mean'] = mean[:, :, np.newaxis].astype(np.float32)
+            h5_obj['Std'] = np.sqrt(m2 / n_sum)[:, :, np.newaxis].astype(np.float32)
+            h5_obj['Intensity'] = intensity[np.newaxis, np.newaxis, :]
+            h5_obj['Time'] = plan['Time vec']
+            if (plan['ETU time vec'] is not None):
+                h5_obj['ETUTime'] = plan['ETU time vec']
+            if (plan['W7X time vec'] is not None):
+                h5_obj['W7XTime'] = plan['W7X time vec']
+            h5_obj.attrs['Version'] = QUICKLOOK_VERSION
+            h5_obj.attrs['Camera'] = plan['Camera']
+            h5_obj.attrs['Info'] = json.dumps(info)
+            h5_obj.attrs['Source path'] = plan['Path']
+            h5_obj.attrs['Source mtime'] = source_st.st_mtime_ns
+            h5_obj.attrs['Source size'] = source_st.st_size
+        os.replace(tmp_path, ql_path)
+    finally:
+        if (os.path.exists(tmp_path)):
+            os.remove(tmp_path)
+    logger.info("Quick-look of %s %s written to %s, %d levels", exp_id, data_name, ql_path, n_levels)
+    return ql_path
+
+
+# Quick-look file contents: {(path, mtime, size): quick-look dictionary}
+_quicklook_cache = _MetadataCache(TIME_CACHE_SIZE)
+
+
+def read_quicklook_info(ql_path, source_path):
+    """
+    Returns the description of a quick-look file or None if it does not exist or
+    was made from an earlier version of source_path. The result is cached:
+        'Path': ql_path
+        'Camera', 'Info': The camera name and the info stored by w7x_camera_quicklook()
+        'Time vec', 'ETU time vec', 'W7X time vec': The time vectors of the recording
+    """
+    try:
+        st = os.stat(ql_path)
+    except FileNotFoundError:
+        return None
+    key = (ql_path, st.st_mtime_ns, st.st_size)
+    ql = _quicklook_cache.get(key)
+    if (ql is None):
+        with _file_pool.file(ql_path) as h5_obj:
+            attrs = dict(h5_obj.attrs)
+            if (attrs.get('Version') != QUICKLOOK_VERSION):
+                logger.warning("Unknown quick-look file version in %s, not used.", ql_path)
+                return None
+            ql = {'Path': ql_path,
+                  'Camera': attrs['Camera'],
+                  'Info': json.loads(attrs['Info']),
+                  'Source mtime': int(attrs['Source mtime']),
+                  'Source size': int(attrs['Source size'])}
+            for (name, key_name) in [('Time', 'Time vec'), ('ETUTime', 'ETU time vec'), ('W7XTime', 'W7X time vec')]:
+                if (name in h5_obj):
+                    ql[key_name] = np.array(h5_obj[name])
+                    ql[key_name].flags.writeable = False
+                else:
+                    ql[key_name] = None
+        _quicklook_cache.put(key, ql)
+    if (_source_changed(ql, source_path)):
+        logger.warning("The quick-look file %s is older than %s, not used.", ql_path, source_path)
+        return None
+    return ql
+
+
+def quicklook_read_plan(ql, product, coordinates, options):
+    """
+    Returns a read plan (see w7x_camera_read_plan()) of a quick-look product.
+    ql: The quick-look file description (see read_quicklook_info())
+    product: 'Mean', 'Std', 'Intensity' or a level number (see w7x_camera_quicklook())
+    coordinates: Time, Image x and Image y ranges to read
+    The frames of the product are averages of groups of frames of the recording,
+    the time coordinates are the mean times of the groups, Sample is the frame
+    number in the product. The Image x and Image y coordinates are the centers
+    of the pixel groups.
+    """
+    info = ql['Info']
+    dims = info['Dims']
+    if (product in ['Mean', 'Std']):
+        h5_path = '/' + product
+        step = (1, 1)
+        factor = dims[2]
+    elif (product == 'Intensity'):
+        h5_path = '/Intensity'
+        step = (dims[0], dims[1])
+        factor = 1
     else:
-        if (type(coordinates) is not list):
-            _coordinates = [coordinates]
+        try:
+            level = int(product)
+        except (TypeError, ValueError):
+            raise ValueError("Quicklook should be 'Mean', 'Std', 'Intensity' or a level number.")
+        if ((level < 1) or (level > info['Levels'])):
+            raise ValueError("Quick-look level should be 1...{:d}.".format(info['Levels']))
+        h5_path = '/Level{:d}'.format(level)
+        step = (2 ** level, 2 ** level)
+        factor = 2 ** level
+    # The time vectors of the frame groups
+    recording = {'Frame vec': np.arange(dims[2]),
+                 'Time vec': ql['Time vec'],
+                 'ETU time vec': ql['ETU time vec'],
+                 'W7X time vec': ql['W7X time vec'],
+                 'Time equidistant': False,
+                 'Frame average': 1}
+    groups = decimate_plan(recording, factor, mode='Average')
+    time_vec_sec = groups['Time vec']
+    product_dims, dtype = dataset_info(ql['Path'], h5_path)
+    frame_vec = np.arange(product_dims[2])
+    window = [[0, product_dims[0]], [0, product_dims[1]]]
+    x, y, image_x_start, image_y_start, binning = image_window([], (info['X Start'], info['Y Start']), dims,
+                                                               binning=step, flip_x=info['Flip x'])
+    image_start = (image_x_start, image_y_start)
+    for coord in coordinates:
+        if (type(coord) is not flap.Coordinate):
+            raise TypeError("Coordinate description should be flap.Coordinate.")
+        if (coord.c_range is None):
+            raise NotImplementedError("At present only simple range selection is supported for {:s}.".format(coord.unit.name))
+        if (coord.unit.name == 'Time'):
+            read_range = [float(coord.c_range[0]), float(coord.c_range[1])]
+            frame_vec = time_range_index(time_vec_sec, time_axis(time_vec_sec), read_range,
+                                         include_end=(ql['Camera'] == 'EDICAM'))
+            if (len(frame_vec) == 0):
+                raise ValueError("No data in time range.")
+        elif (coord.unit.name in ['Image x', 'Image y']):
+            i_dim = 0 if (coord.unit.name == 'Image x') else 1
+            start = max(int(np.ceil((float(coord.c_range[0]) - image_start[i_dim]) / step[i_dim])), 0)
+            end = min(int(np.floor((float(coord.c_range[1]) - image_start[i_dim]) / step[i_dim])) + 1,
+                      product_dims[i_dim])
+            if (end <= start):
+                raise ValueError("No data in {:s} range.".format(coord.unit.name))
+            window[i_dim] = [start, end]
         else:
-            _coordinates = coordinates
+            raise NotImplementedError("Coordinate selection for {:s} is not supported.".format(coord.unit.name))
+
+    frame_vec.flags.writeable = False
+    time_vectors = {}
+    for key in ['Time vec', 'ETU time vec', 'W7X time vec']:
+        if (groups[key] is not None):
+            time_vectors[key] = groups[key][frame_vec]
+        else:
+            time_vectors[key] = None
+    time_equidistant = frames_equidistant(time_axis(time_vec_sec), frame_vec)
+    time_start = None
+    time_step = None
+    if (time_equidistant):
+        time_start = time_vec_sec[frame_vec[0]]
+        time_step = time_vec_sec[frame_vec[0] + 1] - time_vec_sec[frame_vec[0]]
+    return {'Path': ql['Path'],
+            'HDF5 path': h5_path,
+            'Camera': ql['Camera'],
+            'Dims': product_dims,
+            'Dtype': dtype,
+            'Frame vec': frame_vec,
+            'Time vec': time_vectors['Time vec'],
+            'ETU time vec': time_vectors['ETU time vec'],
+            'W7X time vec': time_vectors['W7X time vec'],
+            'Time equidistant': time_equidistant,
+            'Time start': time_start,
+            'Time step': time_step,
+            'Frame average': 1,
+            'x': (window[0][0], window[0][1]),
+            'y': (window[1][0], window[1][1]),
+            'Binning': (1, 1),
+            'Image step': step,
+            'Flip x': False,
+            'Image x start': image_start[0] + window[0][0] * step[0],
+            'Image y start': image_start[1] + window[1][0] * step[1],
+            'Info': info,
+            'Options': options,
+            'Correction': None
+            }
+
+
+# Dark frames and flat fields of whole ROIs in image orientation
+CORRECTION_CACHE_SIZE = 16
+_correction_cache = _MetadataCache(CORRECTION_CACHE_SIZE)
+
+
+def _cached_correction_frame(key, compute):
+    frame = _correction_cache.get(key)
+    if (frame is not None):
+        return frame
+    frame = compute()
+    frame.flags.writeable = False
+    return _correction_cache.put(key, frame)
+
+
+def read_correction_file(path):
+    """
+    Reads a dark frame or flat field from a .npy file, an (Image x, Image y)
+    array of the whole ROI. The frame is cached until the file changes.
+    """
+    key = ('File', os.path.abspath(path), os.stat(path).st_mtime_ns)
+
+    def compute():
+        frame = np.load(path)
+        if (frame.ndim != 2):
+            raise ValueError("The correction frame in {:s} should be 2 dimensional.".format(path))
+        return frame.astype(float)
+
+    return _cached_correction_frame(key, compute)
+
+
+def dark_frame(exp_id, data_name, options, dark_range):
+    """
+    Returns the mean of the frames of a ROI in a time range (e.g. before the
+    discharge), an (Image x, Image y) array of the whole ROI. The frames are
+    read in blocks of READ_BLOCK_SIZE. The result is cached per recording,
+    ROI and time range.
+    options: Merged read options (see w7x_camera_read_plan())
+    dark_range: Time range [s]
+    """
+    dark_options = dict(options)
+    dark_options.update({'Dark': None, 'Flat': None, 'Binning': None, 'Decimate': None, 'Quicklook': None})
+    coord = flap.Coordinate(name='Time', unit='Second', c_range=list(dark_range))
+    plan = w7x_camera_read_plan(exp_id=exp_id, data_name=data_name, options=dark_options, coordinates=[coord])
+    frame_vec = plan['Frame vec']
+    key = ('Dark', plan['Path'], os.stat(plan['Path']).st_mtime_ns, plan['HDF5 path'],
+           int(frame_vec[0]), int(frame_vec[-1]) + 1)
+
+    def compute():
+        n_x = plan['x'][1] - plan['x'][0]
+        n_y = plan['y'][1] - plan['y'][0]
+        block_frames = max(READ_BLOCK_SIZE // max(n_x * n_y * plan['Dtype'].itemsize, 1), 1)
+        frame_sum = np.zeros((n_x, n_y))
+        with _file_pool.dataset(plan['Path'], plan['HDF5 path']) as h5_data:
+            for i_block in range(0, len(frame_vec), block_frames):
+                arr = read_hdf5_arr(h5_data, plan['x'], plan['y'], frame_vec[i_block:i_block + block_frames])
+                frame_sum += arr.sum(axis=2)
+        frame = frame_sum / len(frame_vec)
+        if (plan['Flip x']):
+            frame = np.ascontiguousarray(frame[::-1])
+        return frame
+
+    return _cached_correction_frame(key, compute)
+
+
+def frame_correction(plan, exp_id, data_name, options):
+    """
+    Returns the dark frame and flat field correction of a read plan or None if
+    none is requested in the options (Dark, Flat, Correction dtype, see
+    w7x_camera_get_data()). The correction is a dictionary:
+        'Dark': The dark frame or None
+        'Gain': The inverse of the flat field normalized to 1 mean or None.
+                It is NaN where the flat field is not positive.
+        'Dtype': The dtype of the corrected data
+    The frames are cut to the read window of the plan and are in the orientation
+    of the file, they are used by read_hdf5_arr().
+    """
+    if ((options['Dark'] is None) and (options['Flat'] is None)):
+        return None
+    dtype = np.dtype(options['Correction dtype'])
+    if (dtype.kind != 'f'):
+        raise ValueError("Correction dtype should be a floating point type.")
+    dims = plan['Dims']
+    correction = {'Dtype': dtype, 'Dark': None, 'Gain': None}
+    for name in ['Dark', 'Flat']:
+        spec = options[name]
+        if (spec is None):
+            continue
+        if (isinstance(spec, str)):
+            frame = read_correction_file(spec)
+        elif (np.ndim(spec) == 2):
+            frame = np.asarray(spec, dtype=float)
+        elif ((name == 'Dark') and (np.shape(spec) == (2,))):
+            frame = dark_frame(exp_id, data_name, options, [float(spec[0]), float(spec[1])])
+        else:
+            raise ValueError("{:s} should be a file name or an (Image x, Image y) array{:s}.".format(
+                             name, ' or a time range' if (name == 'Dark') else ''))
+        if (frame.shape != tuple(dims[:2])):
+            raise ValueError("The {:s} frame shape {} is not the ROI shape {}.".format(
+                             name.lower(), frame.shape, tuple(dims[:2])))
+        window = frame
+        if (plan['Flip x']):
+            window = window[::-1]
+        window = window[plan['x'][0]:plan['x'][1], plan['y'][0]:plan['y'][1]]
+        if (name == 'Dark'):
+            correction['Dark'] = np.ascontiguousarray(window, dtype=dtype)
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                gain = np.where(window > 0, frame.mean() / window, np.nan)
+            correction['Gain'] = np.ascontiguousarray(gain, dtype=dtype)
+    return correction
+
+
+# Decoded Photron timing files: {(path, mtime): timing dictionary}
+TIMING_CACHE_SIZE = 64
+_timing_cache = _MetadataCache(TIMING_CACHE_SIZE)
+
+
+def _timing_sidecar(time_fn, cache_dir):
+    """
+    Returns the sidecar file names (without extension) of a timing file in the cache directory.
+    """
+    key = hashlib.sha1(os.path.abspath(time_fn).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, "{:s}_{:s}".format(os.path.splitext(os.path.basename(time_fn))[0], key))
+
+
+def _photron_timing(time_vec_sec, frame_per_trig, rec_rate):
+    trig_times = time_vec_sec[::frame_per_trig]
+    meas_end_times = trig_times + 1. / rec_rate * (frame_per_trig - 1)
+    return {'Time vec': time_vec_sec,
+            'Frame per trig': frame_per_trig,
+            'Rec rate': rec_rate,
+            'Trig times': trig_times,
+            'Meas end times': meas_end_times,
+            'Time axis': time_axis(time_vec_sec)}
+
+
+def read_photron_timing(time_fn, cache_dir=None):
+    """
+    Reads the time vector and the trigger settings from a Photron IDL timing file
+    (*_integ_v1.sav). The last TIMING_CACHE_SIZE results are cached in memory by
+    path and modification time.
+    If cache_dir is set the time vector and the settings are also stored there
+    in a .npy and a .json file, which are read instead of the .sav file while
+    its modification time is unchanged.
+    Returns a dictionary with
+        'Time vec': Time of the frames [s]
+        'Frame per trig': Number of frames recorded after each trigger
+        'Rec rate': Frame rate [Hz]
+        'Trig times', 'Meas end times': Time of the first and last frame after each trigger
+        'Time axis': See time_axis()
+    """
+    try:
+        mtime = os.stat(time_fn).st_mtime_ns
+    except OSError:
+        raise IOError("Error reading file {:s}.".format(time_fn))
+    key = (os.path.abspath(time_fn), mtime)
+    timing = _timing_cache.get(key)
+    if (timing is not None):
+        return timing
+
+    if (cache_dir is not None):
+        sidecar = _timing_sidecar(time_fn, cache_dir)
+        try:
+            with open(sidecar + '.json', 'r') as f:
+                meta = json.load(f)
+            if ((meta['Path'] == os.path.abspath(time_fn)) and (meta['Mtime'] == mtime)):
+                # Not memory mapped, that would keep a file open for each cached timing
+                time_vec_sec = np.load(sidecar + '.npy')
+                time_vec_sec.flags.writeable = False
+                return _timing_cache.put(key, _photron_timing(time_vec_sec, meta['Frame per trig'],
+                                                              meta['Rec rate']))
+        except (OSError, ValueError, KeyError):
+            pass
+
+    try:
+        idldat = io.readsav(time_fn,python_dict=True,verbose=False)
+    except IOError:
+        raise IOError("Error reading file {:s}.".format(time_fn))
+    time_vec_sec = np.asarray(idldat['resa'][0][4], dtype=float)
+    try:
+        frame_per_trig = int(idldat['resa'][0][15]['frame_per_trig'][0])
+    except Exception:
+        dt = time_vec_sec[1:] - time_vec_sec[:-1]
+        ind = np.nonzero(dt > dt[0]*2)[0]
+        if (len(ind) != 0):
+            frame_per_trig = int(ind[0]) + 1
+        else:
+            frame_per_trig = len(time_vec_sec)
+    rec_rate = float(idldat['resa'][0][15]['rec_rate'][0])
+    time_vec_sec.flags.writeable = False
+    timing = _timing_cache.put(key, _photron_timing(time_vec_sec, frame_per_trig, rec_rate))
+
+    if (cache_dir is not None):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_name = "{:s}.{:d}.tmp".format(sidecar, os.getpid())
+        with open(tmp_name, 'wb') as f:
+            np.save(f, time_vec_sec)
+        os.replace(tmp_name, sidecar + '.npy')
+        with open(tmp_name, 'w') as f:
+            json.dump({'Path': os.path.abspath(time_fn),
+                       'Mtime': mtime,
+                       'Frame per trig': frame_per_trig,
+                       'Rec rate': rec_rate}, f)
+        os.replace(tmp_name, sidecar + '.json')
+    return timing
+
+
+# The camera names in the file names
+_CAMERA_FILE_NAMES = {'EDICAM': 'edi', 'PHOTRON': 'phot'}
+
+
+def find_recording(exp_id, data_name, options):
+    """
+    Finds the file of a camera recording.
+    options: The merged options (Datapath, Time and Index path are used)
+    Returns the path of the file and the time of the recording (HHMMSS).
+    """
+    if (options['Time'] == 'All'):
+        raise ValueError("Time='All' is only supported by w7x_camera_get_data().")
+    dp, port, cam_str, date, exp_num = _recording_directory(exp_id, data_name, options)
+    fname, time = find_camera_file(dp, port, cam_str, date, exp_num, options['Time'],
+                                   index_path=options['Index path'])
+    return os.path.join(dp, fname), time
+
+
+def find_recordings(exp_id, data_name, options):
+    """
+    Finds all recordings of a camera in an experiment, e.g. when the recording
+    was restarted during the discharge.
+    options: The merged options (Datapath and Index path are used)
+    Returns a list of (path, time) tuples in the order of the recording times.
+    """
+    dp, port, cam_str, date, exp_num = _recording_directory(exp_id, data_name, options)
+    files = index_camera_directory(dp, index_path=options['Index path'])
+    recordings = []
+    for fname, file_entry in files.items():
+        if ((file_entry['Port'] == port.lower()) and (file_entry['Camera'] == cam_str.lower())
+                and (file_entry['Date'] == date) and (file_entry['Exp num'] == exp_num)):
+            recordings.append((os.path.join(dp, fname), file_entry['Time']))
+    if (len(recordings) == 0):
+        filename_mask = "_".join([port.lower(), cam_str.lower(), date, exp_num, ("*.h5")])
+        raise ValueError("Cannot find any file for this measurement. Filename mask:"+filename_mask+" dp:"+dp)
+    return sorted(recordings, key=lambda recording: recording[1])
+
+
+def photron_timing_file(timing_path, port, date, time):
+    """
+    Returns the path of the IDL timing file of a Photron recording.
+    """
+    time_fn = os.path.join(timing_path, date, "_".join([port.lower(), 'phot', date, time, 'integ', ('v1' + ".sav")]))
+    return time_fn.replace('\\', '/')
+
+
+def _recording_directory(exp_id, data_name, options):
+    """
+    Checks the experiment ID and the data name and returns the data directory,
+    port, camera file name string, date and experiment number.
+    """
+    name_split = data_name.split("_")
+    port = name_split[0]
+    cam_name = name_split[1].upper()
 
     if port is None:
         raise ValueError("Port name and number should be set for W7X camera! (E.g. AEQ20)")
@@ -149,223 +2089,226 @@ def w7x_camera_get_data(exp_id=None, data_name=None, no_data=False, options=None
 
     if cam_name is None:
         raise ValueError("Camera name should be set for W7X camera!")
-    elif cam_name.lower() == "edicam":
-        cam_str = "edi"
-    elif cam_name.lower() == "photron":
-        cam_str = "phot"
-    else:
+    elif cam_name not in _CAMERA_FILE_NAMES:
         raise ValueError("Camera name should be either EDICAM or PHOTRON, not {}.".format(cam_name))
+    cam_str = _CAMERA_FILE_NAMES[cam_name]
 
     if (exp_id is None):
         raise ValueError('Both exp_id should be set for W7X camera.')
     exp_id_split = exp_id.split('.')
     date = exp_id_split[0]
     exp_num = exp_id_split[1]
-    dp = os.path.join(datapath, cam_name.upper(), port.upper(), date)
-    dp_timing = os.path.join(timing_path,date)
-    flist = os.listdir(dp)
+    dp = os.path.join(options['Datapath'], cam_name.upper(), port.upper(), date)
+    return dp, port, cam_str, date, exp_num
 
-    if (time is None):
-        filename_mask = "_".join([port.lower(), cam_str.lower(), date, exp_num, ("*.h5")])
+
+def w7x_camera_read_plan(exp_id=None, data_name=None, options=None, coordinates=None, stats=None):
+    """
+    Finds the file of the measurement, reads the camera configuration and the
+    time vectors and determines the frames and pixels to read.
+    The arguments and options are the same as for w7x_camera_get_data().
+    Returns a dictionary:
+        'Path', 'HDF5 path': The file and the dataset in it
+        'Camera': 'EDICAM' or 'PHOTRON'
+        'Dims', 'Dtype': The shape and dtype of the dataset
+        'Frame vec': The frame numbers to read
+        'Time vec', 'ETU time vec', 'W7X time vec': The time vectors for the frames
+                    in Frame vec (the latter two are None for Photron)
+        'Time equidistant', 'Time start', 'Time step': Equidistant time description
+        'x', 'y', 'Binning', 'Flip x': The read parameters for read_hdf5_arr()
+        'Image x start', 'Image y start': The first Image x and Image y coordinates
+        'Image step': The Image x and Image y step of the pixels
+        'Info': The camera configuration
+        'Options': The merged options
+        'Correction': The dark frame and flat field correction (see frame_correction())
+    stats: Read statistics (see new_read_stats()) to add the stage times to or None.
+    """
+
+    default_options = {'Datapath': 'data',
+                       'Timing path': 'data',
+                       'Time': None,
+                       'Max_size': 4,  # in GB!
+                       'Binning': None,
+                       'Lazy': False,
+                       'Index path': None,
+                       'Timing cache': None,
+                       'Decimate': None,
+                       'Read stats': False,
+                       'Use repack': True,
+                       'Repack path': None,
+                       'Quicklook': None,
+                       'Quicklook path': None,
+                       'Dark': None,
+                       'Flat': None,
+                       'Correction dtype': 'float32'
+                       }
+    _options = flap.config.merge_options(default_options, options, data_source='W7X_CAMERA')
+
+    name_split = data_name.split("_")
+    port = name_split[0]
+    cam_name = name_split[1].upper()
+    roi_num = name_split[2]
+
+    timing_path = _options['Timing path']
+
+    if (coordinates is None):
+        _coordinates = []
     else:
-        filename_mask = "_".join([port.lower(), cam_str.lower(), date, exp_num, (time + ".h5")])
-    fnames = fnmatch.filter(flist, filename_mask)
-    if (len(fnames) > 1):
-        if (time is not None):
-            raise ValueError("Multiple files found, 'Time' option should be set?")
+        if (type(coordinates) is not list):
+            _coordinates = [coordinates]
         else:
-            raise ValueError("Multiple files found:{:s}.".format(os.path.join(dp,filename_mask))) 
-    elif (len(fnames) == 0):
-        if (time is not None):
-            filename_mask = "_".join([port.lower(), cam_str.lower(), date, (time + ".h5")])
-            fnames = fnmatch.filter(flist, filename_mask)
-            if (len(fnames) == 0):
-                raise ValueError("Cannot find any file for this measurement.")
-            else:
-                time = fnames[0].split('_')[3]
-                time = time.split('.')[0]
+            _coordinates = coordinates
+
+    t_stage = stage_time(stats)
+    path, time = find_recording(exp_id, data_name, _options)
+    date = exp_id.split('.')[0]
+    if (_options['Quicklook'] is not None):
+        if ((_options['Dark'] is not None) or (_options['Flat'] is not None)):
+            raise NotImplementedError("Dark frame and flat field correction is not supported for quick-look products.")
+        ql = read_quicklook_info(quicklook_path(path, roi_num, _options['Quicklook path']), path)
+        if (ql is None):
+            raise IOError("No up to date quick-look file for {:s}, see w7x_camera_quicklook().".format(path))
+        plan = quicklook_read_plan(ql, _options['Quicklook'], _coordinates, _options)
+        stage_time(stats, 'File resolution', t_stage)
+        return plan
+    store = None
+    if (_options['Use repack']):
+        store = read_repack_info(repack_path(path, roi_num, _options['Repack path']), path)
+    t_stage = stage_time(stats, 'File resolution', t_stage)
+
+    if (store is not None):
+        # Reading the repacked store instead of the recording
+        logger.debug("Using the repacked store %s", store['Path'])
+        path = store['Path']
+        info = store['Info']
+        time_vec_sec = store['Time vec']
+        time_vec_etu = store['ETU time vec']
+        time_vec_w7x = store['W7X time vec']
+        t_stage = stage_time(stats, 'Time vector load', t_stage)
+        h5_path = '/ROIP/{}/{}Data'.format(roi_num.upper(), roi_num.upper())
+        dims, dtype = dataset_info(path, h5_path)
+        frame_vec = np.arange(len(time_vec_sec))
+        for coord in _coordinates:
+            if (type(coord) is not flap.Coordinate):
+                raise TypeError("Coordinate description should be flap.Coordinate.")
+            if (coord.unit.name == 'Time'):  # assuming the unit to be Second
+                if (coord.c_range is None):
+                    raise NotImplementedError("At present only simple tie range selection is supported.")
+                read_range = [float(coord.c_range[0]),float(coord.c_range[1])]
+                # The Photron time range end is not included
+                frame_vec = time_range_index(time_vec_sec, store['Time axis'], read_range,
+                                             include_end=(cam_name == 'EDICAM'))
+                if (len(frame_vec) == 0):
+                    raise ValueError("No data in time range.")
+            elif (coord.unit.name not in ['Image x', 'Image y']):
+                raise NotImplementedError("Coordinate selection for {:s} is not supported.".format(coord.unit.name))
+        time_vec_sec = time_vec_sec[frame_vec]
+        if (time_vec_etu is not None):
+            time_vec_etu = time_vec_etu[frame_vec]
+        if (time_vec_w7x is not None):
+            time_vec_w7x = time_vec_w7x[frame_vec]
+        if (cam_name == 'PHOTRON'):
+            # Equidistant within one trigger
+            frame_per_trig = info['Frame per trig']
+            time_equidistant = ((frame_vec[0] // frame_per_trig == frame_vec[-1] // frame_per_trig)
+                                and (frame_vec[-1] - frame_vec[0] + 1 == len(frame_vec)))
+            time_step = 1. / info['Rec rate']
         else:
-            raise ValueError("Cannot find file without time parameter. Filename mask:"+filename_mask+" dp:"+dp)
-    else:
-        time = fnames[0].split('_')[4]
-        time = time.split('.')[0]
-        
-    path = os.path.join(dp,fnames[0]) 
-
-    if (cam_name == 'EDICAM'):
+            time_equidistant = frames_equidistant(store['Time axis'], frame_vec)
+            if (time_equidistant):
+                time_step = time_vec_sec[1] - time_vec_sec[0]
+        time_start = time_vec_sec[0]
+        # The Photron flip is applied in the store
+        flip_x = False
+        t_stage = stage_time(stats, 'Frame selection', t_stage)
+    elif (cam_name == 'EDICAM'):
         # Getting the file info
-        with h5py.File(path, 'r') as h5_obj:
-                try:
-                    info = get_camera_config_h5(h5_obj, roi_num)
-                except Exception as e:
-                    print("Camera config is not found:")
-                    print(e)
-                    try:
-                        info = get_camera_config_ascii(path)
-                    except Exception as e:
-                        print("Cannot read the info file!")
-                        print(e)
-                finally:
-                    if info is None:
-                        info = dict()
-    
-        print(info)
+        info = read_camera_settings(path, roi_num, cam_name)
+        t_stage = stage_time(stats, 'Config parse', t_stage)
     
         # Read the time vectors
-        with h5py.File(path, 'r') as h5_obj:
-            try:
-                time_vec_etu = np.array(h5_obj['ROIP']['{}'.format(roi_num.upper())]['{}ETU'.format(roi_num.upper())])
-                #print("ETU time vector found!")
-            except Exception as e:
-                print("Cannot read ETU! Error message:")
-                print(e)
-                time_vec_etu = None
-            try:
-                time_vec_w7x = np.array(h5_obj['ROIP']['{}'.format(roi_num.upper())]['{}W7XTime'.format(roi_num.upper())])
-                #print("W7-X time vector found!")
-            except Exception as e:
-                print("Cannot read W7-X time units (ns)! Error message:")
-                print(e)
-                time_vec_w7x = None
-            
-            if time_vec_w7x is not None:
-                print("Using W7-X time vector [ns] for time vector [s] calculation!")
-                time_vec_sec = (time_vec_w7x - time_vec_w7x[0]) / 1.e9
-            elif time_vec_etu is not None:
-                print("Using ETU time vector [100 ns] for time vector [s] calculation!")
-                time_vec_sec = (time_vec_etu - time_vec_etu[0]) / 1.e7
-            else:
-                print("Cannot find any meaningful time vector!")
-                print("Exiting...")
-                raise IOError("No time vector found!")
+        time_vectors = read_edicam_time(path, roi_num)
+        time_vec_sec = time_vectors['Time vec']
+        time_vec_etu = time_vectors['ETU time vec']
+        time_vec_w7x = time_vectors['W7X time vec']
+        time_axis = time_vectors['Time axis']
+        t_stage = stage_time(stats, 'Time vector load', t_stage)
     
-        # Open the file and check the data path and read the data
-        try:
-            h5_obj = h5py.h5f.open(path.encode('utf-8'))
-            # print(roi_num)
-            h5_path = '/ROIP/{}/{}Data'.format(roi_num.upper(), roi_num.upper())
-            # print("Opening {} with path {}.".format(roi_num.upper(), h5_path))
-            h5_data = h5py.h5d.open(h5_obj, h5_path.encode('utf-8'))
-            # print("Data size: {}.".format(h5_data.shape))
-        except Exception as e:
-            print("Something bad happened:")
-            print(e)
-        
-        # Read the data
-        data_space = h5_data.get_space()
-        dims = data_space.shape
-        if coordinates == None:
-            # Indices contain everything!
-            frame_vec = np.arange(0, dims[2])
-        else:
-            # Take indices from the coordinates!
-            # Only time coordinates are working as of now (2019. June 11.)
-            for coord in _coordinates:
-                if (type(coord) is not flap.Coordinate):
-                    raise TypeError("Coordinate description should be flap.Coordinate.")
-                if (coord.unit.name is 'Time'):  # assuming the unit to be Second
-    #                if (coord.unit.unit is not 'Second'):
-    #                    raise NotImplementedError("Your time coordinate unit is not in Seconds! Cannot use it (yet).")
-                    if (coord.c_range is None):
-                        raise NotImplementedError("At present only simple tie range selection is supported.")
-                    read_range = [float(coord.c_range[0]),float(coord.c_range[1])]
-                    # Since np.where gives back indices, it is the same as the frame_vec
-                    n_frames = len(time_vec_sec)
-                    frame_vec = np.where((time_vec_sec >= read_range[0]) & (time_vec_sec <= read_range[1]))[0]
-                    time_vec_sec = time_vec_sec[frame_vec]
-                    time_vec_etu = time_vec_etu[frame_vec]
-                    time_vec_w7x = time_vec_w7x[frame_vec]
-                else:
-                    raise NotImplementedError("Coordinate selection for image coordinates is not supported yet.")
-            
-            dt = time_vec_sec[1:] - time_vec_sec[0:-1]
-            if (np.nonzero((np.abs(dt[0] - dt) / dt[0]) > 0.001)[0].size == 0):
-                time_equidistant = True
-                time_step = dt[0]
-                time_start = time_vec_sec[0]
-            else:
-                time_equidistant = False
-        # TODO: make this for the spatial coordinates as well! (Binning etc.)
-        x = (0, dims[0])
-        y = (0, dims[1])
-        # We will set data_shape in flap.DataObject to show what the shape would be if data was read
-        if (no_data):
-            data_arr = None
-            data_shape = (dims[0],dims[1],len(frame_vec))
-        else:
-            file_size = os.path.getsize(path)  # in bytes!
-            file_size = file_size / 1024**3  # in GB
-            fraction = len(frame_vec) / n_frames            
-            if file_size * fraction > max_size:
-                print("The expected read size from {} is too large. (size: {} GB, limit: {} GB.)".format(path, file_size * fraction, max_size))
-                raise IOError("File size is too large!")          
-            data_arr = read_hdf5_arr(h5_data, x, y, frame_vec)
-            data_shape = data_arr.shape
-        h5_obj.close()
+        # Check the data path and get the data size
+        h5_path = '/ROIP/{}/{}Data'.format(roi_num.upper(), roi_num.upper())
+        dims, dtype = indexed_dataset_info(path, h5_path, index_path=_options['Index path'])
+        frame_vec = np.arange(len(time_vec_sec))
+        # Take indices from the coordinates!
+        for coord in _coordinates:
+            if (type(coord) is not flap.Coordinate):
+                raise TypeError("Coordinate description should be flap.Coordinate.")
+            if (coord.unit.name == 'Time'):  # assuming the unit to be Second
+#                if (coord.unit.unit is not 'Second'):
+#                    raise NotImplementedError("Your time coordinate unit is not in Seconds! Cannot use it (yet).")
+                if (coord.c_range is None):
+                    raise NotImplementedError("At present only simple tie range selection is supported.")
+                read_range = [float(coord.c_range[0]),float(coord.c_range[1])]
+                frame_vec = time_range_index(time_vec_sec, time_axis, read_range, include_end=True)
+                if (len(frame_vec) == 0):
+                    raise ValueError("No data in time range.")
+            elif (coord.unit.name not in ['Image x', 'Image y']):
+                raise NotImplementedError("Coordinate selection for {:s} is not supported.".format(coord.unit.name))
+        time_vec_sec = time_vec_sec[frame_vec]
+        if (time_vec_etu is not None):
+            time_vec_etu = time_vec_etu[frame_vec]
+        if (time_vec_w7x is not None):
+            time_vec_w7x = time_vec_w7x[frame_vec]
+
+        time_equidistant = frames_equidistant(time_axis, frame_vec)
+        if (time_equidistant):
+            time_step = time_vec_sec[1] - time_vec_sec[0]
+            time_start = time_vec_sec[0]
+        flip_x = False
     elif (cam_name == 'PHOTRON'):
-        time_fn = os.path.join(dp_timing,"_".join([port.lower(), cam_str, date, time, 'integ', ('v1' + ".sav")])) 
-        time_fn = time_fn.replace('\\','/',)
-        try:
-            idldat = io.readsav(time_fn,python_dict=True,verbose=False)
-        except IOError as e:
-            raise IOError("Error reading file {:s}.".format(time_fn))
-        time_vec_sec = idldat['resa'][0][4]
+        time_fn = photron_timing_file(timing_path, port, date, time)
+        timing = read_photron_timing(time_fn, cache_dir=_options['Timing cache'])
+        time_vec_sec = timing['Time vec']
         time_vec_etu = None
         time_vec_w7x = None
-        try:
-            frame_per_trig = idldat['resa'][0][15]['frame_per_trig'][0]
-        except:
-            dt = time_vec_sec[1:] - time_vec_sec[:-1]
-            ind = np.nonzero(dt > dt[0]*2)[0]
-            if (len(ind) != 0):
-                frame_per_trig = ind[0] + 1
-            else:
-                frame_per_trig = len(time_vec_sec)
-        rec_rate = idldat['resa'][0][15]['rec_rate'][0]
-        trig_times = []
-        for i in range(0,len(time_vec_sec),frame_per_trig):
-            trig_times.append(time_vec_sec[i])
-        trig_times = np.array(trig_times)
-        meas_end_times = trig_times + 1. / rec_rate * (frame_per_trig - 1)
-                # Open the file and check the data path and read the data
-        try:
-            h5_obj = h5py.h5f.open(path.encode('utf-8'))
-            # print(roi_num)
-            h5_path = '/ROIP/{}/{}Data'.format(roi_num.upper(), roi_num.upper())
-            # print("Opening {} with path {}.".format(roi_num.upper(), h5_path))
-            h5_data = h5py.h5d.open(h5_obj, h5_path.encode('utf-8'))
-            # print("Data size: {}.".format(h5_data.shape))
-        except Exception as e:
-            print("Something bad happened:")
-            print(e)        
-        data_space = h5_data.get_space()
-        dims = data_space.shape
+        frame_per_trig = timing['Frame per trig']
+        rec_rate = timing['Rec rate']
+        trig_times = timing['Trig times']
+        meas_end_times = timing['Meas end times']
+        t_stage = stage_time(stats, 'Time vector load', t_stage)
+        # Check the data path and get the data size
+        h5_path = '/ROIP/{}/{}Data'.format(roi_num.upper(), roi_num.upper())
+        dims, dtype = indexed_dataset_info(path, h5_path, index_path=_options['Index path'])
         if (dims[2] != len(time_vec_sec)):
-            RuntimeError("Frame number in HDF5 file and time file are different.")
-        n_frames = dims[2]
+            raise RuntimeError("Frame number in HDF5 file and time file are different.")
         for coord in _coordinates:
             if (type(coord) is not flap.Coordinate):
                 raise TypeError("Coordinate description should be flap.Coordinate.")
-            if (coord.unit.name is 'Time'):  # assuming the unit to be Second
+            if (coord.unit.name == 'Time'):  # assuming the unit to be Second
         #                if (coord.unit.unit is not 'Second'):
         #                    raise NotImplementedError("Your time coordinate unit is not in Seconds! Cannot use it (yet).")
                 if (coord.c_range is None):
                     raise NotImplementedError("At present only simple tie range selection is supported.")
                 read_range = [float(coord.c_range[0]),float(coord.c_range[1])]
-                # Since np.where gives back indices, it is the same as the frame_vec
-                frame_vec = np.nonzero(np.logical_and((time_vec_sec >= read_range[0]),(time_vec_sec < read_range[1])))[0]
+                frame_vec = time_range_index(time_vec_sec, timing['Time axis'], read_range, include_end=False)
                 if (len(frame_vec) == 0):
+                    # The frames are recorded only in a window after each trigger
+                    i_trig = int(np.searchsorted(trig_times, read_range[0], side='right')) - 1
+                    if ((i_trig >= 0) and (i_trig + 1 < len(trig_times))
+                            and (read_range[0] > meas_end_times[i_trig])):
+                        raise ValueError("No data in time range, it is between the measurement windows "
+                                         "ending at {:.6f} s and starting at {:.6f} s.".format(
+                                             meas_end_times[i_trig], trig_times[i_trig + 1]))
                     raise ValueError("No data in time range.")
                 start_block = int(frame_vec[0] // frame_per_trig)
                 end_block = int(frame_vec[-1] // frame_per_trig)
-                if (end_block == start_block):
+                if ((end_block == start_block) and (frame_vec[-1] - frame_vec[0] + 1 == len(frame_vec))):
                     time_equidistant  = True
                     time_step = 1./rec_rate
                     time_start = time_vec_sec[frame_vec[0]]
                 else:
                     time_equidistant = False
-            else:
-                raise NotImplementedError("Coordinate selection for image coordinates is not supported yet.")
+            elif (coord.unit.name not in ['Image x', 'Image y']):
+                raise NotImplementedError("Coordinate selection for {:s} is not supported.".format(coord.unit.name))
         try:
             frame_vec
         except NameError:
@@ -374,125 +2317,1334 @@ def w7x_camera_get_data(exp_id=None, data_name=None, no_data=False, options=None
                 time_equidistant = False
             else:
                 time_equidistant = True
+                time_step = 1./rec_rate
+                time_start = time_vec_sec[0]
+        time_vec_sec = time_vec_sec[frame_vec]
+        t_stage = stage_time(stats, 'Frame selection', t_stage)
                    
-        x = (0, dims[0])
-        y = (0, dims[1])
-        info = {}
-        with h5py.File(path, 'r') as h5_obj_config:
-            try:
-                info['X Start'] = h5_obj_config['Settings']['X pos'][0]
-                info['Y Start'] = h5_obj_config['Settings']['Y pos'][0]
-            except Exception as e:
-                raise IOError("Could not find ROI x and y position in HDF5 file.")
-  
-        # We will set data_shape in flap.DataObject to show what the shape would be if data was read
-        if (no_data):
-            data_arr = None
-            data_shape = (dims[0],dims[1],len(frame_vec))
-        else:
-            file_size = os.path.getsize(path)  # in bytes!
-            file_size = file_size / 1024**3  # in GB
-            fraction = len(frame_vec) / n_frames            
-            if file_size * fraction > max_size:
-                print("The expected read size from {} is too large. (size: {} GB, limit: {} GB.)".format(path, file_size * fraction, max_size))
-                raise IOError("File size is too large!")          
-            data_arr = read_hdf5_arr(h5_data, x, y, frame_vec)
-            data_arr = np.flip(data_arr,axis=0)
-            data_shape = data_arr.shape
-        h5_obj.close()
+        settings = read_camera_settings(path, roi_num, cam_name)
+        info = {'X Start': settings['X Start'],
+                'Y Start': settings['Y Start']}
+        info['Frame per trig'] = frame_per_trig
+        info['Rec rate'] = rec_rate
+        t_stage = stage_time(stats, 'Config parse', t_stage)
+        # The Photron images are flipped in x direction after reading
+        flip_x = True
     else:
         raise ValueError("Invalid camera name.")
+
+    x, y, image_x_start, image_y_start, binning = image_window(_coordinates,
+                                                               (int(info['X Start']), int(info['Y Start'])),
+                                                               dims,
+                                                               binning=_options['Binning'],
+                                                               flip_x=flip_x)
+    if (not time_equidistant):
+        time_start = None
+        time_step = None
+    # The coordinates share these arrays
+    frame_vec.flags.writeable = False
+    t_stage = stage_time(stats, 'Frame selection', t_stage)
+
+    plan = {'Path': path,
+            'HDF5 path': h5_path,
+            'Camera': cam_name,
+            'Dims': dims,
+            'Dtype': dtype,
+            'Frame vec': frame_vec,
+            'Time vec': time_vec_sec,
+            'ETU time vec': time_vec_etu,
+            'W7X time vec': time_vec_w7x,
+            'Time equidistant': time_equidistant,
+            'Time start': time_start,
+            'Time step': time_step,
+            'Frame average': 1,
+            'x': x,
+            'y': y,
+            'Binning': binning,
+            'Image step': binning,
+            'Flip x': flip_x,
+            'Image x start': image_x_start,
+            'Image y start': image_y_start,
+            'Info': info,
+            'Options': _options,
+            'Correction': None
+            }
+    plan['Correction'] = frame_correction(plan, exp_id, data_name, _options)
+    return plan
+
+
+def camera_coordinates(plan, index=None):
+    """
+    Creates the flap coordinates for the frames plan['Frame vec'][index]
+    of a read plan (see w7x_camera_read_plan()).
+    index: A slice, None means all frames.
+    The coordinate values are read only views of the arrays of the plan, they
+    are not copied.
+    """
+    if (index is None):
+        index = slice(0, len(plan['Frame vec']))
+    frame_vec = plan['Frame vec'][index]
+    time_vec_sec = plan['Time vec'][index]
+    time_vec_etu = plan['ETU time vec']
+    time_vec_w7x = plan['W7X time vec']
+    image_step = plan['Image step']
+
     coord = []
-    # TODO: check for equidistant time coordinates!
-    if (time_equidistant):
-        coord.append(copy.deepcopy(flap.Coordinate(name='Time',
-                                                   unit='Second',
-                                                   mode=flap.CoordinateMode(equidistant=True),
-                                                   start = time_start, 
-                                                   step = time_step,
-                                                   shape=[],
-                                                   dimension_list=[2]
-                                                   )
-                                    )          
-                    )
+    if (plan['Time equidistant']):
+        coord.append(flap.Coordinate(name='Time',
+                                     unit='Second',
+                                     mode=flap.CoordinateMode(equidistant=True),
+                                     start = plan['Time start'] + index.indices(len(plan['Frame vec']))[0] * plan['Time step'],
+                                     step = plan['Time step'],
+                                     shape=[],
+                                     dimension_list=[2]
+                                     )
+                     )
     else:
-        coord.append(copy.deepcopy(flap.Coordinate(name='Time',
-                                                   unit='Second',
-                                                   mode=flap.CoordinateMode(equidistant=False),
-                                                   values = time_vec_sec, 
-                                                   shape=time_vec_sec.shape,
-                                                   dimension_list=[2]
-                                                   )
-                                    )          
-                    )
+        coord.append(flap.Coordinate(name='Time',
+                                     unit='Second',
+                                     mode=flap.CoordinateMode(equidistant=False),
+                                     values = time_vec_sec, 
+                                     shape=time_vec_sec.shape,
+                                     dimension_list=[2]
+                                     )
+                     )
         
         
     if (time_vec_etu is not None):
-        coord.append(copy.deepcopy(flap.Coordinate(name='ETUTime',
-                                                   unit='ETU',
-                                                   mode=flap.CoordinateMode(equidistant=False),
-                                                   values=time_vec_etu,
-                                                   shape=time_vec_etu.shape,
-                                                   dimension_list=[2]
-                                                   )
-                                   )
-                    )
+        time_vec_etu = time_vec_etu[index]
+        coord.append(flap.Coordinate(name='ETUTime',
+                                     unit='ETU',
+                                     mode=flap.CoordinateMode(equidistant=False),
+                                     values=time_vec_etu,
+                                     shape=time_vec_etu.shape,
+                                     dimension_list=[2]
+                                     )
+                     )
     
     if (time_vec_w7x is not None):
-        coord.append(copy.deepcopy(flap.Coordinate(name='W7XTime',
-                                                   unit='Nanosecond',
-                                                   mode=flap.CoordinateMode(equidistant=False),
-                                                   values=time_vec_w7x,
-                                                   shape=time_vec_w7x.shape,
-                                                   dimension_list=[2]
-                                                   )
-                                    )
-                    )
-    coord.append(copy.deepcopy(flap.Coordinate(name='Sample',
-                                               unit='',
-                                               mode=flap.CoordinateMode(equidistant=False),
-                                               values=frame_vec,
-                                               shape=frame_vec.shape,
-                                               dimension_list=[2]
-                                               )
-                              )
-                )
-    coord.append(copy.deepcopy(flap.Coordinate(name='Image x',
-                                               unit='Pixel',
-                                               mode=flap.CoordinateMode(equidistant=True),
-                                               start=int(info['X Start']),
-                                               step=int(1),
-                                               shape=[],
-                                               dimension_list=[0]
-                                               )
-                              )
-                )
-    coord.append(copy.deepcopy(flap.Coordinate(name='Image y',
-                                               unit='Pixel',
-                                               mode=flap.CoordinateMode(equidistant=True),
-                                               start=int(info['Y Start']),
-                                               step=int(1),
-                                               shape=[],
-                                               dimension_list=[1]
-                                               )
-                              )
+        time_vec_w7x = time_vec_w7x[index]
+        coord.append(flap.Coordinate(name='W7XTime',
+                                     unit='Nanosecond',
+                                     mode=flap.CoordinateMode(equidistant=False),
+                                     values=time_vec_w7x,
+                                     shape=time_vec_w7x.shape,
+                                     dimension_list=[2]
+                                     )
+                     )
+    coord.append(flap.Coordinate(name='Sample',
+                                 unit='',
+                                 mode=flap.CoordinateMode(equidistant=False),
+                                 values=frame_vec,
+                                 shape=frame_vec.shape,
+                                 dimension_list=[2]
+                                 )
+                 )
+    coord.append(flap.Coordinate(name='Image x',
+                                 unit='Pixel',
+                                 mode=flap.CoordinateMode(equidistant=True),
+                                 start=plan['Image x start'],
+                                 step=image_step[0],
+                                 shape=[],
+                                 dimension_list=[0]
+                                 )
                  )
+    coord.append(flap.Coordinate(name='Image y',
+                                 unit='Pixel',
+                                 mode=flap.CoordinateMode(equidistant=True),
+                                 start=plan['Image y start'],
+                                 step=image_step[1],
+                                 shape=[],
+                                 dimension_list=[1]
+                                 )
+                 )
+    return coord
+
+
+def read_plan_data(plan, out=None, stats=None):
+    """
+    Reads the data of a read plan (see w7x_camera_read_plan()) and applies the
+    x flip for Photron in place.
+    out: Array to read the data into (see read_hdf5_arr()). If None a new array
+         is allocated.
+    stats: Read statistics (see new_read_stats()) to update or None.
+    The peak memory use is the size of the result plus one block of frames
+    (binning, non-consecutive frames) or one row (x flip).
+    """
+    with _file_pool.dataset(plan['Path'], plan['HDF5 path']) as h5_data:
+        data_arr = read_hdf5_arr(h5_data, plan['x'], plan['y'], plan['Frame vec'],
+                                 binning=plan['Binning'], out=out, average=plan['Frame average'],
+                                 stats=stats, cache=_active_frame_cache(), correction=plan['Correction'])
+    if (plan['Flip x']):
+        flip_x_inplace(data_arr)
+    return data_arr
+
+
+def plan_data_shape(plan):
+    """
+    Returns the shape of the data read by a read plan.
+    """
+    return ((plan['x'][1] - plan['x'][0]) // plan['Binning'][0],
+            (plan['y'][1] - plan['y'][0]) // plan['Binning'][1],
+            len(plan['Frame vec']))
+
+
+def plan_data_size(plan):
+    """
+    Returns the size of the data read by a read plan in bytes.
+    This is calculated from the dtype and the extent of the read window, the file
+    size is not used.
+    """
+    if (plan['Correction'] is not None):
+        itemsize = plan['Correction']['Dtype'].itemsize
+    elif ((tuple(plan['Binning']) != (1, 1)) or (plan['Frame average'] > 1)):
+        itemsize = np.dtype(float).itemsize
+    else:
+        itemsize = plan['Dtype'].itemsize
+    return int(np.prod(plan_data_shape(plan))) * itemsize
+
+
+def decimate_plan(plan, factor, mode='Stride'):
+    """
+    Returns a copy of a read plan which reads only every factor-th frame.
+    mode: 'Stride': Reads frames 0, factor, 2*factor, ... of the plan.
+          'Average': Reads the averages of groups of factor consecutive frames,
+                     the last incomplete group is dropped. The time coordinates
+                     are the mean time of the groups, Sample is the first frame
+                     of the groups.
+    """
+    factor = int(factor)
+    if (factor < 1):
+        raise ValueError("Decimation factor should be positive.")
+    if (mode not in ['Stride', 'Average']):
+        raise ValueError("Decimation mode should be 'Stride' or 'Average'.")
+    if (plan['Frame average'] != 1):
+        raise ValueError("The read plan is already averaged.")
+    new_plan = dict(plan)
+    if (factor == 1):
+        return new_plan
+    if (mode == 'Stride'):
+        new_plan['Frame vec'] = plan['Frame vec'][::factor]
+
+        def decimate(vec):
+            return vec[::factor]
+    else:
+        if (np.any(np.diff(plan['Frame vec']) != 1)):
+            raise ValueError("Frame averaging needs consecutive frames.")
+        n_groups = len(plan['Frame vec']) // factor
+        if (n_groups == 0):
+            raise ValueError("Less frames than the decimation factor.")
+        new_plan['Frame vec'] = plan['Frame vec'][:n_groups * factor:factor]
+        new_plan['Frame average'] = factor
+
+        def decimate(vec):
+            groups = vec[:n_groups * factor].reshape(n_groups, factor)
+            if (vec.dtype.kind == 'f'):
+                return groups.mean(axis=1)
+            # Integer time stamps (ETU, ns) are averaged relative to the first one
+            # to keep the precision
+            offsets = (groups - groups[:, :1]).astype(np.int64)
+            return groups[:, 0] + np.round(offsets.mean(axis=1)).astype(vec.dtype)
+    for key in ['Time vec', 'ETU time vec', 'W7X time vec']:
+        if (plan[key] is not None):
+            new_plan[key] = decimate(plan[key])
+    if (plan['Time equidistant']):
+        if (mode == 'Average'):
+            new_plan['Time start'] = plan['Time start'] + (factor - 1) / 2 * plan['Time step']
+        new_plan['Time step'] = plan['Time step'] * factor
+    return new_plan
+
+
+def decimation_factor(plan, max_bytes, mode='Stride'):
+    """
+    Returns the smallest decimation factor (see decimate_plan()) with which the
+    data of a read plan fits into max_bytes.
+    """
+    n_frames = len(plan['Frame vec'])
+    shape = plan_data_shape(plan)
+    if (mode == 'Average'):
+        frame_bytes = shape[0] * shape[1] * np.dtype(float).itemsize
+    else:
+        frame_bytes = plan_data_size(plan) / max(n_frames, 1)
+    max_frames = int(max_bytes // frame_bytes)
+    if (max_frames < 1):
+        raise IOError("One frame is larger than the size limit.")
+    return max(-(-n_frames // max_frames), 1)
 
+
+def camera_data_object(plan, data_arr, exp_id, data_name, data_shape=None, stats=None):
+    """
+    Creates the flap.DataObject from the data read by a read plan.
+    stats: Read statistics to put into the info as 'Read stats' or None.
+    """
+    if (data_shape is None):
+        data_shape = data_arr.shape
     data_title = "W7-X CAMERA data: {}".format(data_name)
+    info = {'Options':plan['Options'], 'Data name': data_name}
+    if (stats is not None):
+        info['Read stats'] = stats
     d = flap.DataObject(data_array=data_arr,
                         data_shape=data_shape,
                         data_unit=flap.Unit(name='Frame', unit='Digit'),
-                        coordinates=coord,
+                        coordinates=camera_coordinates(plan),
                         exp_id=exp_id,
                         data_title=data_title,
-                        info={'Options':_options},
+                        info=info,
+                        data_source="W7X_CAMERA")
+    return d
+
+
+# Functions called with the read statistics after each w7x_camera_get_data() call
+_read_hooks = []
+
+
+def add_read_hook(hook):
+    """
+    Registers a function which is called as hook(stats) after each w7x_camera_get_data()
+    call. stats is the read statistics dictionary (see new_read_stats()) with
+    'Exp id', 'Data name' and 'Path' added.
+    """
+    if (not callable(hook)):
+        raise TypeError("The read hook should be callable.")
+    if (hook not in _read_hooks):
+        _read_hooks.append(hook)
+
+
+def remove_read_hook(hook):
+    """
+    Removes a function registered with add_read_hook().
+    """
+    if (hook in _read_hooks):
+        _read_hooks.remove(hook)
+
+
+def _report_read_stats(stats):
+    logger.debug("Read %s %s from %s: %d bytes in %d HDF5 read calls, peak buffer %d bytes, stages: %s",
+                 stats['Exp id'], stats['Data name'], stats['Path'], stats['Bytes read'],
+                 stats['Read calls'], stats['Peak buffer'],
+                 ", ".join(["{:s} {:.2f} ms".format(name, t * 1000) for (name, t) in stats['Stages'].items()]))
+    for hook in list(_read_hooks):
+        try:
+            hook(stats)
+        except Exception as e:
+            logger.warning("Read hook %r failed: %s", hook, e)
+
+
+def w7x_camera_get_data(exp_id=None, data_name=None, no_data=False, options=None, coordinates=None, data_source=None):
+    """ Data read function for the W7-X EDICAM and Photron cameras (HDF5 format)
+    data_name: Usually AEQ21_PHOTRON_ROIPx, ... (string) depending on configuration file
+    exp_id: Experiment ID, YYYYMMDD.xxx, e.g. 20181018.016
+    Options:
+            Datapath: the base path at which the camera files can be found (e.g. /data/W7X)
+            Time: the date and time the recording was made: 123436 (12:34:36)
+                  'All': All recordings of the experiment are read and
+                         concatenated in time (see w7x_camera_get_data_concat())
+            Camera name: either EDICAM or PHOTRON
+            Port: the port number the camera was used, e.g. AEQ20
+            Binning: Number of pixels to average on read in the Image x and Image y
+                     directions. Either one integer for both or [x, y].
+            Max_size: Maximum size of the data to read [GB]. The size is calculated
+                      from the read window and the data type.
+            Decimate: What to do if the data is larger than Max_size:
+                      None: Raise IOError
+                      'Stride': Read only every n-th frame
+                      'Average': Read the average of n consecutive frames (float)
+                      n is the smallest number for which the data fits Max_size.
+                      The Time, ETUTime, W7XTime and Sample coordinates are those of
+                      the read frames (see decimate_plan()).
+            Lazy: If True the data is not read, the data of the DataObject is a
+                  LazyCameraArray which reads only the indexed frames and pixels.
+                  Max_size does not apply.
+            Index path: Directory storing the shot index, one JSON file per data
+                        directory (see index_camera_directory()). If None the
+                        index is kept only in memory. The index also holds the
+                        dataset shapes and dtypes (see indexed_dataset_info()).
+            Timing cache: Directory for the decoded Photron timing files
+                          (see read_photron_timing()). If None they are cached
+                          only in memory.
+            Output array: A C contiguous numpy array to read the data into, it
+                          becomes the data of the DataObject. Its shape and dtype
+                          should be those of the result (use no_data=True to get
+                          the shape, the dtype is the file dtype, float with
+                          binning or Correction dtype with correction). If None
+                          a new array is allocated.
+            Read stats: If True the read statistics (stage times, bytes read, number of
+                        HDF5 read calls, peak buffer size, see new_read_stats()) are
+                        put into the info of the DataObject as 'Read stats'. They are
+                        always logged at DEBUG level and passed to the functions
+                        registered with add_read_hook().
+            Use repack: If True and there is an up to date repacked store of the
+                        ROI (see w7x_camera_repack()) it is read instead of the
+                        recording.
+            Repack path: Directory of the repacked stores. If None they are
+                         next to the recordings.
+            Quicklook: If not None a quick-look product is read instead of the
+                       recording: 'Mean', 'Std', 'Intensity' or a downsampled movie
+                       level number (see w7x_camera_quicklook()). The Time, Image x
+                       and Image y coordinates are those of the product.
+            Quicklook path: Directory of the quick-look files. If None they are
+                            next to the recordings.
+            Dark: Dark frame to subtract from the frames:
+                  [t1, t2]: The mean of the frames of the ROI in this time
+                            range [s], e.g. before the discharge
+                  A .npy file name or an (Image x, Image y) array of the whole ROI
+                  None: No dark frame subtraction
+            Flat: Flat field (dark subtracted) to divide the frames with, a .npy
+                  file name or an (Image x, Image y) array of the whole ROI. It is
+                  normalized to 1 mean, pixels where it is not positive become NaN.
+            Correction dtype: The dtype of the data with Dark or Flat (float32
+                              or float64). The correction is applied to the raw
+                              frames block by block during the read, before binning
+                              and frame averaging. The dark and flat frames are
+                              cached per recording and ROI.
+    Coordinates:
+            Time: Time range to read [s]
+            Image x, Image y: Pixel ranges to read. Only the necessary window is read
+                              from the file.
+    Repeated and overlapping reads can be served from a frame block cache,
+    see set_frame_cache_size().
+    """
+
+
+    if (flap.config.merge_options({'Time': None}, options, data_source='W7X_CAMERA')['Time'] == 'All'):
+        return w7x_camera_get_data_concat(exp_id=exp_id, data_name=data_name, no_data=no_data,
+                                          options=options, coordinates=coordinates)
+
+    # The output array is taken from the options directly so that it is not
+    # copied by the option handling or stored in the DataObject info
+    out = None
+    if (options is not None):
+        out = options.get('Output array')
+        options = {key: options[key] for key in options if key != 'Output array'}
+    stats = new_read_stats()
+    plan = w7x_camera_read_plan(exp_id=exp_id, data_name=data_name, options=options, coordinates=coordinates,
+                                stats=stats)
+    t_stage = stage_time(stats)
+    _options = plan['Options']
+    x = plan['x']
+    y = plan['y']
+    binning = plan['Binning']
+    path = plan['Path']
+    max_size = _options['Max_size']
+
+    if (not _options['Lazy']):
+        size = plan_data_size(plan) / 1024**3  # in GB
+        if (size > max_size):
+            if (_options['Decimate'] is not None):
+                factor = decimation_factor(plan, max_size * 1024**3, _options['Decimate'])
+                logger.info("The expected read size from %s is too large. (size: %s GB, limit: %s GB.) Decimating by %d.",
+                            path, size, max_size, factor)
+                plan = decimate_plan(plan, factor, mode=_options['Decimate'])
+            elif (not no_data):
+                logger.error("The expected read size from %s is too large. (size: %s GB, limit: %s GB.)", path, size, max_size)
+                raise IOError("File size is too large!")
+    frame_vec = plan['Frame vec']
+    t_stage = stage_time(stats, 'Frame selection', t_stage)
+
+    # We will set data_shape in flap.DataObject to show what the shape would be if data was read
+    if (no_data):
+        data_arr = None
+        data_shape = plan_data_shape(plan)
+    elif (_options['Lazy']):
+        if (plan['Correction'] is not None):
+            raise NotImplementedError("Dark frame and flat field correction is not supported for lazy reads.")
+        data_arr = LazyCameraArray(path, plan['HDF5 path'], x, y, frame_vec, binning=binning, flip_x=plan['Flip x'])
+        data_shape = data_arr.shape
+    else:
+        data_arr = read_plan_data(plan, out=out, stats=stats)
+        data_shape = data_arr.shape
+    t_stage = stage_time(stats, 'HDF5 read', t_stage)
+
+    d = camera_data_object(plan, data_arr, exp_id, data_name, data_shape=data_shape,
+                           stats=stats if _options['Read stats'] else None)
+    stage_time(stats, 'DataObject construction', t_stage)
+    stats['Exp id'] = exp_id
+    stats['Data name'] = data_name
+    stats['Path'] = plan['Path']
+    _report_read_stats(stats)
+    return d
+
+
+def w7x_camera_iter_data(exp_id=None, data_name=None, options=None, coordinates=None):
+    """
+    Reads the data in consecutive blocks of frames. This is a generator yielding
+    a flap.DataObject for each block with the Time, ETUTime, W7XTime and Sample
+    coordinates of the block. The next block is read on a background thread while
+    the caller processes the current one.
+    The arguments and options are the same as for w7x_camera_get_data(),
+    Max_size and Lazy are not used. Further options:
+        Block size: Number of frames in a block. If None the block size is
+                    set from READ_BLOCK_SIZE.
+        Prefetch: If False the blocks are read only when requested.
+    """
+    default_options = {'Block size': None,
+                       'Prefetch': True}
+    _options = flap.config.merge_options(default_options, options, data_source='W7X_CAMERA')
+    plan = w7x_camera_read_plan(exp_id=exp_id, data_name=data_name, options=options, coordinates=coordinates)
+    x = plan['x']
+    y = plan['y']
+    binning = plan['Binning']
+    frame_vec = plan['Frame vec']
+    n_frames = len(frame_vec)
+    block_size = _options['Block size']
+    if (block_size is None):
+        # Assuming 8 byte pixels, binned data is float
+        block_size = max(READ_BLOCK_SIZE // ((x[1] - x[0]) * (y[1] - y[0]) * 8), 1)
+    block_size = int(block_size)
+    if (block_size < 1):
+        raise ValueError("Block size should be positive.")
+
+    with _file_pool.dataset(plan['Path'], plan['HDF5 path']) as h5_data:
+
+        def read_block(i_start):
+            arr = read_hdf5_arr(h5_data, x, y, frame_vec[i_start:i_start + block_size],
+                                binning=binning, average=plan['Frame average'],
+                                cache=_active_frame_cache(), correction=plan['Correction'])
+            if (plan['Flip x']):
+                flip_x_inplace(arr)
+            return arr
+
+        executor = None
+        if (_options['Prefetch']):
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            if (executor is not None):
+                future = executor.submit(read_block, 0)
+            for i_start in range(0, n_frames, block_size):
+                if (executor is not None):
+                    data_arr = future.result()
+                    if (i_start + block_size < n_frames):
+                        future = executor.submit(read_block, i_start + block_size)
+                else:
+                    data_arr = read_block(i_start)
+                d = flap.DataObject(data_array=data_arr,
+                                    data_unit=flap.Unit(name='Frame', unit='Digit'),
+                                    coordinates=camera_coordinates(plan, slice(i_start, i_start + data_arr.shape[2])),
+                                    exp_id=exp_id,
+                                    data_title="W7-X CAMERA data: {}".format(data_name),
+                                    info={'Options': plan['Options'], 'Data name': data_name},
+                                    data_source="W7X_CAMERA")
+                yield d
+        finally:
+            if (executor is not None):
+                executor.shutdown(wait=True)
+
+
+def w7x_camera_follow(exp_id=None, data_name=None, options=None, coordinates=None):
+    """
+    Follows an EDICAM recording which is being written during a discharge. The file
+    is opened in HDF5 SWMR (single writer multiple readers) read mode and the
+    extents of the datasets are polled. This is a generator yielding a
+    flap.DataObject with the frames appended since the previous one, with their
+    Time, ETUTime, W7XTime and Sample coordinates. A frame is returned when its
+    data and time stamps are in the file.
+    The arguments and options are the same as for w7x_camera_get_data(), a Time
+    coordinate range skips the frames before it and stops after it. The Time
+    coordinate is relative to the first frame of the recording.
+    Further options:
+        Poll interval: Time between checks for new frames [s].
+        Timeout: Stop if no new frame arrived for this long [s]. None means
+                 follow until the caller stops.
+        Skip existing: If True the frames already in the file are not returned.
+        Block size: Maximum number of frames in one DataObject. If None the
+                    block size is set from READ_BLOCK_SIZE.
+    """
+    default_options = {'Datapath': 'data',
+                       'Time': None,
+                       'Index path': None,
+                       'Binning': None,
+                       'Poll interval': 0.05,
+                       'Timeout': 10.,
+                       'Skip existing': False,
+                       'Block size': None}
+    _options = flap.config.merge_options(default_options, options, data_source='W7X_CAMERA')
+    cam_name = data_name.split("_")[1].upper()
+    roi_num = data_name.split("_")[2]
+    if (cam_name != 'EDICAM'):
+        raise NotImplementedError("Following a recording is only supported for EDICAM.")
+    if (coordinates is None):
+        _coordinates = []
+    elif (type(coordinates) is not list):
+        _coordinates = [coordinates]
+    else:
+        _coordinates = coordinates
+    read_range = None
+    for coord in _coordinates:
+        if (type(coord) is not flap.Coordinate):
+            raise TypeError("Coordinate description should be flap.Coordinate.")
+        if (coord.unit.name == 'Time'):
+            if (coord.c_range is None):
+                raise NotImplementedError("At present only simple tie range selection is supported.")
+            read_range = [float(coord.c_range[0]), float(coord.c_range[1])]
+        elif (coord.unit.name not in ['Image x', 'Image y']):
+            raise NotImplementedError("Coordinate selection for {:s} is not supported.".format(coord.unit.name))
+
+    path = find_recording(exp_id, data_name, _options)[0]
+    # The file cannot be open in normal and SWMR mode at the same time
+    _file_pool.discard(path)
+    roi = roi_num.upper()
+    h5_obj = h5py.File(path, 'r', libver='latest', swmr=True)
+    try:
+        info = get_camera_config_h5(h5_obj, roi_num)
+        data = h5_obj['ROIP'][roi][roi + 'Data']
+        time_data = []
+        for name in [roi + 'ETU', roi + 'W7XTime']:
+            if (name in h5_obj['ROIP'][roi]):
+                time_data.append(h5_obj['ROIP'][roi][name])
+            else:
+                time_data.append(None)
+        if ((time_data[0] is None) and (time_data[1] is None)):
+            raise IOError("No time vector found!")
+        dims = data.shape
+        x, y, image_x_start, image_y_start, binning = image_window(_coordinates,
+                                                                   (int(info['X Start']), int(info['Y Start'])),
+                                                                   dims, binning=_options['Binning'])
+        block_size = _options['Block size']
+        if (block_size is None):
+            block_size = max(READ_BLOCK_SIZE // ((x[1] - x[0]) * (y[1] - y[0]) * 8), 1)
+        block_size = int(block_size)
+        if (block_size < 1):
+            raise ValueError("Block size should be positive.")
+
+        # The first time stamp and its unit [1/s]
+        time_first = None
+        n_done = None
+        t_last = time.monotonic()
+        while (True):
+            data.refresh()
+            n_available = data.shape[2]
+            for dataset in time_data:
+                if (dataset is not None):
+                    dataset.refresh()
+                    n_available = min(n_available, dataset.shape[0])
+            if (n_done is None):
+                n_done = n_available if _options['Skip existing'] else 0
+            if ((time_first is None) and (n_available > 0)):
+                if (time_data[1] is not None):
+                    time_first = (time_data[1][0], 1.e9)
+                else:
+                    time_first = (time_data[0][0], 1.e7)
+            if (n_available > n_done):
+                n_new = min(n_available - n_done, block_size)
+                frame_vec = np.arange(n_done, n_done + n_new)
+                time_vectors = [None if (dataset is None) else dataset[n_done:n_done + n_new]
+                                for dataset in time_data]
+                ref = time_vectors[1] if (time_vectors[1] is not None) else time_vectors[0]
+                time_vec_sec = (ref - time_first[0]) / time_first[1]
+                n_done += n_new
+                t_last = time.monotonic()
+                ind = slice(0, n_new)
+                stop = False
+                if (read_range is not None):
+                    in_range = np.nonzero((time_vec_sec >= read_range[0]) & (time_vec_sec <= read_range[1]))[0]
+                    stop = (time_vec_sec[-1] > read_range[1])
+                    if (len(in_range) == 0):
+                        if (stop):
+                            return
+                        continue
+                    ind = slice(in_range[0], in_range[-1] + 1)
+                frame_vec = frame_vec[ind]
+                arr = read_hdf5_arr(data.id, x, y, frame_vec, binning=binning)
+                plan = {'Frame vec': frame_vec,
+                        'Time vec': time_vec_sec[ind],
+                        'ETU time vec': None if (time_vectors[0] is None) else time_vectors[0][ind],
+                        'W7X time vec': None if (time_vectors[1] is None) else time_vectors[1][ind],
+                        'Time equidistant': False,
+                        'Image x start': image_x_start,
+                        'Image y start': image_y_start,
+                        'Image step': binning}
+                yield flap.DataObject(data_array=arr,
+                                      data_unit=flap.Unit(name='Frame', unit='Digit'),
+                                      coordinates=camera_coordinates(plan),
+                                      exp_id=exp_id,
+                                      data_title="W7-X CAMERA data: {}".format(data_name),
+                                      info={'Options': _options, 'Data name': data_name},
+                                      data_source="W7X_CAMERA")
+                if (stop):
+                    return
+                continue
+            if ((_options['Timeout'] is not None) and (time.monotonic() - t_last > _options['Timeout'])):
+                return
+            time.sleep(_options['Poll interval'])
+    finally:
+        h5_obj.close()
+
+
+def _segment_power(plan, i_seg_start, i_seg_end, n_per_seg, seg_step, window, f_ind, trend_removal):
+    """
+    Reads the frames of segments i_seg_start...i_seg_end-1 and returns the sum
+    and the sum of squares of their (unscaled) power spectra at the frequencies
+    f_ind (a slice), (x, y, frequency) arrays.
+    """
+    frame_start = i_seg_start * seg_step
+    frame_end = (i_seg_end - 1) * seg_step + n_per_seg
+    with _file_pool.dataset(plan['Path'], plan['HDF5 path']) as h5_data:
+        arr = read_hdf5_arr(h5_data, plan['x'], plan['y'], plan['Frame vec'][frame_start:frame_end],
+                            binning=plan['Binning'], average=plan['Frame average'],
+                            correction=plan['Correction'])
+    # (x, y, segment, frame) view of the overlapping segments
+    segments = np.lib.stride_tricks.sliding_window_view(arr, n_per_seg, axis=2)[:, :, ::seg_step]
+    # The spectra are calculated for groups of segments to limit the temporary arrays
+    group = max(READ_BLOCK_SIZE // (arr.shape[0] * arr.shape[1] * n_per_seg * 16), 1)
+    window_spectrum = np.fft.rfft(window)[f_ind]
+    power_sum = np.zeros((arr.shape[0], arr.shape[1], len(window_spectrum)))
+    power2_sum = np.zeros((arr.shape[0], arr.shape[1], len(window_spectrum)))
+    for i_group in range(0, segments.shape[2], group):
+        seg_group = segments[:, :, i_group:i_group + group]
+        spectra = np.fft.rfft(seg_group * window, axis=3)[..., f_ind]
+        if (trend_removal == 'Mean'):
+            # Subtracting the mean before windowing is subtracting the mean times
+            # the window spectrum after the transform
+            spectra -= seg_group.mean(axis=3, keepdims=True) * window_spectrum
+        power = np.abs(spectra) ** 2
+        power_sum += power.sum(axis=2)
+        power2_sum += (power ** 2).sum(axis=2)
+    return power_sum, power2_sum
+
+
+def w7x_camera_apsd(exp_id=None, data_name=None, options=None, coordinates=None):
+    """
+    Calculates the auto power spectral density of the time signal of each pixel
+    (Welch method) without reading the whole movie into memory.
+    The frames are read in blocks of whole segments, the segment spectra are
+    calculated for all pixels at once and summed up. The blocks are read and
+    processed in parallel threads.
+    The arguments and options are the same as for w7x_camera_get_data(), use the
+    Binning option to average pixels before the spectrum calculation. The time
+    axis of the selected frames should be equidistant (for Photron select a Time
+    range within one trigger). Further options:
+        Resolution: Frequency resolution [Hz], the segment length is sampling
+                    frequency / Resolution frames.
+        Range: Frequency range [Hz] to return, None means all frequencies.
+        Hanning: If True a Hanning window is applied to the segments and they
+                 overlap by half of their length.
+        Trend removal: 'Mean' subtracts the segment mean, None does nothing.
+        Error calculation: If True the error of the DataObject is the standard
+                           error of the mean of the segment spectra.
+        Workers: Number of threads. None means the number of CPUs.
+    Returns a flap.DataObject with (Image x, Image y, Frequency) shape. The spectra
+    are one sided and normalized so that their integral over frequency is the
+    mean square of the signal.
+    """
+    default_options = {'Resolution': 1000.,
+                       'Range': None,
+                       'Hanning': True,
+                       'Trend removal': 'Mean',
+                       'Error calculation': True,
+                       'Workers': None}
+    _options = flap.config.merge_options(default_options, options, data_source='W7X_CAMERA')
+    if (_options['Trend removal'] not in [None, 'Mean']):
+        raise ValueError("Trend removal should be None or 'Mean'.")
+    plan = w7x_camera_read_plan(exp_id=exp_id, data_name=data_name, options=options, coordinates=coordinates)
+    if (not plan['Time equidistant']):
+        raise ValueError("The APSD needs equidistant time. Select a Time range within one trigger.")
+    f_sample = 1. / plan['Time step']
+    n_frames = len(plan['Frame vec'])
+    n_per_seg = int(round(f_sample / float(_options['Resolution'])))
+    if (n_per_seg < 2):
+        raise ValueError("Frequency resolution is too coarse for the sampling frequency.")
+    if (n_per_seg > n_frames):
+        raise ValueError("Frequency resolution is too fine for the length of the time range.")
+    if (_options['Hanning']):
+        window = np.hanning(n_per_seg)
+        seg_step = n_per_seg // 2
+    else:
+        window = np.ones(n_per_seg)
+        seg_step = n_per_seg
+    n_seg = (n_frames - n_per_seg) // seg_step + 1
+
+    freq = np.fft.rfftfreq(n_per_seg, d=1. / f_sample)
+    if (_options['Range'] is None):
+        f_ind = slice(0, len(freq))
+    else:
+        ind = np.nonzero((freq >= _options['Range'][0]) & (freq <= _options['Range'][1]))[0]
+        if (len(ind) == 0):
+            raise ValueError("No frequency in range.")
+        f_ind = slice(ind[0], ind[-1] + 1)
+    # One sided density: the power of the negative frequencies is added except
+    # for zero and the Nyquist frequency
+    scale = np.full(len(freq), 2. / (f_sample * np.sum(window ** 2)))
+    scale[0] /= 2
+    if (n_per_seg % 2 == 0):
+        scale[-1] /= 2
+    scale = scale[f_ind]
+
+    # Blocks of about READ_BLOCK_SIZE, the overlap of the segments at the block
+    # boundaries is read twice
+    shape = plan_data_shape(plan)
+    block_frames = max(int(READ_BLOCK_SIZE // (plan_data_size(plan) / n_frames)), n_per_seg)
+    block_segs = (block_frames - n_per_seg) // seg_step + 1
+    blocks = [(i, min(i + block_segs, n_seg)) for i in range(0, n_seg, block_segs)]
+    power_sum = np.zeros((shape[0], shape[1], len(freq[f_ind])))
+    power2_sum = np.zeros((shape[0], shape[1], len(freq[f_ind])))
+    n_workers = _options['Workers']
+    if (n_workers is None):
+        n_workers = os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+        # Only a few blocks are submitted ahead so that the finished partial sums
+        # do not pile up in memory
+        n_ahead = 2 * n_workers
+        futures = collections.deque()
+        for (i_start, i_end) in blocks:
+            futures.append(executor.submit(_segment_power, plan, i_start, i_end, n_per_seg, seg_step, window,
+                                           f_ind, _options['Trend removal']))
+            if (len(futures) >= n_ahead):
+                p_sum, p2_sum = futures.popleft().result()
+                power_sum += p_sum
+                power2_sum += p2_sum
+        while (len(futures) > 0):
+            p_sum, p2_sum = futures.popleft().result()
+            power_sum += p_sum
+            power2_sum += p2_sum
+    power = power_sum / n_seg
+    error = None
+    if (_options['Error calculation']):
+        error = np.sqrt(np.maximum(power2_sum / n_seg - power ** 2, 0) / n_seg) * scale
+    power *= scale
+    if (plan['Flip x']):
+        power = power[::-1].copy()
+        if (error is not None):
+            error = error[::-1].copy()
+
+    coord = [flap.Coordinate(name='Frequency',
+                             unit='Hz',
+                             mode=flap.CoordinateMode(equidistant=True),
+                             start=freq[f_ind][0],
+                             step=freq[1] - freq[0],
+                             shape=[],
+                             dimension_list=[2]
+                             )
+             ]
+    coord.extend([c for c in camera_coordinates(plan) if c.unit.name in ['Image x', 'Image y']])
+    d = flap.DataObject(data_array=power,
+                        error=error,
+                        data_unit=flap.Unit(name='Spectral density', unit='Digit^2/Hz'),
+                        coordinates=coord,
+                        exp_id=exp_id,
+                        data_title="W7-X CAMERA APSD: {}".format(data_name),
+                        info={'Options': plan['Options'], 'Data name': data_name, 'Segments': n_seg},
                         data_source="W7X_CAMERA")
     return d
 
 
-def add_coordinate(data_object, new_coordinates, options=None):
-    raise NotImplementedError("Coordinate conversions not implemented yet.")
+def _read_plan_group(plans):
+    """
+    Reads the data of read plans of the same file through one open file handle.
+    This is module level so that it can be run in a process pool.
+    """
+    with _file_pool.file(plans[0]['Path']):
+        return [read_plan_data(plan) for plan in plans]
+
+
+def _multi_plans(requests, options):
+    """
+    Creates the read plans for the requests of w7x_camera_get_data_multi() in parallel.
+    Returns the normalized requests, the read plans and the merged options.
+    """
+    default_options = {'Workers': 4,
+                       'Executor': 'Thread',
+                       'Memory budget': 4  # in GB!
+                       }
+    _options = flap.config.merge_options(default_options, options, data_source='W7X_CAMERA')
+    if (_options['Executor'] not in ['Thread', 'Process']):
+        raise ValueError("Executor should be 'Thread' or 'Process'.")
+
+    _requests = []
+    for request in requests:
+        if ((len(request) < 2) or (len(request) > 4)):
+            raise ValueError("Requests should be (exp_id, data_name[, coordinates[, options]]) tuples.")
+        exp_id = request[0]
+        data_name = request[1]
+        coordinates = request[2] if len(request) > 2 else None
+        request_options = {} if options is None else dict(options)
+        if ((len(request) > 3) and (request[3] is not None)):
+            request_options.update(request[3])
+        _requests.append((exp_id, data_name, coordinates, request_options))
+
+    def plan(request):
+        return w7x_camera_read_plan(exp_id=request[0], data_name=request[1],
+                                    options=request[3], coordinates=request[2])
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=_options['Workers']) as executor:
+        plans = list(executor.map(plan, _requests))
+    return _requests, plans, _options
+
+
+def _multi_read(requests, plans, _options):
+    """
+    Reads the data of the read plans in parallel and yields (index, DataObject)
+    tuples as the reads complete. The plans of the same file are read through
+    one file handle in one task, the size of the tasks read but not yet
+    yielded is kept below the memory budget.
+    """
+    budget = _options['Memory budget'] * 1024**3
+    sizes = [plan_data_size(plan) for plan in plans]
+    for i, size in enumerate(sizes):
+        if (size > budget):
+            raise IOError("The expected read size of {:s} {:s} is larger than the memory budget. (size: {} GB, limit: {} GB.)".format(
+                          requests[i][0], requests[i][1], size / 1024**3, _options['Memory budget']))
+
+    # Grouping the requests by file and splitting the groups to fit in the budget
+    files = {}
+    for i, plan in enumerate(plans):
+        files.setdefault(plan['Path'], []).append(i)
+    tasks = []
+    for indices in files.values():
+        task = []
+        task_size = 0
+        for i in indices:
+            if ((len(task) > 0) and (task_size + sizes[i] > budget)):
+                tasks.append((task, task_size))
+                task = []
+                task_size = 0
+            task.append(i)
+            task_size += sizes[i]
+        tasks.append((task, task_size))
+
+    if (_options['Executor'] == 'Process'):
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=_options['Workers'])
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=_options['Workers'])
+    pending = {}
+    in_flight = 0
+    i_task = 0
+    try:
+        while ((i_task < len(tasks)) or (len(pending) != 0)):
+            while ((i_task < len(tasks)) and ((len(pending) == 0) or (in_flight + tasks[i_task][1] <= budget))):
+                indices, task_size = tasks[i_task]
+                future = executor.submit(_read_plan_group, [plans[i] for i in indices])
+                pending[future] = (indices, task_size)
+                in_flight += task_size
+                i_task += 1
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                indices, task_size = pending.pop(future)
+                data_arrs = future.result()
+                for i, data_arr in zip(indices, data_arrs):
+                    yield i, camera_data_object(plans[i], data_arr, requests[i][0], requests[i][1])
+                in_flight -= task_size
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def w7x_camera_iter_data_multi(requests, options=None):
+    """
+    Reads many camera signals (ROIs, shots) in parallel and yields
+    (index, flap.DataObject) tuples as the reads complete, index is the
+    position of the request in requests.
+    requests: List of (exp_id, data_name, coordinates) or
+              (exp_id, data_name, coordinates, options) tuples, the arguments
+              of w7x_camera_get_data(). The request options override options.
+    Options:
+        Workers: Number of parallel workers
+        Executor: 'Thread' or 'Process'
+        Memory budget: Size limit of the data read but not yet yielded [GB].
+                       This replaces Max_size.
+    The ROIs of the same file are read through one open file handle.
+    """
+    _requests, plans, _options = _multi_plans(requests, options)
+    for result in _multi_read(_requests, plans, _options):
+        yield result
+
+
+def w7x_camera_get_data_multi(requests, options=None):
+    """
+    Reads many camera signals in parallel, see w7x_camera_iter_data_multi().
+    Returns the list of flap.DataObjects in the order of the requests.
+    As all data is returned together the total size should fit in the Memory budget.
+    """
+    _requests, plans, _options = _multi_plans(requests, options)
+    total_size = sum(plan_data_size(plan) for plan in plans)
+    if (total_size > _options['Memory budget'] * 1024**3):
+        raise IOError("The expected total read size is larger than the memory budget. (size: {} GB, limit: {} GB.)".format(
+                      total_size / 1024**3, _options['Memory budget']))
+    data_objects = [None] * len(_requests)
+    for i, d in _multi_read(_requests, plans, _options):
+        data_objects[i] = d
+    return data_objects
+
+
+# The time stamps in the file names have 1 s resolution and are not exactly
+# the W7-X time of the first frame, recordings are skipped only if their
+# estimated time range is farther than this from the read time range [s]
+SEGMENT_TIME_MARGIN = 2.
+
+
+def _stamp_seconds(stamp):
+    return int(stamp[0:2]) * 3600 + int(stamp[2:4]) * 60 + int(stamp[4:6])
+
+
+def _segment_plans(exp_id, data_name, _options, coordinates, stats=None):
+    """
+    Creates the read plans of the recordings of an experiment which have frames
+    in the Time range of the coordinates (see w7x_camera_get_data_concat()).
+    Returns a list of (plan, time offset [s]) tuples in recording order.
+    stats: Read statistics (see new_read_stats()) to add the stage times of the
+           plans to or None.
+    """
+    t_stage = stage_time(stats)
+    recordings = find_recordings(exp_id, data_name, _options)
+    cam_name = data_name.split("_")[1].upper()
+    roi_num = data_name.split("_")[2]
+    read_range = None
+    other_coordinates = []
+    for coord in coordinates:
+        if ((type(coord) is flap.Coordinate) and (coord.unit.name == 'Time')):
+            if (coord.c_range is None):
+                raise NotImplementedError("At present only simple time range selection is supported.")
+            read_range = [float(coord.c_range[0]), float(coord.c_range[1])]
+        else:
+            other_coordinates.append(coord)
+
+    segments = []
+    if (cam_name == 'EDICAM'):
+        # The time of each recording is relative to its first frame, the common
+        # time is relative to the first frame of the first recording
+        origin_times = read_edicam_time(recordings[0][0], roi_num)
+        if (origin_times['W7X time vec'] is not None):
+            clock = ('W7X time vec', 1.e9)
+        else:
+            clock = ('ETU time vec', 1.e7)
+        origin = origin_times[clock[0]][0]
+        stamps = [_stamp_seconds(seg_time) - _stamp_seconds(recordings[0][1]) for path, seg_time in recordings]
+        for i, (path, seg_time) in enumerate(recordings):
+            if (read_range is not None):
+                # Estimating the time range of the recording from the file names
+                # without opening the file
+                est_start = stamps[i] - SEGMENT_TIME_MARGIN
+                est_end = stamps[i + 1] + SEGMENT_TIME_MARGIN if (i + 1 < len(recordings)) else np.inf
+                if ((est_end < read_range[0]) or (est_start > read_range[1])):
+                    logger.debug("Skipping %s, it is outside the time range.", path)
+                    continue
+            time_vectors = read_edicam_time(path, roi_num)
+            if (time_vectors[clock[0]] is None):
+                raise IOError("No {:s} in {:s}, the recordings cannot be concatenated.".format(clock[0], path))
+            offset = (int(time_vectors[clock[0]][0]) - int(origin)) / clock[1]
+            segment_coordinates = list(other_coordinates)
+            if (read_range is not None):
+                segment_range = [read_range[0] - offset, read_range[1] - offset]
+                frame_vec = time_range_index(time_vectors['Time vec'], time_vectors['Time axis'],
+                                             segment_range, include_end=True)
+                if (len(frame_vec) == 0):
+                    continue
+                segment_coordinates.append(flap.Coordinate(name='Time', unit='Second', c_range=segment_range))
+            segments.append((seg_time, segment_coordinates, offset))
+    else:
+        # The Photron times are relative to the same trigger, the timing files
+        # are checked without opening the recordings
+        port = data_name.split("_")[0]
+        date = exp_id.split('.')[0]
+        for path, seg_time in recordings:
+            if (read_range is not None):
+                timing = read_photron_timing(photron_timing_file(_options['Timing path'], port, date, seg_time),
+                                             cache_dir=_options['Timing cache'])
+                frame_vec = time_range_index(timing['Time vec'], timing['Time axis'], read_range,
+                                             include_end=False)
+                if (len(frame_vec) == 0):
+                    logger.debug("Skipping %s, it is outside the time range.", path)
+                    continue
+            segments.append((seg_time, coordinates, 0.))
+    if (len(segments) == 0):
+        raise ValueError("No data in time range.")
+    stage_time(stats, 'File resolution', t_stage)
+
+    def plan(segment):
+        segment_options = dict(_options)
+        segment_options['Time'] = segment[0]
+        segment_stats = new_read_stats()
+        return (w7x_camera_read_plan(exp_id=exp_id, data_name=data_name, options=segment_options,
+                                     coordinates=segment[1], stats=segment_stats),
+                segment_stats)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=_options['Workers']) as executor:
+        results = list(executor.map(plan, segments))
+    for (segment_plan, segment_stats) in results:
+        merge_read_stats(stats, segment_stats)
+    return [(results[i][0], segments[i][2]) for i in range(len(segments))]
+
+
+def _concat_plan(segments):
+    """
+    Returns a read plan describing the concatenated frames of the segment plans
+    for camera_coordinates(). The Time coordinate is shifted by the offsets of
+    the segments, Sample is the frame number in the recordings.
+    """
+    plans = [plan for plan, offset in segments]
+    first = plans[0]
+    for plan in plans[1:]:
+        if ((plan_data_shape(plan)[:2] != plan_data_shape(first)[:2])
+                or (plan['Image x start'] != first['Image x start'])
+                or (plan['Image y start'] != first['Image y start'])):
+            raise ValueError("The image windows of the recordings are different, they cannot be concatenated.")
+    concat = dict(first)
+    concat['Frame vec'] = np.concatenate([plan['Frame vec'] for plan in plans])
+    concat['Time vec'] = np.concatenate([plan['Time vec'] + offset for plan, offset in segments])
+    for key in ['ETU time vec', 'W7X time vec']:
+        if (any(plan[key] is None for plan in plans)):
+            concat[key] = None
+        else:
+            concat[key] = np.concatenate([plan[key] for plan in plans])
+    if (len(plans) == 1):
+        if (first['Time equidistant']):
+            concat['Time start'] = first['Time start'] + segments[0][1]
+    else:
+        concat['Time equidistant'] = False
+        concat['Time start'] = None
+        concat['Time step'] = None
+    for key in ['Frame vec', 'Time vec', 'ETU time vec', 'W7X time vec']:
+        if (concat[key] is not None):
+            concat[key].flags.writeable = False
+    return concat
+
+
+def w7x_camera_get_data_concat(exp_id=None, data_name=None, no_data=False, options=None, coordinates=None):
+    """
+    Reads all recordings of a camera in an experiment (files with different
+    time stamps) and concatenates them along the time dimension into one
+    flap.DataObject. w7x_camera_get_data() calls this with Time='All'.
+    The arguments and options are the same as for w7x_camera_get_data(),
+    Lazy is not supported. Further options:
+        Workers: Number of parallel reads
+    The Time coordinate is not equidistant if more than one recording is read.
+    For EDICAM it is relative to the first frame of the first recording, for
+    Photron it is the time of the timing files. Sample is the frame number in
+    the recording. The recordings which do not intersect the Time range are
+    not opened (for EDICAM this is decided from the file name time stamps,
+    the time vectors of the first recording are read for the time origin).
+    info['Recordings'] lists the path and the number of frames read from each
+    recording.
+    The frames are read in blocks of READ_BLOCK_SIZE in parallel directly into
+    the result.
+    The read statistics ('Read stats' option, add_read_hook()) are collected as
+    in w7x_camera_get_data(), the stage times, bytes and read calls of the
+    recordings are added up. 'Path' is the first recording read, 'Recordings'
+    lists all of them.
+    """
+    default_options = {'Datapath': 'data',
+                       'Timing path': 'data',
+                       'Time': None,
+                       'Max_size': 4,  # in GB!
+                       'Lazy': False,
+                       'Index path': None,
+                       'Timing cache': None,
+                       'Decimate': None,
+                       'Read stats': False,
+                       'Workers': 4}
+    out = None
+    if (options is not None):
+        out = options.get('Output array')
+        options = {key: options[key] for key in options if key != 'Output array'}
+    _options = flap.config.merge_options(default_options, options, data_source='W7X_CAMERA')
+    if (_options['Lazy']):
+        raise NotImplementedError("Lazy reading of concatenated recordings is not supported.")
+    if (coordinates is None):
+        _coordinates = []
+    elif (type(coordinates) is not list):
+        _coordinates = [coordinates]
+    else:
+        _coordinates = coordinates
+
+    stats = new_read_stats()
+    segments = _segment_plans(exp_id, data_name, _options, _coordinates, stats=stats)
+    t_stage = stage_time(stats)
+    max_bytes = _options['Max_size'] * 1024**3
+    size = sum(plan_data_size(plan) for plan, offset in segments)
+    if (size > max_bytes):
+        if (_options['Decimate'] is not None):
+            factor = max(int(np.ceil(size / max_bytes)), 2)
+            while (sum(plan_data_size(decimate_plan(plan, factor, mode=_options['Decimate']))
+                       for plan, offset in segments) > max_bytes):
+                factor += 1
+            logger.info("The expected read size of %s %s is too large. (size: %s GB, limit: %s GB.) Decimating by %d.",
+                        exp_id, data_name, size / 1024**3, _options['Max_size'], factor)
+            segments = [(decimate_plan(plan, factor, mode=_options['Decimate']), offset)
+                        for plan, offset in segments]
+        elif (not no_data):
+            logger.error("The expected read size of %s %s is too large. (size: %s GB, limit: %s GB.)",
+                         exp_id, data_name, size / 1024**3, _options['Max_size'])
+            raise IOError("File size is too large!")
+    concat = _concat_plan(segments)
+    concat['Options'] = _options
+    data_shape = plan_data_shape(concat)
+    t_stage = stage_time(stats, 'Frame selection', t_stage)
+
+    if (no_data):
+        data_arr = None
+    else:
+        first = segments[0][0]
+        if (first['Correction'] is not None):
+            dtype = first['Correction']['Dtype']
+        elif ((tuple(first['Binning']) != (1, 1)) or (first['Frame average'] > 1)):
+            dtype = np.dtype(float)
+        else:
+            dtype = first['Dtype']
+        data_arr = output_array(out, data_shape, dtype)
+        count_buffer(stats, data_arr)
+        # Blocks of frames of the segments
+        frame_bytes = max(plan_data_size(first) // max(len(first['Frame vec']), 1), 1)
+        block_frames = max(READ_BLOCK_SIZE // frame_bytes, 1)
+        blocks = []
+        i_out = 0
+        for plan, offset in segments:
+            for i_start in range(0, len(plan['Frame vec']), block_frames):
+                blocks.append((plan, i_start, i_out + i_start))
+            i_out += len(plan['Frame vec'])
+
+        def read_block(block):
+            plan, i_start, i_out = block
+            block_plan = dict(plan)
+            block_plan['Frame vec'] = plan['Frame vec'][i_start:i_start + block_frames]
+            block_stats = new_read_stats()
+            arr = read_plan_data(block_plan, stats=block_stats)
+            data_arr[:, :, i_out:i_out + arr.shape[2]] = arr
+            return block_stats
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=_options['Workers']) as executor:
+            for block_stats in executor.map(read_block, blocks):
+                merge_read_stats(stats, block_stats)
+    t_stage = stage_time(stats, 'HDF5 read', t_stage)
+
+    d = camera_data_object(concat, data_arr, exp_id, data_name, data_shape=data_shape,
+                           stats=stats if _options['Read stats'] else None)
+    d.info['Recordings'] = [{'Path': plan['Path'], 'Frames': len(plan['Frame vec'])} for plan, offset in segments]
+    stage_time(stats, 'DataObject construction', t_stage)
+    stats['Exp id'] = exp_id
+    stats['Data name'] = data_name
+    stats['Path'] = segments[0][0]['Path']
+    stats['Recordings'] = [plan['Path'] for plan, offset in segments]
+    _report_read_stats(stats)
+    return d
+
+
+# Calibration files: {(path, mtime): {coordinate name: (grid, unit)}}
+CALIBRATION_CACHE_SIZE = 16
+_calibration_cache = _MetadataCache(CALIBRATION_CACHE_SIZE)
+# Coordinate grids of image windows, see coordinate_grid()
+GRID_CACHE_SIZE = 64
+_grid_cache = _MetadataCache(GRID_CACHE_SIZE)
+
+
+def calibration_path(calibration_dir, port, camera):
+    """
+    Returns the path of the calibration file of a camera at a port:
+        <calibration_dir>/<port>_<camera>_calibration.h5
+    The file contains a (sensor x, sensor y) dataset for each coordinate (e.g.
+    Device R, Device Z, Device phi or line of sight parameters) with its value
+    at each pixel in the orientation of the Image x and Image y coordinates
+    (Photron flip applied). The unit is the Unit attribute of the dataset.
+    """
+    return os.path.join(calibration_dir, "_".join([port.lower(), camera.lower(), 'calibration.h5']))
+
+
+def read_calibration(path):
+    """
+    Reads a calibration file (see calibration_path()) and returns
+    {coordinate name: (grid, unit)}. The result is cached by path and modification
+    time, the grids are read only.
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        raise IOError("Calibration file {:s} not found.".format(path))
+    key = (path, mtime)
+    calibration = _calibration_cache.get(key)
+    if (calibration is None):
+        calibration = {}
+        with h5py.File(path, 'r') as h5_obj:
+            for name in h5_obj:
+                grid = np.array(h5_obj[name], dtype=float)
+                if (grid.ndim != 2):
+                    continue
+                grid.flags.writeable = False
+                unit = h5_obj[name].attrs.get('Unit', '')
+                if (isinstance(unit, bytes)):
+                    unit = unit.decode('utf-8')
+                calibration[name] = (grid, str(unit))
+        _calibration_cache.put(key, calibration)
+    return calibration
+
+
+def coordinate_grid(path, name, image_x, image_y):
+    """
+    Returns the values of a calibrated coordinate for the pixels of an image window.
+    path: The calibration file
+    name: The coordinate name
+    image_x, image_y: (first Image x, Image step, number of pixels). Binned pixels
+                      (Image step > 1) get the mean of the values of the pixels
+                      in the bin.
+    The result is a read only (Image x, Image y) array, it is cached by the
+    calibration file and the window so repeated calls do not calculate it again.
+    """
+    calibration = read_calibration(path)
+    if (name not in calibration):
+        raise ValueError("Coordinate {:s} is not in calibration file {:s}. Available: {:s}".format(
+                         name, path, ", ".join(sorted(calibration.keys()))))
+    grid, unit = calibration[name]
+    key = (path, os.stat(path).st_mtime_ns, name, tuple(image_x), tuple(image_y))
+    values = _grid_cache.get(key)
+    if (values is not None):
+        return values, unit
+    window = []
+    for (i_dim, (start, step, n)) in enumerate([image_x, image_y]):
+        step = int(round(step))
+        # The coordinate of a bin is its center
+        first = int(round(start - (step - 1) / 2))
+        if ((first < 0) or (first + n * step > grid.shape[i_dim])):
+            raise ValueError("The image is outside the calibrated sensor area.")
+        window.append((first, step, n))
+    ((x0, sx, nx), (y0, sy, ny)) = window
+    values = grid[x0:x0 + nx * sx, y0:y0 + ny * sy]
+    if ((sx > 1) or (sy > 1)):
+        values = values.reshape(nx, sx, ny, sy).mean(axis=(1, 3))
+    else:
+        values = values.copy()
+    values.flags.writeable = False
+    _grid_cache.put(key, values)
+    return values, unit
+
+
+def add_coordinate(data_object, new_coordinates, exp_id=None, options=None):
+    """
+    Adds calibrated coordinates (e.g. Device R, Device Z, Device phi) to a
+    W7X_CAMERA data object. The coordinates depend on Image x and Image y
+    (dimensions 0 and 1), they are looked up from the calibration file of the
+    port and camera (see calibration_path()) for the whole image at once.
+    new_coordinates: A coordinate name or a list of names.
+    Options:
+        Calibration path: Directory of the calibration files.
+    Returns the data object.
+    """
+    default_options = {'Calibration path': 'data'}
+    _options = flap.config.merge_options(default_options, options, data_source='W7X_CAMERA')
+    if (type(new_coordinates) is str):
+        new_coordinates = [new_coordinates]
+    try:
+        data_name = data_object.info['Data name']
+    except (TypeError, KeyError):
+        raise ValueError("The data object has no W7X_CAMERA data name.")
+    name_split = data_name.split("_")
+    path = calibration_path(_options['Calibration path'], name_split[0], name_split[1])
+    windows = []
+    for (i_dim, name) in enumerate(['Image x', 'Image y']):
+        coord = data_object.get_coordinate_object(name)
+        if ((not coord.mode.equidistant) or (coord.dimension_list != [i_dim])):
+            raise ValueError("{:s} should be equidistant along dimension {:d}.".format(name, i_dim))
+        windows.append((float(coord.start), float(np.atleast_1d(coord.step)[0]), data_object.shape[i_dim]))
+    for name in new_coordinates:
+        values, unit = coordinate_grid(path, name, windows[0], windows[1])
+        data_object.add_coordinate_object(flap.Coordinate(name=name,
+                                                          unit=unit,
+                                                          mode=flap.CoordinateMode(equidistant=False),
+                                                          values=values,
+                                                          shape=values.shape,
+                                                          dimension_list=[0, 1]
+                                                          )
+                                          )
+    return data_object
 
 def register(data_source=None):
     flap.register_data_source('W7X_CAMERA',
-                              get_data_func=w7x_camera_get_data)
+                              get_data_func=w7x_camera_get_data,
+                              add_coord_func=add_coordinate)
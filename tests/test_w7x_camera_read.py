@@ -0,0 +1,452 @@
+import concurrent.futures
+import copy
+import os
+import pickle
+import tempfile
+import tracemalloc
+
+import numpy as np
+import h5py
+import pytest
+
+import flap_w7x_camera
+
+
+def _write_dataset(path, shape, chunks):
+    data = np.arange(np.prod(shape), dtype=np.uint16).reshape(shape)
+    with h5py.File(path, 'w') as f:
+        f.create_dataset('/ROIP/ROIP1/ROIP1Data', data=data, chunks=chunks)
+    return data
+
+
+def test_read_hdf5_arr():
+    shape = (6, 5, 300)
+    frame_vecs = [np.arange(300),
+                  np.arange(20, 50),
+                  np.arange(3, 300, 3),
+                  np.array([0, 1, 2, 10, 11, 100, 101, 102, 103, 299]),
+                  np.array([5, 3, 3, 250])]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for i_layout, chunks in enumerate([None, (6, 5, 1), (6, 5, 16), (2, 2, 64)]):
+            path = os.path.join(tmp_dir, 'test_{:d}.h5'.format(i_layout))
+            data = _write_dataset(path, shape, chunks)
+            h5_obj = h5py.h5f.open(path.encode('utf-8'))
+            h5_data = h5py.h5d.open(h5_obj, b'/ROIP/ROIP1/ROIP1Data')
+            for frame_vec in frame_vecs:
+                arr = flap_w7x_camera.read_hdf5_arr(h5_data, (0, 6), (0, 5), frame_vec)
+                assert np.array_equal(arr, data[:, :, frame_vec])
+                arr = flap_w7x_camera.read_hdf5_arr(h5_data, (1, 4), (2, 5), frame_vec)
+                assert np.array_equal(arr, data[1:4, 2:5, frame_vec])
+            arr = flap_w7x_camera.read_hdf5_arr(h5_data, (0, 6), (0, 5), [])
+            assert arr.shape == (6, 5, 0)
+            h5_data.close()
+            h5_obj.close()
+
+
+def test_read_hdf5_arr_frame_groups(monkeypatch):
+    # Frames read one by one are copied into the output in groups
+    monkeypatch.setattr(flap_w7x_camera, 'FRAME_COPY_GROUP', 4)
+    shape = (6, 5, 40)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'test.h5')
+        data = _write_dataset(path, shape, (6, 5, 1))
+        h5_obj = h5py.h5f.open(path.encode('utf-8'))
+        h5_data = h5py.h5d.open(h5_obj, b'/ROIP/ROIP1/ROIP1Data')
+        for frame_vec in [np.array([7]), np.arange(4), np.arange(3, 10), np.arange(0, 40, 3),
+                          np.array([30, 2, 2, 17, 5, 39])]:
+            stats = flap_w7x_camera.new_read_stats()
+            arr = flap_w7x_camera.read_hdf5_arr(h5_data, (1, 5), (0, 3), frame_vec, stats=stats)
+            assert np.array_equal(arr, data[1:5, 0:3, frame_vec])
+            assert stats['Read calls'] == len(frame_vec)
+            assert stats['Bytes read'] == len(frame_vec) * 4 * 3 * 2
+            # The group buffer is not larger than the output
+            assert stats['Peak buffer'] == arr.nbytes
+        # Reading into a given output array
+        out = np.zeros((6, 5, 6), dtype=np.uint16)
+        arr = flap_w7x_camera.read_hdf5_arr(h5_data, (0, 6), (0, 5), np.array([30, 2, 2, 17, 5, 39]), out=out)
+        assert arr is out
+        assert np.array_equal(out, data[:, :, [30, 2, 2, 17, 5, 39]])
+        h5_data.close()
+        h5_obj.close()
+
+
+def test_time_range_frames():
+    # Two equidistant blocks with a gap, as recorded with several triggers
+    time_vec = np.concatenate([1 + np.arange(100) * 1e-3, 2 + np.arange(100) * 1e-3])
+    axis = flap_w7x_camera.time_axis(time_vec)
+    assert axis['Monotonic']
+    assert list(axis['Segment starts']) == [0, 99, 100]
+    for read_range in [[0, 5], [1.0105, 1.05], [1.01, 2.01], [1.5, 1.6], [2.099, 3]]:
+        for include_end in [True, False]:
+            if (include_end):
+                ind = np.nonzero((time_vec >= read_range[0]) & (time_vec <= read_range[1]))[0]
+            else:
+                ind = np.nonzero((time_vec >= read_range[0]) & (time_vec < read_range[1]))[0]
+            start, end = flap_w7x_camera.time_range_frames(time_vec, axis, read_range, include_end=include_end)
+            assert np.array_equal(np.arange(start, end), ind)
+    assert flap_w7x_camera.window_equidistant(axis, 10, 100)
+    assert not flap_w7x_camera.window_equidistant(axis, 10, 101)
+    assert flap_w7x_camera.window_equidistant(axis, 100, 200)
+    assert not flap_w7x_camera.window_equidistant(axis, 5, 6)
+
+    # A frame out of order: the frames in the range are selected with a mask
+    time_vec = np.arange(100) * 1e-3
+    time_vec[5] = 5.
+    axis = flap_w7x_camera.time_axis(time_vec)
+    assert not axis['Monotonic']
+    ind = flap_w7x_camera.time_range_index(time_vec, axis, [0, 0.01])
+    assert np.array_equal(ind, [0, 1, 2, 3, 4, 6, 7, 8, 9, 10])
+    assert np.array_equal(flap_w7x_camera.time_range_index(time_vec, axis, [0, 0.01], include_end=False),
+                          [0, 1, 2, 3, 4, 6, 7, 8, 9])
+    assert not flap_w7x_camera.frames_equidistant(axis, ind)
+    assert flap_w7x_camera.frames_equidistant(axis, np.arange(10, 20))
+
+
+def test_read_plan_data_memory():
+    # The Photron x flip is done in place and the data can be read into a
+    # preallocated array: the peak memory is the result plus at most one row.
+    shape = (64, 32, 400)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'test.h5')
+        data = _write_dataset(path, shape, (64, 32, 16))
+        plan = {'Path': path,
+                'HDF5 path': '/ROIP/ROIP1/ROIP1Data',
+                'x': (0, 64),
+                'y': (0, 32),
+                'Frame vec': np.arange(400),
+                'Frame average': 1,
+                'Binning': (1, 1),
+                'Correction': None,
+                'Flip x': True}
+        tracemalloc.start()
+        try:
+            arr = flap_w7x_camera.read_plan_data(plan)
+            size, peak = tracemalloc.get_traced_memory()
+            assert np.array_equal(arr, data[::-1])
+            assert arr.flags.c_contiguous
+            assert peak < 1.1 * arr.nbytes
+            out = np.empty_like(arr)
+            tracemalloc.reset_peak()
+            arr_out = flap_w7x_camera.read_plan_data(plan, out=out)
+            size_out, peak_out = tracemalloc.get_traced_memory()
+            assert arr_out is out
+            assert np.array_equal(out, data[::-1])
+            assert peak_out - size_out < 0.1 * out.nbytes
+        finally:
+            tracemalloc.stop()
+
+
+def test_decimate_plan():
+    shape = (6, 5, 300)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'test.h5')
+        data = _write_dataset(path, shape, (6, 5, 16))
+        frame_vec = np.arange(10, 110)
+        plan = {'Path': path,
+                'HDF5 path': '/ROIP/ROIP1/ROIP1Data',
+                'Dtype': np.dtype(np.uint16),
+                'x': (0, 6),
+                'y': (0, 5),
+                'Frame vec': frame_vec,
+                'Time vec': frame_vec * 0.01,
+                'ETU time vec': None,
+                'W7X time vec': 1539860000000000000 + frame_vec * 10000000,
+                'Time equidistant': True,
+                'Time start': 0.1,
+                'Time step': 0.01,
+                'Frame average': 1,
+                'Binning': (1, 1),
+                'Correction': None,
+                'Flip x': False}
+        assert flap_w7x_camera.plan_data_size(plan) == 6 * 5 * 100 * 2
+        assert flap_w7x_camera.decimation_factor(plan, 6 * 5 * 2 * 30) == 4
+        assert flap_w7x_camera.decimation_factor(plan, 6 * 5 * 8 * 30, mode='Average') == 4
+
+        stride = flap_w7x_camera.decimate_plan(plan, 3, mode='Stride')
+        assert np.array_equal(flap_w7x_camera.read_plan_data(stride), data[:, :, 10:110:3])
+        assert np.array_equal(stride['Time vec'], plan['Time vec'][::3])
+        assert np.isclose(stride['Time step'], 0.03)
+
+        average = flap_w7x_camera.decimate_plan(plan, 3, mode='Average')
+        arr = flap_w7x_camera.read_plan_data(average)
+        assert arr.shape == (6, 5, 33)
+        assert np.allclose(arr, data[:, :, 10:109].reshape(6, 5, 33, 3).mean(axis=3))
+        assert flap_w7x_camera.plan_data_size(average) == arr.nbytes
+        assert np.array_equal(average['Frame vec'], np.arange(10, 109, 3))
+        assert np.allclose(average['Time vec'], plan['Time vec'][1:108:3])
+        assert np.array_equal(average['W7X time vec'], plan['W7X time vec'][1:108:3])
+        assert np.isclose(average['Time start'], 0.11)
+
+
+def test_camera_file_pool():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = [os.path.join(tmp_dir, 'test_{:d}.h5'.format(i)) for i in range(3)]
+        for path in paths:
+            _write_dataset(path, (2, 2, 4), None)
+        pool = flap_w7x_camera.CameraFilePool(max_open=2)
+        try:
+            with pool.file(paths[0]) as f0:
+                with pool.file(paths[0]) as f0_again:
+                    assert f0_again is f0
+                with pool.dataset(paths[0], '/ROIP/ROIP1/ROIP1Data') as h5_data:
+                    assert h5_data.get_space().shape == (2, 2, 4)
+            assert (pool.opens, pool.hits) == (1, 2)
+            with pool.file(paths[1]):
+                pass
+            with pool.file(paths[2]):
+                pass
+            # The least recently used file is closed
+            assert pool.open_files() == [os.path.abspath(p) for p in paths[1:]]
+            assert not f0.id.valid
+            # A file in use is not closed, the limit is exceeded until it is released
+            with pool.file(paths[0]) as f0:
+                pool.set_max_open(1)
+                assert f0.id.valid
+            assert pool.open_files() == [os.path.abspath(paths[0])]
+            # A replaced file is reopened
+            _write_dataset(paths[0] + '.new', (2, 2, 8), None)
+            os.replace(paths[0] + '.new', paths[0])
+            with pool.dataset(paths[0], '/ROIP/ROIP1/ROIP1Data') as h5_data:
+                assert h5_data.get_space().shape == (2, 2, 8)
+            assert not f0.id.valid
+        finally:
+            pool.close()
+        assert pool.open_files() == []
+
+
+def test_frame_block_cache(monkeypatch):
+    shape = (6, 5, 300)
+    frame_vecs = [np.arange(20, 50),
+                  np.arange(40, 80),
+                  np.array([5, 3, 3, 250]),
+                  np.arange(3, 300, 3)]
+    # Blocks of 32 frames
+    monkeypatch.setattr(flap_w7x_camera, 'CACHE_BLOCK_SIZE', 6 * 5 * 2 * 32)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for i_layout, chunks in enumerate([None, (6, 5, 1), (6, 5, 16)]):
+            path = os.path.join(tmp_dir, 'test_{:d}.h5'.format(i_layout))
+            data = _write_dataset(path, shape, chunks)
+            h5_obj = h5py.h5f.open(path.encode('utf-8'))
+            h5_data = h5py.h5d.open(h5_obj, b'/ROIP/ROIP1/ROIP1Data')
+            cache = flap_w7x_camera.FrameBlockCache(max_bytes=6 * 5 * 2 * 32 * 20)
+            for frame_vec in frame_vecs:
+                arr = flap_w7x_camera.read_hdf5_arr(h5_data, (1, 4), (2, 5), frame_vec, cache=cache)
+                assert np.array_equal(arr, data[1:4, 2:5, frame_vec])
+            # 20-49: blocks 0, 1; 40-79: 1, 2; 3, 5, 250: 0, 7; every 3rd: all 10 blocks
+            assert cache.statistics()['Misses'] == 10
+            assert cache.statistics()['Hits'] == 1 + 1 + 4
+            binned = flap_w7x_camera.read_hdf5_arr(h5_data, (0, 6), (0, 4), np.arange(300),
+                                                   binning=(2, 2), cache=cache)
+            assert np.allclose(binned, data[:, :4, :].reshape(3, 2, 2, 2, 300).mean(axis=(1, 3)))
+            assert cache.statistics()['Misses'] == 10
+            # Over budget the least recently used blocks are evicted
+            cache.set_max_bytes(6 * 5 * 2 * 32 * 3)
+            stats = cache.statistics()
+            assert stats['Blocks'] == 3
+            assert stats['Evictions'] == 7
+            assert stats['Bytes'] <= stats['Max bytes']
+            h5_data.close()
+            h5_obj.close()
+
+
+def test_metadata_cache():
+    cache = flap_w7x_camera._MetadataCache(max_items=3)
+    for i in range(3):
+        assert cache.put(i, str(i)) == str(i)
+    assert cache.get(0) == '0'
+    assert cache.get(5) is None
+    # The least recently used entry is dropped
+    cache.put(3, '3')
+    assert cache.keys() == [2, 0, 3]
+    # Concurrent use from threads
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda i: cache.put(i % 10, cache.get(i % 7) or str(i)), range(1000)))
+    assert len(cache) == 3
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_lazy_camera_array():
+    shape = (12, 10, 60)
+    keys = [(Ellipsis,),
+            (slice(2, 9), slice(None), slice(5, 40, 3)),
+            (slice(None, None, -1), slice(8, 1, -2), slice(None, None, -7)),
+            (3, -1, 7),
+            (-2, slice(None), [0, 5, 5, 2]),
+            ([1, 0, 4], slice(1, 3), slice(None)),
+            (Ellipsis, [55, 0, 30]),
+            (np.int64(2), Ellipsis),
+            (slice(4, 4), slice(None), slice(None)),
+            (slice(None), slice(None), slice(10, 2))]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'test.h5')
+        data = _write_dataset(path, shape, (12, 10, 8))
+        frame_vec = np.arange(2, 58)
+        try:
+            for flip_x in [False, True]:
+                for binning in [(1, 1), (2, 3)]:
+                    x = (1, 11)
+                    y = (0, 9)
+                    lazy = flap_w7x_camera.LazyCameraArray(path, '/ROIP/ROIP1/ROIP1Data', x, y, frame_vec,
+                                                           binning=binning, flip_x=flip_x)
+                    window = data[x[0]:x[1], y[0]:y[1]][:, :, frame_vec].astype(float)
+                    n_x = (x[1] - x[0]) // binning[0]
+                    n_y = (y[1] - y[0]) // binning[1]
+                    eager = window[:n_x * binning[0], :n_y * binning[1]].reshape(
+                        n_x, binning[0], n_y, binning[1], len(frame_vec)).mean(axis=(1, 3))
+                    if (flip_x):
+                        eager = eager[::-1]
+                    assert lazy.shape == eager.shape
+                    for restored in [lazy, pickle.loads(pickle.dumps(lazy)), copy.deepcopy(lazy)]:
+                        for key in keys:
+                            arr = restored[key]
+                            assert arr.shape == eager[key].shape, key
+                            assert np.allclose(arr, eager[key]), key
+                    assert np.allclose(np.array(lazy), eager)
+            # The file is read through the shared pool
+            assert os.path.abspath(path) in flap_w7x_camera._file_pool.open_files()
+        finally:
+            flap_w7x_camera.close_camera_files()
+
+
+def test_iter_data(monkeypatch):
+    shape = (6, 5, 100)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'test.h5')
+        data = _write_dataset(path, shape, (6, 5, 8))
+        frame_vec = np.arange(10, 80, 2)
+        time_vec = 1 + frame_vec * 1e-3
+        for flip_x in [False, True]:
+            plan = {'Path': path,
+                    'HDF5 path': '/ROIP/ROIP1/ROIP1Data',
+                    'x': (1, 5),
+                    'y': (0, 4),
+                    'Frame vec': frame_vec,
+                    'Frame average': 1,
+                    'Time vec': time_vec,
+                    'ETU time vec': None,
+                    'W7X time vec': frame_vec * 1000,
+                    'Time equidistant': False,
+                    'Time start': None,
+                    'Time step': None,
+                    'Binning': (1, 1),
+                    'Correction': None,
+                    'Flip x': flip_x,
+                    'Image x start': 1,
+                    'Image y start': 0,
+                    'Image step': (1, 1),
+                    'Options': {}}
+            monkeypatch.setattr(flap_w7x_camera, 'w7x_camera_read_plan', lambda **kw: plan)
+            expected = data[1:5, 0:4, frame_vec]
+            if (flip_x):
+                expected = expected[::-1]
+            for prefetch in [True, False]:
+                blocks = list(flap_w7x_camera.w7x_camera_iter_data(exp_id='20181018.016',
+                                                                   data_name='AEQ21_EDICAM_ROIP1',
+                                                                   options={'Block size': 8,
+                                                                            'Prefetch': prefetch}))
+                assert [d.data.shape[2] for d in blocks] == [8, 8, 8, 8, 3]
+                assert np.array_equal(np.concatenate([d.data for d in blocks], axis=2), expected)
+                for i, d in enumerate(blocks):
+                    block = slice(i * 8, (i + 1) * 8)
+                    assert np.array_equal(d.get_coordinate_object('Time').values, time_vec[block])
+                    assert np.array_equal(d.get_coordinate_object('W7XTime').values, frame_vec[block] * 1000)
+                    assert np.array_equal(d.get_coordinate_object('Sample').values, frame_vec[block])
+            # The reads stop when the caller stops iterating
+            blocks = flap_w7x_camera.w7x_camera_iter_data(exp_id='20181018.016', data_name='AEQ21_EDICAM_ROIP1',
+                                                          options={'Block size': 8})
+            assert np.array_equal(next(blocks).data, expected[:, :, :8])
+            blocks.close()
+        with pytest.raises(ValueError):
+            next(flap_w7x_camera.w7x_camera_iter_data(exp_id='20181018.016', data_name='AEQ21_EDICAM_ROIP1',
+                                                      options={'Block size': 0}))
+
+
+def test_multi(monkeypatch):
+    # Read plans of three ROIs in each of two files
+    rois = {'ROIP1': (0, 8), 'ROIP2': (8, 16), 'ROIP3': (4, 12)}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = {}
+        for i, exp_id in enumerate(['20181018.016', '20181018.013']):
+            path = os.path.join(tmp_dir, 'test_{:d}.h5'.format(i))
+            data = np.random.default_rng(i).integers(0, 4096, size=(16, 16, 20), dtype=np.uint16)
+            with h5py.File(path, 'w') as f:
+                for roi in rois:
+                    f.create_dataset('/ROIP/{0}/{0}Data'.format(roi), data=data, chunks=(16, 16, 4))
+            files[exp_id] = (path, data)
+
+        def read_plan(exp_id=None, data_name=None, options=None, coordinates=None):
+            roi = data_name.split('_')[2]
+            frame_vec = np.arange(20) if coordinates is None else np.arange(5, 10)
+            return {'Path': files[exp_id][0],
+                    'HDF5 path': '/ROIP/{0}/{0}Data'.format(roi),
+                    'Dtype': np.dtype(np.uint16),
+                    'x': (0, 16),
+                    'y': rois[roi],
+                    'Frame vec': frame_vec,
+                    'Frame average': 1,
+                    'Time vec': frame_vec * 0.01,
+                    'ETU time vec': None,
+                    'W7X time vec': None,
+                    'Time equidistant': True,
+                    'Time start': frame_vec[0] * 0.01,
+                    'Time step': 0.01,
+                    'Binning': (1, 1),
+                    'Correction': None,
+                    'Flip x': False,
+                    'Image x start': 0,
+                    'Image y start': rois[roi][0],
+                    'Image step': (1, 1),
+                    'Options': options}
+
+        monkeypatch.setattr(flap_w7x_camera, 'w7x_camera_read_plan', read_plan)
+        requests = [(exp_id, 'AEQ20_EDICAM_' + roi) for roi in ['ROIP3', 'ROIP1', 'ROIP2'] for exp_id in files]
+        requests.append(('20181018.016', 'AEQ20_EDICAM_ROIP1', 'Time range'))
+        expected = []
+        for request in requests:
+            plan = read_plan(exp_id=request[0], data_name=request[1],
+                             coordinates=request[2] if len(request) > 2 else None)
+            expected.append(files[request[0]][1][:, plan['y'][0]:plan['y'][1], plan['Frame vec']])
+
+        # The results are in the order of the requests
+        d_list = flap_w7x_camera.w7x_camera_get_data_multi(requests)
+        assert all(np.array_equal(d.data, arr) for d, arr in zip(d_list, expected))
+        assert [d.exp_id for d in d_list] == [request[0] for request in requests]
+        results = list(flap_w7x_camera.w7x_camera_iter_data_multi(requests))
+        assert sorted(i for i, d in results) == list(range(len(requests)))
+        assert all(np.array_equal(d.data, expected[i]) for i, d in results)
+
+        # The ROIs of the same file are read together
+        groups = []
+        read_plan_group = flap_w7x_camera._read_plan_group
+
+        def record_group(plans):
+            groups.append([(plan['Path'], plan['HDF5 path']) for plan in plans])
+            return read_plan_group(plans)
+
+        roi_size = 16 * 8 * 20 * 2
+        budget_options = {'Memory budget': 2.5 * roi_size / 1024**3}
+        with monkeypatch.context() as m:
+            m.setattr(flap_w7x_camera, '_read_plan_group', record_group)
+            flap_w7x_camera.w7x_camera_get_data_multi(requests)
+            assert sorted(len(group) for group in groups) == [3, 4]
+            assert all(len(set(path for path, h5_path in group)) == 1 for group in groups)
+            # The groups are split to fit in the memory budget
+            groups.clear()
+            list(flap_w7x_camera.w7x_camera_iter_data_multi(requests, options=budget_options))
+            assert sorted(len(group) for group in groups) == [1, 2, 2, 2]
+
+        # Process pool
+        d_list = flap_w7x_camera.w7x_camera_get_data_multi(requests, options={'Executor': 'Process', 'Workers': 2})
+        assert all(np.array_equal(d.data, arr) for d, arr in zip(d_list, expected))
+
+        # Memory budget
+        with pytest.raises(IOError):
+            # The total size is larger than the budget
+            flap_w7x_camera.w7x_camera_get_data_multi(requests, options=budget_options)
+        with pytest.raises(IOError):
+            # A request is larger than the budget
+            list(flap_w7x_camera.w7x_camera_iter_data_multi(requests,
+                                                            options={'Memory budget': 0.5 * roi_size / 1024**3}))
+        with pytest.raises(ValueError):
+            flap_w7x_camera.w7x_camera_get_data_multi(requests, options={'Executor': 'Fork'})
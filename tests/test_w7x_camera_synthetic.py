@@ -0,0 +1,655 @@
+import json
+import multiprocessing
+import os
+import pickle
+
+import numpy as np
+import pytest
+import h5py
+import scipy.signal
+
+import flap
+import flap_w7x_camera
+import w7x_camera_benchmark
+import w7x_camera_synthetic
+
+EXP_ID = '20181018.012'
+
+
+def _read_file(path):
+    with h5py.File(path, 'r') as f:
+        return np.array(f['ROIP/ROIP1/ROIP1Data'])
+
+
+class _Archive:
+    """
+    A temporary camera archive: the recordings are written into datapath, the
+    Photron timing files into timing_path.
+    """
+    def __init__(self, tmp_dir):
+        self.tmp_dir = tmp_dir
+        self.datapath = os.path.join(tmp_dir, 'data')
+        self.timing_path = os.path.join(tmp_dir, 'timing')
+        self.options = {'Datapath': self.datapath, 'Timing path': self.timing_path}
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir, name)
+
+    def edicam(self, exp_id=EXP_ID, **kwargs):
+        return w7x_camera_synthetic.write_edicam(self.datapath, exp_id, **kwargs)
+
+    def photron(self, exp_id=EXP_ID, **kwargs):
+        return w7x_camera_synthetic.write_photron(self.datapath, self.timing_path, exp_id, **kwargs)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    yield _Archive(str(tmp_path))
+    # The pooled files of the removed directory are closed
+    flap_w7x_camera.close_camera_files()
+
+
+def test_edicam(archive):
+    path = archive.edicam(rois={'ROIP1': (8, 32, 4, 16)}, n_frames=200, frame_rate=100.)
+    data = _read_file(path)
+    options = archive.options
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1', options=options)
+    assert np.array_equal(d.data, data)
+    assert d.get_coordinate_object('Image x').start == 8
+    assert d.get_coordinate_object('Image y').start == 4
+
+    time_coord = flap.Coordinate(name='Time', unit='Second', c_range=[0.5, 0.995])
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1', options=options,
+                                            coordinates=[time_coord])
+    assert np.array_equal(d.data, data[:, :, 50:100])
+    assert np.array_equal(d.get_coordinate_object('Sample').values, np.arange(50, 100))
+    assert np.isclose(d.get_coordinate_object('Time').start, 0.5)
+
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1', options=options,
+                                            no_data=True)
+    assert tuple(d.shape) == data.shape
+
+    # A time stamp out of order is not in the time range
+    flap_w7x_camera.close_camera_files()
+    with h5py.File(path, 'a') as f:
+        f['ROIP/ROIP1/ROIP1W7XTime'][5] += 5000000000
+    time_coord = flap.Coordinate(name='Time', unit='Second', c_range=[0, 0.1])
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1', options=options,
+                                            coordinates=[time_coord])
+    frames = [0, 1, 2, 3, 4] + list(range(6, 11))
+    assert np.array_equal(d.get_coordinate_object('Sample').values, frames)
+    assert np.array_equal(d.data, data[:, :, frames])
+    assert np.all(d.get_coordinate_object('Time').values <= 0.1)
+
+
+def test_photron(archive):
+    path, time_fn = archive.photron(n_x=24, n_y=16, x_pos=8, y_pos=4, n_trig=2, frame_per_trig=100,
+                                    rec_rate=1000., trig_period=1., t_first=1.)
+    data = _read_file(path)
+    options = archive.options
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ21_PHOTRON_ROIP1', options=options)
+    # The Photron images are flipped in x
+    assert np.array_equal(d.data, data[::-1])
+    assert not d.get_coordinate_object('Time').mode.equidistant
+
+    time_coord = flap.Coordinate(name='Time', unit='Second', c_range=[2.01, 2.05])
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ21_PHOTRON_ROIP1', options=options,
+                                            coordinates=[time_coord])
+    assert np.array_equal(d.data, data[::-1, :, 110:150])
+    assert d.get_coordinate_object('Time').mode.equidistant
+    assert np.isclose(d.get_coordinate_object('Time').start, 2.01)
+    # A time range between the measurement windows of the triggers
+    time_coord = flap.Coordinate(name='Time', unit='Second', c_range=[1.5, 1.6])
+    with pytest.raises(ValueError, match='between the measurement windows'):
+        flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ21_PHOTRON_ROIP1', options=options,
+                                            coordinates=[time_coord])
+
+    # A timing file of another recording
+    w7x_camera_synthetic.write_photron(archive.path('other'), archive.timing_path, EXP_ID, n_x=24, n_y=16,
+                                       n_trig=1, frame_per_trig=100)
+    with pytest.raises(RuntimeError):
+        flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ21_PHOTRON_ROIP1', options=options)
+
+
+def test_photron_timing_cache(archive, monkeypatch):
+    cache_dir = archive.path('cache')
+    path, time_fn = archive.photron(n_x=4, n_y=4, n_trig=2, frame_per_trig=10, rec_rate=1000., t_first=1.)
+    monkeypatch.setattr(flap_w7x_camera, '_timing_cache',
+                        flap_w7x_camera._MetadataCache(flap_w7x_camera.TIMING_CACHE_SIZE))
+    timing = flap_w7x_camera.read_photron_timing(time_fn, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+    assert flap_w7x_camera.read_photron_timing(time_fn, cache_dir=cache_dir) is timing
+
+    # Read back from the sidecar files without the .sav file, not memory mapped
+    flap_w7x_camera._timing_cache.clear()
+    with monkeypatch.context() as m:
+        def no_readsav(*args, **kwargs):
+            raise AssertionError("Reading " + time_fn)
+        m.setattr(flap_w7x_camera.io, 'readsav', no_readsav)
+        cached = flap_w7x_camera.read_photron_timing(time_fn, cache_dir=cache_dir)
+    assert type(cached['Time vec']) is np.ndarray
+    assert not cached['Time vec'].flags.writeable
+    assert np.array_equal(cached['Time vec'], timing['Time vec'])
+    assert (cached['Frame per trig'], cached['Rec rate']) == (10, 1000.)
+    assert np.array_equal(cached['Trig times'], [1., 2.])
+
+    # The sidecar files are not used after the .sav file changed
+    archive.photron(n_x=4, n_y=4, n_trig=2, frame_per_trig=10, rec_rate=1000., t_first=3.)
+    st = os.stat(time_fn)
+    os.utime(time_fn, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+    changed = flap_w7x_camera.read_photron_timing(time_fn, cache_dir=cache_dir)
+    assert np.array_equal(changed['Trig times'], [3., 4.])
+    flap_w7x_camera._timing_cache.clear()
+    assert np.array_equal(flap_w7x_camera.read_photron_timing(time_fn, cache_dir=cache_dir)['Trig times'],
+                          [3., 4.])
+    assert len(os.listdir(cache_dir)) == 2
+
+    # Without cache directory only the memory cache is used, it is bounded
+    monkeypatch.setattr(flap_w7x_camera._timing_cache, 'max_items', 1)
+    other_fn = archive.photron(time='123500', n_x=4, n_y=4, n_trig=1, frame_per_trig=10)[1]
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ21_PHOTRON_ROIP1',
+                                            options=dict(archive.options, Time='123500',
+                                                         **{'Timing cache': None}))
+    assert d.data.shape == (4, 4, 10)
+    assert flap_w7x_camera._timing_cache.keys() == [(os.path.abspath(other_fn),
+                                                           os.stat(other_fn).st_mtime_ns)]
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_decimate(archive):
+    path = archive.edicam(rois={'ROIP1': (0, 16, 0, 8)}, n_frames=200, frame_rate=100.)
+    photron_path = archive.photron(n_x=16, n_y=8, n_trig=2, frame_per_trig=100, rec_rate=1000., t_first=1.)[0]
+    # 60 raw frames fit in Max_size
+    options = dict(archive.options, Max_size=16 * 8 * 2 * 60 / 1024**3)
+    edicam_data = _read_file(path)
+    photron_data = _read_file(photron_path)[::-1]
+    for (data_name, data, coordinates, time_vec) in [
+            ('AEQ20_EDICAM_ROIP1', edicam_data, None, np.arange(200) * 0.01),
+            ('AEQ21_PHOTRON_ROIP1', photron_data[:, :, 100:200],
+             [flap.Coordinate(name='Time', unit='Second', c_range=[2., 3.])], 2 + np.arange(100) * 1e-3)]:
+        with pytest.raises(IOError):
+            flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name, options=options,
+                                                coordinates=coordinates)
+        n_frames = data.shape[2]
+        # Every 4th frame for EDICAM, every 2nd for Photron
+        factor = -(-n_frames // 60)
+        d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name,
+                                                options=dict(options, Decimate='Stride'),
+                                                coordinates=coordinates)
+        assert np.array_equal(d.data, data[:, :, ::factor])
+        c = d.get_coordinate_object('Time')
+        assert c.mode.equidistant
+        assert np.isclose(c.start, time_vec[0])
+        assert np.isclose(c.step, factor * (time_vec[1] - time_vec[0]))
+        assert d.data.shape[2] == len(time_vec[::factor])
+        d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name,
+                                                options=dict(options, Decimate='Stride'),
+                                                coordinates=coordinates, no_data=True)
+        assert tuple(d.shape) == data[:, :, ::factor].shape
+
+        # Averages of 14 or 7 frames (float) fit in Max_size
+        factor = -(-n_frames // 15)
+        n_groups = n_frames // factor
+        d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name,
+                                                options=dict(options, Decimate='Average'),
+                                                coordinates=coordinates)
+        assert d.data.shape == (16, 8, n_groups)
+        assert np.allclose(d.data, data[:, :, :n_groups * factor].reshape(16, 8, n_groups, factor).mean(axis=3))
+        c = d.get_coordinate_object('Time')
+        assert np.isclose(c.start, time_vec[:factor].mean())
+        assert np.isclose(c.step, factor * (time_vec[1] - time_vec[0]))
+
+
+def test_benchmark(tmp_path):
+    results = w7x_camera_benchmark.run_benchmark(str(tmp_path), n_frames=40, n_x=16, n_y=8, repeat=1)
+    assert len(results) == 8
+    for r in results:
+        assert r['Frames'] > 0
+        assert r['MB/s'] > 0
+
+
+def test_read_stats(archive):
+    archive.edicam(rois={'ROIP1': (0, 16, 0, 8)}, n_frames=50)
+    hook_stats = []
+    flap_w7x_camera.add_read_hook(hook_stats.append)
+    try:
+        d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1',
+                                                options=dict(archive.options, **{'Read stats': True}))
+    finally:
+        flap_w7x_camera.remove_read_hook(hook_stats.append)
+    stats = d.info['Read stats']
+    assert hook_stats == [stats]
+    assert stats['Bytes read'] == d.data.nbytes
+    # One frame per chunk: the frames are read one by one
+    assert stats['Read calls'] == 50
+    assert stats['Peak buffer'] == d.data.nbytes
+    for stage in ['File resolution', 'Config parse', 'Time vector load', 'Frame selection',
+                  'HDF5 read', 'DataObject construction']:
+        assert stats['Stages'][stage] >= 0
+
+
+def test_repack(archive):
+    repack_dir = archive.path('repack')
+    archive.edicam(rois={'ROIP1': (8, 32, 4, 16)}, n_frames=300)
+    archive.photron(n_x=24, n_y=16, x_pos=8, y_pos=4, n_trig=2, frame_per_trig=150, rec_rate=1000.)
+    options = dict(archive.options, **{'Repack path': repack_dir})
+    for (data_name, time_range) in [('AEQ20_EDICAM_ROIP1', [0.5, 1.5]), ('AEQ21_PHOTRON_ROIP1', [2.01, 2.1])]:
+        coordinates = [flap.Coordinate(name='Time', unit='Second', c_range=time_range),
+                       flap.Coordinate(name='Image x', unit='Pixel', c_range=[10, 20])]
+        ref = [flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name, options=options),
+               flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name, options=options,
+                                                   coordinates=coordinates)]
+        store_path = flap_w7x_camera.w7x_camera_repack(exp_id=EXP_ID, data_name=data_name, options=options)
+        assert os.path.dirname(store_path) == repack_dir
+        with h5py.File(store_path, 'r') as f:
+            # The whole time series of a pixel is in one chunk
+            assert f['ROIP/ROIP1/ROIP1Data'].chunks[2] == 300
+        repacked = [flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name, options=options),
+                    flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name, options=options,
+                                                        coordinates=coordinates)]
+        for (d_ref, d) in zip(ref, repacked):
+            assert np.array_equal(d.data, d_ref.data)
+            for name in ['Time', 'Sample', 'Image x', 'Image y']:
+                c_ref = d_ref.get_coordinate_object(name)
+                c = d.get_coordinate_object(name)
+                assert c.mode.equidistant == c_ref.mode.equidistant
+                if (c.mode.equidistant):
+                    assert np.isclose(c.start, c_ref.start)
+                    assert np.allclose(c.step, c_ref.step)
+                else:
+                    assert np.array_equal(c.values, c_ref.values)
+        plan = flap_w7x_camera.w7x_camera_read_plan(exp_id=EXP_ID, data_name=data_name, options=options)
+        assert plan['Path'] == store_path
+        assert not plan['Flip x']
+        # The read options of w7x_camera_get_data() do not change the store
+        raw_options = dict(options, Quicklook='Mean', Dark=[0, 0.1], Binning=2, Decimate='Stride',
+                           Overwrite=True)
+        assert flap_w7x_camera.w7x_camera_repack(exp_id=EXP_ID, data_name=data_name,
+                                                 options=raw_options) == store_path
+        d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name, options=options)
+        assert np.array_equal(d.data, ref[0].data)
+        # A store older than the recording is not used
+        source = flap_w7x_camera.w7x_camera_read_plan(exp_id=EXP_ID, data_name=data_name,
+                                                      options=dict(options, **{'Use repack': False}))['Path']
+        os.utime(source, ns=(0, os.stat(source).st_mtime_ns + 1000))
+        plan = flap_w7x_camera.w7x_camera_read_plan(exp_id=EXP_ID, data_name=data_name, options=options)
+        assert plan['Path'] == source
+
+
+def test_quicklook(archive):
+    archive.edicam(rois={'ROIP1': (8, 21, 4, 16)}, n_frames=301)
+    archive.photron(n_x=24, n_y=13, x_pos=8, y_pos=4, n_trig=2, frame_per_trig=150, rec_rate=1000.)
+    options = dict(archive.options, **{'Quicklook path': archive.path('quicklook')})
+    for (data_name, time_range) in [('AEQ20_EDICAM_ROIP1', [0.5, 1.5]), ('AEQ21_PHOTRON_ROIP1', [2.01, 2.1])]:
+        flap_w7x_camera.w7x_camera_quicklook(exp_id=EXP_ID, data_name=data_name,
+                                             options=dict(options, **{'Quicklook levels': 3}))
+        data = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name, options=options).data
+        d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name,
+                                                options=dict(options, Quicklook='Mean'))
+        assert d.data.shape == data.shape[:2] + (1,)
+        assert np.allclose(d.data[:, :, 0], data.mean(axis=2), rtol=1e-6)
+        d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name,
+                                                options=dict(options, Quicklook='Std'))
+        assert np.allclose(d.data[:, :, 0], data.std(axis=2), rtol=1e-5)
+        d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name,
+                                                options=dict(options, Quicklook='Intensity'))
+        assert np.array_equal(d.data[0, 0], data.sum(axis=(0, 1)))
+        with pytest.raises(ValueError):
+            flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name,
+                                                options=dict(options, Quicklook=4))
+
+        # A level is the binned and frame averaged movie
+        coordinates = [flap.Coordinate(name='Time', unit='Second', c_range=time_range),
+                       flap.Coordinate(name='Image x', unit='Pixel', c_range=[10, 20])]
+        for (level, coords) in [(1, None), (3, None), (2, coordinates)]:
+            factor = 2 ** level
+            d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name,
+                                                    options=dict(options, Quicklook=level), coordinates=coords)
+            plan = flap_w7x_camera.w7x_camera_read_plan(exp_id=EXP_ID, data_name=data_name,
+                                                        options=dict(options, Binning=factor))
+            plan = flap_w7x_camera.decimate_plan(plan, factor, mode='Average')
+            data_ref = flap_w7x_camera.read_plan_data(plan)
+            time_ref = plan['Time vec']
+            x_ref = plan['Image x start'] + factor * np.arange(data_ref.shape[0])
+            if (coords is not None):
+                # The Photron time range end is not included
+                if ('EDICAM' in data_name):
+                    ind_t = np.nonzero((time_ref >= time_range[0]) & (time_ref <= time_range[1]))[0]
+                else:
+                    ind_t = np.nonzero((time_ref >= time_range[0]) & (time_ref < time_range[1]))[0]
+                ind_x = np.nonzero((x_ref >= 10) & (x_ref <= 20))[0]
+                data_ref = data_ref[ind_x][:, :, ind_t]
+                time_ref = time_ref[ind_t]
+                x_ref = x_ref[ind_x]
+            assert d.data.shape == data_ref.shape
+            assert np.allclose(d.data, data_ref, rtol=1e-6)
+            c = d.get_coordinate_object('Time')
+            if (c.mode.equidistant):
+                assert np.allclose(c.start + c.step * np.arange(len(time_ref)), time_ref)
+            else:
+                assert np.allclose(c.values, time_ref)
+            assert np.isclose(d.get_coordinate_object('Image x').start, x_ref[0])
+            assert np.isclose(d.get_coordinate_object('Image x').step, factor)
+            assert np.isclose(d.get_coordinate_object('Image y').start, plan['Image y start'])
+
+        # The read options of w7x_camera_get_data() do not change the products
+        flap_w7x_camera.w7x_camera_quicklook(exp_id=EXP_ID, data_name=data_name,
+                                             options=dict(options, Quicklook='Mean', Dark=[0, 0.1], Binning=2,
+                                                          Decimate='Average', Overwrite=True))
+        d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name,
+                                                options=dict(options, Quicklook='Mean'))
+        assert np.allclose(d.data[:, :, 0], data.mean(axis=2), rtol=1e-6)
+
+
+def test_apsd(archive, monkeypatch):
+    archive.edicam(rois={'ROIP1': (8, 12, 4, 6)}, n_frames=1000, frame_rate=1000.)
+    archive.photron(n_x=8, n_y=6, x_pos=8, y_pos=4, n_trig=2, frame_per_trig=500, rec_rate=1000.)
+    options = dict(archive.options, Resolution=20., Workers=2)
+    for (data_name, coordinates) in [('AEQ20_EDICAM_ROIP1', None),
+                                     ('AEQ21_PHOTRON_ROIP1',
+                                      [flap.Coordinate(name='Time', unit='Second', c_range=[1., 1.4])])]:
+        for binning in [None, 2]:
+            _options = dict(options, Binning=binning)
+            data = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name, options=_options,
+                                                       coordinates=coordinates).data
+            freq, p_ref = scipy.signal.welch(data.astype(float), fs=1000., window=np.hanning(50), nperseg=50,
+                                             noverlap=25, detrend='constant', scaling='density', axis=2)
+            # Small block size: the segments are processed in more blocks
+            with monkeypatch.context() as m:
+                m.setattr(flap_w7x_camera, 'READ_BLOCK_SIZE', data.nbytes // data.shape[2] * 120)
+                d = flap_w7x_camera.w7x_camera_apsd(exp_id=EXP_ID, data_name=data_name, options=_options,
+                                                    coordinates=coordinates)
+            assert np.allclose(d.data, p_ref)
+            assert np.all(d.error > 0)
+            c = d.get_coordinate_object('Frequency')
+            assert np.allclose(c.start + c.step * np.arange(d.data.shape[2]), freq)
+            d_range = flap_w7x_camera.w7x_camera_apsd(exp_id=EXP_ID, data_name=data_name,
+                                                      options=dict(_options, Range=[100, 200], Hanning=False),
+                                                      coordinates=coordinates)
+            assert d_range.data.shape[2] == 6
+            assert np.isclose(d_range.get_coordinate_object('Frequency').start, 100)
+    with pytest.raises(ValueError):
+        # Two triggers, the time is not equidistant
+        flap_w7x_camera.w7x_camera_apsd(exp_id=EXP_ID, data_name='AEQ21_PHOTRON_ROIP1', options=options)
+
+
+def test_follow(archive):
+    ctx = multiprocessing.get_context('spawn')
+    ready = ctx.Event()
+    writer = ctx.Process(target=w7x_camera_synthetic.write_edicam_swmr,
+                         args=(archive.datapath, EXP_ID),
+                         kwargs={'roi_window': (8, 16, 4, 8), 'n_frames': 200, 'batch_frames': 7,
+                                 'interval': 0.02, 'ready': ready})
+    writer.start()
+    try:
+        assert ready.wait(30)
+        blocks = []
+        n_frames = 0
+        for d in flap_w7x_camera.w7x_camera_follow(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1',
+                                                   options=dict(archive.options, Timeout=30)):
+            blocks.append(d)
+            n_frames += d.data.shape[2]
+            if (n_frames == 200):
+                break
+    finally:
+        writer.join(30)
+    assert writer.exitcode == 0
+    # The frames arrived while the file was written
+    assert len(blocks) > 1
+    data = _read_file(w7x_camera_synthetic.edicam_path(archive.datapath, EXP_ID))
+    assert np.array_equal(np.concatenate([d.data for d in blocks], axis=2), data)
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1',
+                                            options=archive.options)
+    for name in ['ETUTime', 'W7XTime', 'Sample']:
+        values = np.concatenate([block.get_coordinate_object(name).values for block in blocks])
+        assert np.array_equal(values, d.get_coordinate_object(name).values)
+    time_vec = np.concatenate([block.get_coordinate_object('Time').values for block in blocks])
+    assert np.allclose(time_vec, np.arange(200) * 0.01)
+    assert blocks[0].get_coordinate_object('Image x').start == 8
+
+    # Time range on the finished file, the generator stops after the range
+    time_coord = flap.Coordinate(name='Time', unit='Second', c_range=[0.5, 0.995])
+    blocks = list(flap_w7x_camera.w7x_camera_follow(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1',
+                                                    options=dict(archive.options, Timeout=30,
+                                                                 **{'Block size': 16}),
+                                                    coordinates=[time_coord]))
+    assert np.array_equal(np.concatenate([d.data for d in blocks], axis=2), data[:, :, 50:100])
+
+
+def test_add_coordinate(archive):
+    archive.edicam(rois={'ROIP1': (8, 21, 4, 16)}, n_frames=20)
+    sensor_x, sensor_y = np.meshgrid(np.arange(64), np.arange(32), indexing='ij')
+    grids = {'Device R': 5 + 0.01 * sensor_x, 'Device Z': -0.2 + 0.01 * sensor_y * sensor_x}
+    calibration_dir = archive.path('calibration')
+    os.makedirs(calibration_dir)
+    path = flap_w7x_camera.calibration_path(calibration_dir, 'AEQ20', 'EDICAM')
+    with h5py.File(path, 'w') as f:
+        for (name, grid) in grids.items():
+            f[name] = grid
+            f[name].attrs['Unit'] = 'm'
+    options = dict(archive.options, **{'Calibration path': calibration_dir})
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1', options=options)
+    d = flap_w7x_camera.add_coordinate(d, ['Device R', 'Device Z'], options=options)
+    c = d.get_coordinate_object('Device Z')
+    assert c.dimension_list == [0, 1]
+    assert c.unit.unit == 'm'
+    assert np.array_equal(c.values, grids['Device Z'][8:29, 4:20])
+    # The grids of a window are calculated once
+    d_2 = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1', options=options,
+                                              no_data=True)
+    flap_w7x_camera.add_coordinate(d_2, 'Device Z', options=options)
+    assert d_2.get_coordinate_object('Device Z').values is c.values
+
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1',
+                                            options=dict(options, Binning=[2, 4]))
+    flap_w7x_camera.add_coordinate(d, 'Device R', options=options)
+    assert np.allclose(d.get_coordinate_object('Device R').values,
+                       grids['Device R'][8:28, 4:20].reshape(10, 2, 4, 4).mean(axis=(1, 3)))
+    with pytest.raises(ValueError):
+        flap_w7x_camera.add_coordinate(d, 'Device phi', options=options)
+
+
+def test_correction(archive):
+    path = archive.edicam(rois={'ROIP1': (0, 16, 0, 8)}, n_frames=200, frame_rate=100.)
+    data = _read_file(path).astype(float)
+    rng = np.random.default_rng(1)
+    flat = rng.uniform(0.5, 1.5, (16, 8))
+    flat[3, 2] = 0
+    options = dict(archive.options, Dark=[0, 0.195], Flat=flat)
+    dark = data[:, :, :20].mean(axis=2)
+    gain = flat.mean() / np.where(flat > 0, flat, np.nan)
+    expected = (data - dark[:, :, np.newaxis]) * gain[:, :, np.newaxis]
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1', options=options)
+    assert d.data.dtype == np.float32
+    assert np.allclose(d.data, expected, rtol=1e-5, atol=1e-3, equal_nan=True)
+
+    # Binning and a window: the raw pixels are corrected before binning
+    coords = [flap.Coordinate(name='Time', unit='Second', c_range=[0.5, 0.995]),
+              flap.Coordinate(name='Image x', unit='Pixel', c_range=[4, 11])]
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1',
+                                            options=dict(options, Binning=2, Flat=None,
+                                                         **{'Correction dtype': 'float64'}),
+                                            coordinates=coords)
+    dark_corrected = data[4:12, :, 50:100] - dark[4:12, :, np.newaxis]
+    assert d.data.dtype == np.float64
+    assert np.allclose(d.data, dark_corrected.reshape(4, 2, 4, 2, 50).mean(axis=(1, 3)))
+
+    # Photron: the correction frames are in image orientation (flipped x)
+    path, time_fn = archive.photron(n_x=24, n_y=16, n_trig=2, frame_per_trig=100, rec_rate=1000.)
+    image = _read_file(path)[::-1].astype(float)
+    dark_file = archive.path('dark.npy')
+    np.save(dark_file, image[:, :, 0])
+    options = dict(archive.options, Dark=dark_file)
+    coords = [flap.Coordinate(name='Image x', unit='Pixel', c_range=[2, 9])]
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ21_PHOTRON_ROIP1',
+                                            options=options, coordinates=coords)
+    assert np.allclose(d.data, image[2:10] - image[2:10, :, :1])
+    blocks = list(flap_w7x_camera.w7x_camera_iter_data(exp_id=EXP_ID, data_name='AEQ21_PHOTRON_ROIP1',
+                                                       options=dict(options, **{'Block size': 30})))
+    assert np.allclose(np.concatenate([b.data for b in blocks], axis=2), image - image[:, :, :1])
+
+    with pytest.raises(ValueError):
+        flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ21_PHOTRON_ROIP1',
+                                            options=dict(options, Flat=np.ones((4, 4))))
+
+
+def test_concat(archive):
+    # Two EDICAM recordings, the second started 10 s after the first
+    paths = [archive.edicam(time=time, rois={'ROIP1': (0, 16, 0, 8)}, n_frames=100, frame_rate=100., seed=i,
+                            w7x_time_start=1539860000000000000 + i * 10000000000)
+             for i, time in enumerate(['123450', '123500'])]
+    data = [_read_file(path) for path in paths]
+    options = dict(archive.options, Time='All')
+    with pytest.raises(ValueError):
+        flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1',
+                                            options=archive.options)
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1', options=options)
+    assert np.array_equal(d.data, np.concatenate(data, axis=2))
+    time_vec = d.get_coordinate_object('Time').values
+    assert np.allclose(time_vec, np.concatenate([np.arange(100) * 0.01, 10 + np.arange(100) * 0.01]))
+    assert np.array_equal(d.get_coordinate_object('Sample').values, np.tile(np.arange(100), 2))
+    assert len(d.get_coordinate_object('W7XTime').values) == 200
+
+    # The read statistics of the recordings are added up and passed to the read hooks
+    hook_stats = []
+    flap_w7x_camera.add_read_hook(hook_stats.append)
+    try:
+        d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1',
+                                                options=dict(options, **{'Read stats': True}))
+    finally:
+        flap_w7x_camera.remove_read_hook(hook_stats.append)
+    stats = d.info['Read stats']
+    assert hook_stats == [stats]
+    assert stats['Bytes read'] == d.data.nbytes
+    assert stats['Read calls'] == 200
+    assert stats['Peak buffer'] == d.data.nbytes
+    assert stats['Path'] == paths[0]
+    assert stats['Recordings'] == paths
+    for stage in ['File resolution', 'Config parse', 'Time vector load', 'Frame selection',
+                  'HDF5 read', 'DataObject construction']:
+        assert stats['Stages'][stage] >= 0
+
+    # The first recording is not read, only its time vector for the time origin
+    flap_w7x_camera.close_camera_files()
+    time_coord = flap.Coordinate(name='Time', unit='Second', c_range=[10.5, 20])
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1', options=options,
+                                            coordinates=[time_coord])
+    assert np.array_equal(d.data, data[1][:, :, 50:])
+    assert [r['Path'] for r in d.info['Recordings']] == [paths[1]]
+    assert d.get_coordinate_object('Time').mode.equidistant
+    assert np.isclose(d.get_coordinate_object('Time').start, 10.5)
+
+    # Recordings outside the time range are not opened
+    flap_w7x_camera.close_camera_files()
+    time_coord = flap.Coordinate(name='Time', unit='Second', c_range=[0.1, 0.5])
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1', options=options,
+                                            coordinates=[time_coord])
+    assert np.array_equal(d.data, data[0][:, :, 10:51])
+    assert os.path.abspath(paths[1]) not in flap_w7x_camera._file_pool.open_files()
+
+    # Photron recordings of two trigger groups
+    photron = [archive.photron(time=time, n_x=8, n_y=4, n_trig=1, frame_per_trig=50, rec_rate=1000.,
+                               t_first=t_first, seed=i)
+               for i, (time, t_first) in enumerate([('123450', 1.), ('123455', 3.)])]
+    options = dict(archive.options, Time='All', Workers=2)
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ21_PHOTRON_ROIP1', options=options)
+    assert np.array_equal(d.data, np.concatenate([_read_file(path)[::-1] for path, time_fn in photron], axis=2))
+    assert np.allclose(d.get_coordinate_object('Time').values,
+                       np.concatenate([1 + np.arange(50) * 1e-3, 3 + np.arange(50) * 1e-3]))
+    time_coord = flap.Coordinate(name='Time', unit='Second', c_range=[3.01, 4])
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ21_PHOTRON_ROIP1', options=options,
+                                            coordinates=[time_coord])
+    assert d.data.shape == (8, 4, 40)
+    assert len(d.info['Recordings']) == 1
+
+
+def test_camera_settings(archive, caplog):
+    path = archive.edicam(rois={'ROIP1': (8, 32, 4, 16)}, n_frames=10, frame_rate=100.)
+    settings = flap_w7x_camera.read_camera_settings(path, 'ROIP1')
+    assert flap_w7x_camera.read_camera_settings(path, 'ROIP1') is settings
+    assert (settings['X Start'], settings['X Len'], settings['Y Start'], settings['Y Len']) == (8, 32, 4, 16)
+    assert settings['Clock']['PLL mult'] == 10
+    assert np.isclose(settings['Exposure Settings']['Frame rate'], 100.)
+    # The other groups are read at their first use
+    assert 'Sensor Settings' not in repr(settings).split('lazy')[0]
+    assert settings['Sensor Settings'] == {'Bit depth': 12}
+    assert settings['Event']['Event1']['Action1'] == {'Type': 0}
+    restored = pickle.loads(pickle.dumps(settings))
+    assert dict(restored) == json.loads(json.dumps(dict(settings)))
+
+    # Without the Settings group the settings are empty, the ASCII
+    # settings files are not supported
+    flap_w7x_camera.close_camera_files()
+    with h5py.File(path, 'a') as f:
+        del f['Settings']
+    with caplog.at_level('WARNING', logger=flap_w7x_camera.logger.name):
+        settings = flap_w7x_camera.read_camera_settings(path, 'ROIP1')
+    assert len(settings) == 0
+    assert 'ASCII' in caplog.text
+
+
+def test_shot_index(archive, monkeypatch):
+    datapath = archive.datapath
+    index_path = archive.path('index')
+    path = archive.edicam(rois={'ROIP1': (0, 8, 0, 4)}, n_frames=10)
+    monkeypatch.setattr(flap_w7x_camera, '_shot_index', {})
+    monkeypatch.setattr(flap_w7x_camera, '_shot_index_mtimes', {})
+    assert flap_w7x_camera.w7x_camera_build_index(datapath, index_path=index_path) == 1
+    assert len(os.listdir(index_path)) == 1
+
+    # A new process: the index is loaded from the file, the directory is not listed
+    monkeypatch.setattr(flap_w7x_camera, '_shot_index', {})
+    monkeypatch.setattr(flap_w7x_camera, '_shot_index_mtimes', {})
+    monkeypatch.chdir(archive.tmp_dir)
+    options = {'Datapath': 'data', 'Index path': index_path}
+    with monkeypatch.context() as m:
+        def no_listdir(dp):
+            raise AssertionError("Listing " + dp)
+        m.setattr(flap_w7x_camera.os, 'listdir', no_listdir)
+        path_found = flap_w7x_camera.find_recording(EXP_ID, 'AEQ20_EDICAM_ROIP1', dict(options, Time=None))[0]
+        assert path_found == os.path.relpath(path, archive.tmp_dir)
+    # The relative and the absolute path of the directory share the entry
+    flap_w7x_camera.find_recording(EXP_ID, 'AEQ20_EDICAM_ROIP1',
+                                   {'Datapath': datapath, 'Index path': index_path, 'Time': None})
+    assert list(flap_w7x_camera._shot_index.keys()) == [os.path.dirname(path)]
+
+    # A new file changes the directory modification time, the directory is listed again
+    os.utime(os.path.dirname(path), ns=(0, 0))
+    path_013 = archive.edicam('20181018.013', rois={'ROIP1': (0, 8, 0, 4)}, n_frames=10)
+    path_found = flap_w7x_camera.find_recording('20181018.013', 'AEQ20_EDICAM_ROIP1', dict(options, Time=None))[0]
+    assert path_found == os.path.relpath(path_013, archive.tmp_dir)
+    with open(flap_w7x_camera._index_file(index_path, os.path.dirname(path))) as f:
+        assert len(json.load(f)['Entry']['Files']) == 2
+
+    # A file without experiment number is found with its time stamp
+    path_014 = archive.edicam('20181018.014', time='101010', rois={'ROIP1': (0, 8, 0, 4)}, n_frames=10)
+    os.rename(path_014, path_014.replace('_014_', '_'))
+    assert flap_w7x_camera.find_recording('20181018.014', 'AEQ20_EDICAM_ROIP1',
+                                          dict(options, Time='101010'))[1] == '101010'
+    with pytest.raises(ValueError):
+        flap_w7x_camera.find_recording('20181018.014', 'AEQ20_EDICAM_ROIP1', dict(options, Time=None))
+
+    # The dataset shape and dtype are taken from the index while the file is not modified
+    h5_path = '/ROIP/ROIP1/ROIP1Data'
+    assert flap_w7x_camera.indexed_dataset_info(path, h5_path, index_path=index_path) == ((8, 4, 10), np.uint16)
+    with open(flap_w7x_camera._index_file(index_path, os.path.dirname(path))) as f:
+        file_entry = json.load(f)['Entry']['Files'][os.path.basename(path)]
+    assert file_entry['Mtime'] == os.stat(path).st_mtime_ns
+    assert file_entry['Datasets'][h5_path] == {'Shape': [8, 4, 10], 'Dtype': '<u2'}
+    monkeypatch.setattr(flap_w7x_camera, '_shot_index', {})
+    monkeypatch.setattr(flap_w7x_camera, '_shot_index_mtimes', {})
+    with monkeypatch.context() as m:
+        def no_dataset_info(path, h5_path):
+            raise AssertionError("Opening " + path)
+        m.setattr(flap_w7x_camera, 'dataset_info', no_dataset_info)
+        d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1',
+                                                options=dict(options, Time=None), no_data=True)
+        assert d.shape == (8, 4, 10)
+    # A modified file is opened again
+    flap_w7x_camera.close_camera_files()
+    path = archive.edicam(rois={'ROIP1': (0, 8, 0, 4)}, n_frames=12)
+    os.utime(path, ns=(0, 0))
+    d = flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name='AEQ20_EDICAM_ROIP1',
+                                            options=dict(options, Time=None), no_data=True)
+    assert d.shape == (8, 4, 12)
+    assert flap_w7x_camera.indexed_dataset_info(path, h5_path, index_path=index_path) == ((8, 4, 12), np.uint16)
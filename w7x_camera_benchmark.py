@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Read throughput benchmark of the W7-X camera flap module on synthetic
+recordings (see w7x_camera_synthetic).
+
+    python w7x_camera_benchmark.py [--dir DIR] [--frames N] [--size NX NY]
+                                   [--chunks frame|none|N] [--repeat N]
+
+For each camera it reports the frames/s, MB/s and the peak memory allocated
+during the read for
+    full:    w7x_camera_get_data() of the whole recording
+    window:  w7x_camera_get_data() of the middle half of the first trigger
+             (EDICAM: of the recording) with a Time coordinate
+    sparse:  read_hdf5_arr() of 10% of the frames at random positions
+    no_data: w7x_camera_get_data() with no_data=True
+The files are read repeatedly so they are in the page cache, the results
+show the processing speed of the module, not the disk speed.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import flap
+import flap_w7x_camera
+import w7x_camera_synthetic
+
+EXP_ID = '20181018.012'
+
+
+def write_recordings(directory, n_frames=1000, n_x=256, n_y=256, chunks='frame'):
+    """
+    Writes one EDICAM and one Photron test recording into directory and returns
+    the options to read them.
+    """
+    datapath = os.path.join(directory, 'data')
+    timing_path = os.path.join(directory, 'timing')
+    w7x_camera_synthetic.write_edicam(datapath, EXP_ID, rois={'ROIP1': (0, n_x, 0, n_y)},
+                                      n_frames=n_frames, frame_rate=100., chunks=chunks)
+    w7x_camera_synthetic.write_photron(datapath, timing_path, EXP_ID, n_x=n_x, n_y=n_y,
+                                       n_trig=2, frame_per_trig=n_frames // 2,
+                                       rec_rate=10000., chunks=chunks)
+    return {'Datapath': datapath, 'Timing path': timing_path}
+
+
+def measure(func, repeat=3):
+    """
+    Calls func repeat times and returns the result, the best time [s] and the
+    peak memory allocated during one call [bytes].
+    """
+    best = None
+    for i in range(repeat):
+        t_start = time.perf_counter()
+        result = func()
+        dt = time.perf_counter() - t_start
+        if ((best is None) or (dt < best)):
+            best = dt
+        del result
+    tracemalloc.start()
+    try:
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, best, peak
+
+
+def benchmark_cases(options, n_frames):
+    """
+    Returns the benchmark cases as (camera, case, function) tuples. The functions
+    return the data array (or the DataObject for no_data).
+    """
+    cases = []
+    fpt = n_frames // 2
+    windows = {'EDICAM': [0.25 * n_frames / 100., 0.75 * n_frames / 100.],
+               'PHOTRON': [1. + 0.25 * fpt / 10000., 1. + 0.75 * fpt / 10000.]}
+    ports = {'EDICAM': 'AEQ20', 'PHOTRON': 'AEQ21'}
+    rng = np.random.default_rng(0)
+    for camera in ['EDICAM', 'PHOTRON']:
+        data_name = '{}_{}_ROIP1'.format(ports[camera], camera)
+
+        def full(data_name=data_name):
+            return flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name,
+                                                       options=options).data
+
+        def window(data_name=data_name, camera=camera):
+            coord = flap.Coordinate(name='Time', unit='Second', c_range=windows[camera])
+            return flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name,
+                                                       options=options, coordinates=[coord]).data
+
+        plan = flap_w7x_camera.w7x_camera_read_plan(exp_id=EXP_ID, data_name=data_name, options=options)
+        frame_vec = np.sort(rng.choice(plan['Dims'][2], plan['Dims'][2] // 10, replace=False))
+
+        def sparse(plan=plan, frame_vec=frame_vec):
+            h5_obj, h5_data = flap_w7x_camera.open_dataset(plan['Path'], plan['HDF5 path'])
+            try:
+                return flap_w7x_camera.read_hdf5_arr(h5_data, plan['x'], plan['y'], frame_vec)
+            finally:
+                h5_data.close()
+                h5_obj.close()
+
+        def no_data(data_name=data_name):
+            return flap_w7x_camera.w7x_camera_get_data(exp_id=EXP_ID, data_name=data_name,
+                                                       options=options, no_data=True)
+
+        cases.extend([(camera, 'full', full),
+                      (camera, 'window', window),
+                      (camera, 'sparse', sparse),
+                      (camera, 'no_data', no_data)])
+    return cases
+
+
+def run_benchmark(directory, n_frames=1000, n_x=256, n_y=256, chunks='frame', repeat=3):
+    """
+    Writes the test recordings into directory and runs the benchmark cases.
+    Returns a list of dictionaries with 'Camera', 'Case', 'Frames', 'Bytes',
+    'Time' [s], 'Frames/s', 'MB/s' and 'Peak memory' [bytes].
+    For no_data the frames and bytes are those of the described data,
+    nothing is read.
+    """
+    options = write_recordings(directory, n_frames=n_frames, n_x=n_x, n_y=n_y, chunks=chunks)
+    results = []
+    for (camera, case, func) in benchmark_cases(options, n_frames):
+        result, dt, peak = measure(func, repeat=repeat)
+        shape = result.shape
+        if (case == 'no_data'):
+            n_bytes = int(np.prod(shape)) * np.dtype(np.uint16).itemsize
+        else:
+            n_bytes = result.nbytes
+        results.append({'Camera': camera,
+                        'Case': case,
+                        'Frames': shape[2],
+                        'Bytes': n_bytes,
+                        'Time': dt,
+                        'Frames/s': shape[2] / dt,
+                        'MB/s': n_bytes / 1024**2 / dt,
+                        'Peak memory': peak})
+    return results
+
+
+def print_results(results):
+    print("{:8s} {:8s} {:>7s} {:>10s} {:>12s} {:>10s} {:>12s}".format(
+          'Camera', 'Case', 'Frames', 'Time [ms]', 'Frames/s', 'MB/s', 'Peak [MB]'))
+    for r in results:
+        print("{:8s} {:8s} {:7d} {:10.2f} {:12.0f} {:10.0f} {:12.1f}".format(
+              r['Camera'], r['Case'], r['Frames'], r['Time'] * 1000, r['Frames/s'],
+              r['MB/s'], r['Peak memory'] / 1024**2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="W7-X camera read benchmark on synthetic files.")
+    parser.add_argument('--dir', default=None,
+                        help="Directory for the test files. Default is a temporary directory.")
+    parser.add_argument('--frames', type=int, default=1000, help="Number of frames.")
+    parser.add_argument('--size', type=int, nargs=2, default=[256, 256], help="Image size (x, y).")
+    parser.add_argument('--chunks', default='frame',
+                        help="'frame' (one frame per chunk), 'none' (contiguous) or the number of frames per chunk.")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of timed reads.")
+    args = parser.parse_args(argv)
+    if (args.chunks == 'frame'):
+        chunks = 'frame'
+    elif (args.chunks == 'none'):
+        chunks = None
+    else:
+        chunks = (args.size[0], args.size[1], int(args.chunks))
+    if (args.dir is None):
+        with tempfile.TemporaryDirectory() as directory:
+            results = run_benchmark(directory, n_frames=args.frames, n_x=args.size[0], n_y=args.size[1],
+                                    chunks=chunks, repeat=args.repeat)
+    else:
+        results = run_benchmark(args.dir, n_frames=args.frames, n_x=args.size[0], n_y=args.size[1],
+                                chunks=chunks, repeat=args.repeat)
+    print_results(results)
+
+
+if __name__ == '__main__':
+    main()
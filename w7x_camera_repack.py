@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Converts W7-X camera recordings into stores for time series access
+(see flap_w7x_camera.w7x_camera_repack()).
+
+    python w7x_camera_repack.py EXP_ID DATA_NAME [DATA_NAME ...]
+                                [--datapath DIR] [--timing-path DIR]
+                                [--repack-path DIR] [--compression lzf|gzip|none]
+                                [--overwrite]
+
+EXP_ID is YYYYMMDD.nnn, DATA_NAME is <PORT>_<CAMERA>_<ROI>, e.g. AEQ20_EDICAM_ROIP1.
+Options not given on the command line are taken from the flap configuration.
+After the conversion w7x_camera_get_data() reads the store instead of the
+recording.
+"""
+
+import argparse
+import os
+import time
+
+import flap_w7x_camera
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Repack W7-X camera recordings for time series access.")
+    parser.add_argument('exp_id', help="Experiment ID, YYYYMMDD.nnn")
+    parser.add_argument('data_name', nargs='+', help="<PORT>_<CAMERA>_<ROI>, e.g. AEQ20_EDICAM_ROIP1")
+    parser.add_argument('--datapath', default=None, help="Directory of the recordings.")
+    parser.add_argument('--timing-path', default=None, help="Directory of the Photron timing files.")
+    parser.add_argument('--repack-path', default=None,
+                        help="Directory of the stores. Default is next to the recordings.")
+    parser.add_argument('--compression', default=None, choices=['lzf', 'gzip', 'none'],
+                        help="Compression of the stores. Default is lzf.")
+    parser.add_argument('--overwrite', action='store_true', help="Write the stores even if they are up to date.")
+    args = parser.parse_args(argv)
+    options = {'Overwrite': args.overwrite}
+    if (args.datapath is not None):
+        options['Datapath'] = args.datapath
+    if (args.timing_path is not None):
+        options['Timing path'] = args.timing_path
+    if (args.repack_path is not None):
+        options['Repack path'] = args.repack_path
+    if (args.compression == 'none'):
+        options['Compression'] = None
+    elif (args.compression is not None):
+        options['Compression'] = args.compression
+    for data_name in args.data_name:
+        t_start = time.perf_counter()
+        store_path = flap_w7x_camera.w7x_camera_repack(exp_id=args.exp_id, data_name=data_name, options=options)
+        print("{:s}: {:s} ({:.1f} MB, {:.1f} s)".format(data_name, store_path,
+                                                         os.path.getsize(store_path) / 1024**2,
+                                                         time.perf_counter() - t_start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic EDICAM and Photron recordings for testing and benchmarking the
+W7-X camera flap module without access to the W7-X archive.
+
+The files follow the layout read by flap_w7x_camera:
+    <Datapath>/EDICAM/<PORT>/<date>/<port>_edi_<date>_<expnum>_<time>.h5
+    <Datapath>/PHOTRON/<PORT>/<date>/<port>_phot_<date>_<expnum>_<time>.h5
+    <Timing path>/<date>/<port>_phot_<date>_<time>_integ_v1.sav
+"""
+
+import os
+import struct
+import time as time_module
+
+import numpy as np
+import h5py
+
+
+def _frames(n_x, n_y, n_frames, i_start, dtype, seed):
+    """
+    Returns frames i_start... of a reproducible test movie: a moving blob
+    over a pixel dependent background and noise.
+    """
+    rng = np.random.default_rng(seed + i_start)
+    x = np.arange(n_x)[:, None, None]
+    y = np.arange(n_y)[None, :, None]
+    t = np.arange(i_start, i_start + n_frames)[None, None, :]
+    blob = 1000 * np.exp(-((x - n_x / 2 * (1 + 0.5 * np.sin(t / 50))) ** 2 + (y - n_y / 2) ** 2) / (0.05 * n_x * n_y + 1))
+    background = 100 + (x + y) % 16
+    data = background + blob + rng.normal(0, 10, size=(n_x, n_y, n_frames))
+    return np.clip(data, 0, np.iinfo(dtype).max).astype(dtype)
+
+
+def _write_movie(dataset, seed, block_frames=256):
+    n_x, n_y, n_frames = dataset.shape
+    for i_start in range(0, n_frames, block_frames):
+        n = min(block_frames, n_frames - i_start)
+        dataset[:, :, i_start:i_start + n] = _frames(n_x, n_y, n, i_start, dataset.dtype, seed)
+
+
+def edicam_path(datapath, exp_id, port='AEQ20', time='123456'):
+    date, exp_num = exp_id.split('.')
+    return os.path.join(datapath, 'EDICAM', port.upper(), date,
+                        "_".join([port.lower(), 'edi', date, exp_num, time + '.h5']))
+
+
+def photron_path(datapath, exp_id, port='AEQ21', time='123456'):
+    date, exp_num = exp_id.split('.')
+    return os.path.join(datapath, 'PHOTRON', port.upper(), date,
+                        "_".join([port.lower(), 'phot', date, exp_num, time + '.h5']))
+
+
+def photron_timing_path(timing_path, exp_id, port='AEQ21', time='123456'):
+    date = exp_id.split('.')[0]
+    return os.path.join(timing_path, date,
+                        "_".join([port.lower(), 'phot', date, time, 'integ', 'v1.sav']))
+
+
+def _write_edicam_settings(f, rois, frame_rate):
+    settings = f.create_group('Settings')
+    clock = settings.create_group('Clock')
+    clock['Auto int'] = np.array([1], dtype=np.uint8)
+    clock['Clk pol'] = np.array([0], dtype=np.uint8)
+    clock['Enable'] = np.array([1], dtype=np.uint8)
+    clock['PLL div'] = np.array([1], dtype=np.uint16)
+    clock['PLL mult'] = np.array([10], dtype=np.uint16)
+    clock['Quality'] = np.array([1], dtype=np.uint8)
+    action = settings.create_group('Event/Event1/Action1')
+    action['Type'] = np.array([0], dtype=np.uint8)
+    exposure = settings.create_group('Exposure Settings')
+    exposure['Exposure time'] = np.array([1.e6 / frame_rate * 0.9])
+    exposure['Frame rate'] = np.array([frame_rate])
+    settings.create_group('Image Processing Settings')['Gain'] = np.array([1], dtype=np.uint8)
+    settings.create_group('Sensor Control')['Mode'] = np.array([0], dtype=np.uint8)
+    settings.create_group('Sensor Settings')['Bit depth'] = np.array([12], dtype=np.uint8)
+    for (roi, (x_start, x_len, y_start, y_len)) in rois.items():
+        roi_settings = settings.create_group('ROIP/' + roi)
+        roi_settings['X Start'] = np.array([x_start], dtype=np.uint16)
+        roi_settings['X Len'] = np.array([x_len], dtype=np.uint16)
+        roi_settings['Y Start'] = np.array([y_start], dtype=np.uint16)
+        roi_settings['Y Len'] = np.array([y_len], dtype=np.uint16)
+
+
+def _edicam_times(i_start, n_frames, frame_rate, w7x_time_start):
+    """
+    Returns the W7-X time [ns] and ETU time [100 ns] of frames i_start...
+    """
+    w7x_time = w7x_time_start + np.round(np.arange(i_start, i_start + n_frames) * 1.e9 / frame_rate).astype(np.int64)
+    etu = np.round((w7x_time - w7x_time_start) / 100).astype(np.uint64) + 1000
+    return w7x_time, etu
+
+
+def write_edicam(datapath, exp_id, port='AEQ20', time='123456', rois=None,
+                 n_frames=1000, frame_rate=100., w7x_time_start=1539860000000000000,
+                 chunks='frame', dtype=np.uint16, seed=0):
+    """
+    Writes a synthetic EDICAM recording and returns its path.
+    rois: Dictionary {'ROIP1': (X Start, X Len, Y Start, Y Len), ...}
+          Default is one 64x64 ROI.
+    chunks: 'frame' (one frame per chunk, as the camera writes), None (contiguous)
+            or a chunk shape tuple.
+    """
+    if (rois is None):
+        rois = {'ROIP1': (0, 64, 0, 64)}
+    path = edicam_path(datapath, exp_id, port=port, time=time)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with h5py.File(path, 'w') as f:
+        _write_edicam_settings(f, rois, frame_rate)
+        w7x_time, etu = _edicam_times(0, n_frames, frame_rate, w7x_time_start)
+        for i_roi, (roi, (x_start, x_len, y_start, y_len)) in enumerate(rois.items()):
+            if (chunks == 'frame'):
+                _chunks = (x_len, y_len, 1)
+            else:
+                _chunks = chunks
+            roi_group = f.create_group('ROIP/' + roi)
+            data = roi_group.create_dataset(roi + 'Data', shape=(x_len, y_len, n_frames),
+                                            dtype=dtype, chunks=_chunks)
+            _write_movie(data, seed + i_roi)
+            roi_group[roi + 'ETU'] = etu
+            roi_group[roi + 'W7XTime'] = w7x_time
+    return path
+
+
+def write_edicam_swmr(datapath, exp_id, port='AEQ20', time='123456', roi='ROIP1', roi_window=(0, 64, 0, 64),
+                      n_frames=100, batch_frames=10, interval=0.05, frame_rate=100.,
+                      w7x_time_start=1539860000000000000, dtype=np.uint16, seed=0, ready=None):
+    """
+    Writes a synthetic EDICAM recording the way the camera does during a discharge:
+    the file is written in HDF5 SWMR mode and batch_frames frames are appended
+    every interval seconds. The frames are the same as those of write_edicam().
+    ready: An object with a set() method (e.g. multiprocessing.Event) which is
+           called when the file can be opened for reading.
+    Returns the path of the file.
+    """
+    path = edicam_path(datapath, exp_id, port=port, time=time)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    (x_start, x_len, y_start, y_len) = roi_window
+    with h5py.File(path, 'w', libver='latest') as f:
+        _write_edicam_settings(f, {roi: roi_window}, frame_rate)
+        roi_group = f.create_group('ROIP/' + roi)
+        data = roi_group.create_dataset(roi + 'Data', shape=(x_len, y_len, 0), maxshape=(x_len, y_len, None),
+                                        dtype=dtype, chunks=(x_len, y_len, 1))
+        etu_data = roi_group.create_dataset(roi + 'ETU', shape=(0,), maxshape=(None,), dtype=np.uint64,
+                                            chunks=(1024,))
+        w7x_data = roi_group.create_dataset(roi + 'W7XTime', shape=(0,), maxshape=(None,), dtype=np.int64,
+                                            chunks=(1024,))
+        f.swmr_mode = True
+        if (ready is not None):
+            ready.set()
+        for i_start in range(0, n_frames, batch_frames):
+            n = min(batch_frames, n_frames - i_start)
+            # The frames are written before their time stamps
+            data.resize(i_start + n, axis=2)
+            data[:, :, i_start:i_start + n] = _frames(x_len, y_len, n, i_start, dtype, seed)
+            data.flush()
+            w7x_time, etu = _edicam_times(i_start, n, frame_rate, w7x_time_start)
+            for (dataset, values) in [(etu_data, etu), (w7x_data, w7x_time)]:
+                dataset.resize(i_start + n, axis=0)
+                dataset[i_start:i_start + n] = values
+                dataset.flush()
+            time_module.sleep(interval)
+    return path
+
+
+def _idl_string(s):
+    b = s.encode('latin1')
+    return struct.pack('>l', len(b)) + b + b'\x00' * (-len(b) % 4)
+
+
+def _idl_array_desc(n_elements, itemsize):
+    return (struct.pack('>lllll', 8, 0, n_elements * itemsize, n_elements, 1)
+            + struct.pack('>ll', 0, 0)
+            + struct.pack('>l', 8)
+            + struct.pack('>8l', n_elements, 1, 1, 1, 1, 1, 1, 1))
+
+
+# IDL type codes and big endian numpy types of the supported tag values
+_IDL_TYPES = {3: '>i4', 5: '>f8'}
+
+
+def _idl_tag(value):
+    """
+    Returns (typecode, is_array, is_structure, value) for a structure tag value.
+    Integers are written as LONG, floats as DOUBLE, lists of (name, value)
+    as nested structures.
+    """
+    if (type(value) is list):
+        return 8, True, True, value
+    value = np.asarray(value)
+    if (np.issubdtype(value.dtype, np.integer)):
+        typecode = 3
+    else:
+        typecode = 5
+    return typecode, value.ndim > 0, False, value
+
+
+def _idl_struct_desc(name, tags):
+    desc = struct.pack('>l', 9) + _idl_string(name) + struct.pack('>lll', 0, len(tags), 0)
+    parsed = [(tag_name,) + _idl_tag(value) for (tag_name, value) in tags]
+    for (tag_name, typecode, is_array, is_structure, value) in parsed:
+        flags = (4 if is_array else 0) | (32 if is_structure else 0)
+        desc += struct.pack('>lll', 0, typecode, flags)
+    for (tag_name, typecode, is_array, is_structure, value) in parsed:
+        desc += _idl_string(tag_name.upper())
+    for (tag_name, typecode, is_array, is_structure, value) in parsed:
+        if (is_structure):
+            desc += _idl_array_desc(1, 0)
+        elif (is_array):
+            desc += _idl_array_desc(value.size, np.dtype(_IDL_TYPES[typecode]).itemsize)
+    for (tag_name, typecode, is_array, is_structure, value) in parsed:
+        if (is_structure):
+            desc += _idl_struct_desc(name + '_' + tag_name.upper(), value)
+    return desc
+
+
+def _idl_struct_data(tags):
+    data = b''
+    for (tag_name, value) in tags:
+        typecode, is_array, is_structure, value = _idl_tag(value)
+        if (is_structure):
+            data += _idl_struct_data(value)
+        else:
+            data += value.astype(_IDL_TYPES[typecode]).tobytes()
+    return data
+
+
+def write_idl_struct_sav(path, var_name, tags):
+    """
+    Writes an IDL save file (readable with scipy.io.readsav) containing one
+    variable which is a one element structure.
+    tags: list of (name, value) tuples, value is an integer or float scalar or
+          1D array or a list of (name, value) tuples for a nested structure.
+    """
+    payload = (_idl_string(var_name.upper())
+               + struct.pack('>ll', 8, 36)
+               + _idl_array_desc(1, 0)
+               + _idl_struct_desc(var_name.upper(), tags)
+               + struct.pack('>l', 7)
+               + _idl_struct_data(tags))
+    with open(path, 'wb') as f:
+        f.write(b'SR\x00\x04')
+        start = f.tell()
+        next_rec = start + 16 + len(payload)
+        f.write(struct.pack('>lIII', 2, next_rec, 0, 0))
+        f.write(payload)
+        f.write(struct.pack('>lIII', 6, next_rec + 16, 0, 0))
+
+
+def write_photron(datapath, timing_path, exp_id, port='AEQ21', time='123456',
+                  n_x=64, n_y=64, x_pos=0, y_pos=0, n_trig=2, frame_per_trig=500,
+                  rec_rate=10000., trig_period=1., t_first=1., chunks='frame',
+                  dtype=np.uint16, seed=0):
+    """
+    Writes a synthetic Photron recording with its IDL timing file.
+    The camera records frame_per_trig frames at rec_rate after each of n_trig
+    triggers, the triggers are trig_period apart starting at t_first.
+    Returns the paths of the HDF5 and the timing file.
+    """
+    path = photron_path(datapath, exp_id, port=port, time=time)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    n_frames = n_trig * frame_per_trig
+    if (chunks == 'frame'):
+        chunks = (n_x, n_y, 1)
+    with h5py.File(path, 'w') as f:
+        settings = f.create_group('Settings')
+        settings['X pos'] = np.array([x_pos], dtype=np.uint16)
+        settings['Y pos'] = np.array([y_pos], dtype=np.uint16)
+        data = f.create_dataset('ROIP/ROIP1/ROIP1Data', shape=(n_x, n_y, n_frames),
+                                dtype=dtype, chunks=chunks)
+        _write_movie(data, seed)
+
+    time_vec = (t_first + np.repeat(np.arange(n_trig) * trig_period, frame_per_trig)
+                + np.tile(np.arange(frame_per_trig) / rec_rate, n_trig))
+    time_fn = photron_timing_path(timing_path, exp_id, port=port, time=time)
+    os.makedirs(os.path.dirname(time_fn), exist_ok=True)
+    # resa[0][4] is the time vector, resa[0][15] the recording settings
+    tags = [('TAG{:d}'.format(i), 0) for i in range(4)]
+    tags.append(('TIME', time_vec))
+    tags.extend([('TAG{:d}'.format(i), 0) for i in range(5, 15)])
+    tags.append(('SETTINGS', [('FRAME_PER_TRIG', frame_per_trig), ('REC_RATE', float(rec_rate))]))
+    write_idl_struct_sav(time_fn, 'resa', tags)
+    return path, time_fn